@@ -0,0 +1,85 @@
+"""
+Per-feature overhead of RasterDataset.Clip, comparing the previous one-shapefile-per-feature cutlines against the
+shared in-memory cutline layer.
+
+    python -m benchmarks.clip [--features 500] [--workers 4]
+"""
+import argparse
+import uuid
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from benchmarks.common import timed, print_table
+from cognition.pygdal.raster import RasterDataset
+from cognition.pygdal.vector import Vector
+from cognition.pygdal.geometry import boundsToWkb
+from cognition.pygdal.config import pygdal_config
+
+
+def synthetic_raster(size=4096, res=10.0):
+    ds = gdal.GetDriverByName('GTiff').Create('/vsimem/bench_clip/{}.tif'.format(uuid.uuid4().hex), size, size, 1,
+                                              gdal.GDT_UInt16, options=['TILED=YES'])
+    ds.SetGeoTransform((500000.0, res, 0.0, 4000000.0, 0.0, -res))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32611)
+    ds.SetProjection(srs.ExportToWkt())
+    ds.GetRasterBand(1).Fill(100)
+    ds.FlushCache()
+    return RasterDataset(ds)
+
+
+def random_features(raster, count, size=500.0, seed=0):
+    rng = np.random.RandomState(seed)
+    extent = raster.extent
+    x = rng.uniform(extent[0], extent[1] - size, count)
+    y = rng.uniform(extent[2], extent[3] - size, count)
+    ds = ogr.GetDriverByName('Memory').CreateDataSource('features')
+    lyr = ds.CreateLayer('features', raster.srs.srs, ogr.wkbPolygon)
+    for wkb in boundsToWkb(np.stack([x, x + size, y, y + size], axis=1)):
+        feat = ogr.Feature(lyr.GetLayerDefn())
+        feat.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+        lyr.CreateFeature(feat)
+    return Vector(ds)
+
+
+def legacy_clip(raster, vector):
+    """The previous implementation: one ESRI Shapefile per feature, reopened by gdal.Warp"""
+    out = []
+    for feat in vector.lyr:
+        fname = pygdal_config.tempfiles.gen_file('shp', 'clippers', uuid.uuid4().hex)
+        shp = ogr.GetDriverByName('ESRI Shapefile').CreateDataSource(fname)
+        lyr = shp.CreateLayer(fname, raster.srs.srs)
+        out_feat = ogr.Feature(lyr.GetLayerDefn())
+        out_feat.SetGeometry(feat.GetGeometryRef())
+        lyr.CreateFeature(out_feat)
+        lyr = None
+        shp = None
+        clip = '/vsimem/bench_clip/{}.vrt'.format(uuid.uuid4().hex)
+        gdal.Warp(clip, raster.ds, cutlineDSName=fname, cropToCutline=True, format='VRT')
+        out.append(clip)
+    vector.lyr.ResetReading()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--features', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    raster = synthetic_raster()
+    vector = random_features(raster, args.features)
+    vector.spatial_index()
+
+    rows = []
+    for name, func in [('shapefile per feature', lambda: legacy_clip(raster, vector)),
+                       ('in-memory cutline layer', lambda: raster.Clip(vector)),
+                       ('in-memory, {} workers'.format(args.workers), lambda: raster.Clip(vector, workers=args.workers))]:
+        seconds = timed(func, repeat=1)
+        rows.append({'method': name, 'features': args.features, 'total_s': seconds,
+                     'per_feature_ms': seconds / args.features * 1000})
+    print_table(rows, ['method', 'features', 'total_s', 'per_feature_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+Write time, file size and read performance of Cogify across a matrix of COG profiles (compression, predictor,
+level and blocksize), on synthetic rasters and optional sample rasters.  Outputs are read back from local disk and,
+when an endpoint is given, from an S3 compatible stand-in (ex. MinIO) through /vsis3/.  Every row is also appended as
+JSON to `--output` with the run's metadata so results can be compared between runs.
+
+    python -m benchmarks.cog [--size 2048] [--sample scene.tif ...] [--s3-endpoint localhost:9000 --bucket bench]
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+import numpy as np
+import boto3
+from osgeo import gdal, osr
+
+from benchmarks.common import timed, print_table
+from cognition.pygdal.raster import RasterDataset
+from cognition.cog.profiles import COGBase, available_codecs
+
+
+columns = ['raster', 'compression', 'predictor', 'zlevel', 'blocksize', 'write_s', 'size_mb', 'ratio', 'storage',
+           'tile_ms_p50', 'tile_ms_p95', 'window_mb_per_s']
+
+
+def make_profile(compression, predictor, zlevel, blocksize):
+    class BenchmarkCOG(COGBase):
+        compress_full_resolution = True
+
+        def __init__(self, ds):
+            COGBase.__init__(self, ds)
+            self.compression = compression
+            self.predictor = predictor
+            self.zlevel = zlevel
+            self.blocksize = blocksize
+    return BenchmarkCOG
+
+
+def synthetic_rasters(size, res=30.0):
+    """Smooth UInt16, noisy Byte and smooth Float32 rasters, the kinds of data which favour different codecs"""
+    y, x = np.mgrid[0:size, 0:size]
+    smooth = np.sin(x / 50.0) * np.cos(y / 70.0)
+    noise = np.random.RandomState(0).normal(size=(size, size))
+    arrays = {
+        'smooth_uint16': (1000 + 500 * smooth).astype('uint16'),
+        'noisy_byte': np.clip(128 + 40 * smooth + 20 * noise, 0, 255).astype('uint8'),
+        'smooth_float32': (smooth * 10 + 0.01 * noise).astype('float32'),
+    }
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32611)
+    rasters = {}
+    for name, array in arrays.items():
+        ds = gdal.GetDriverByName('MEM').Create(name, size, size, 1, gdal_type(array.dtype))
+        ds.SetGeoTransform((500000.0, res, 0.0, 4000000.0, 0.0, -res))
+        ds.SetProjection(srs.ExportToWkt())
+        ds.GetRasterBand(1).WriteArray(array)
+        rasters[name] = RasterDataset(ds)
+    return rasters
+
+
+def gdal_type(dtype):
+    return {'uint8': gdal.GDT_Byte, 'uint16': gdal.GDT_UInt16, 'float32': gdal.GDT_Float32}[str(dtype)]
+
+
+def matrix(raster, codecs, blocksizes):
+    """(compression, predictor, zlevel, blocksize) combinations valid for the raster's data type"""
+    bitdepth = raster.bitdepth
+    predictors = [None] if bitdepth == 'Byte' else [None, '3' if 'Float' in bitdepth else '2']
+    combos = [('LZW', p, None) for p in predictors]
+    combos += [('DEFLATE', p, z) for p, z in itertools.product(predictors, ['1', '6', '9'])]
+    if 'ZSTD' in codecs:
+        combos += [('ZSTD', p, z) for p, z in itertools.product(predictors, ['1', '9'])]
+    if 'LERC' in codecs and bitdepth != 'Byte':
+        combos.append(('LERC', None, '0'))
+    if bitdepth == 'Byte':
+        combos.append(('JPEG', None, '75'))
+        if 'WEBP' in codecs and raster.shape[2] in (3, 4):
+            combos.append(('WEBP', None, '75'))
+    return [combo + (blocksize,) for combo in combos for blocksize in blocksizes]
+
+
+def read_metrics(path, reads):
+    """Latency of random single tile reads and throughput of one full resolution read of the whole raster"""
+    ds = gdal.Open(path)
+    band = ds.GetRasterBand(1)
+    xblock, yblock = band.GetBlockSize()
+    across = (ds.RasterXSize + xblock - 1) // xblock
+    down = (ds.RasterYSize + yblock - 1) // yblock
+    ds = band = None
+
+    rng = random.Random(0)
+    latencies = []
+    for _ in range(reads):
+        #Reopen for every read so the block cache doesn't serve repeated tiles
+        ds = gdal.Open(path)
+        tx, ty = rng.randrange(across), rng.randrange(down)
+        xoff, yoff = tx * xblock, ty * yblock
+        start = time.perf_counter()
+        ds.ReadRaster(xoff, yoff, min(xblock, ds.RasterXSize - xoff), min(yblock, ds.RasterYSize - yoff))
+        latencies.append((time.perf_counter() - start) * 1000)
+        ds = None
+
+    def full_read():
+        ds = gdal.Open(path)
+        ds.ReadRaster(0, 0, ds.RasterXSize, ds.RasterYSize)
+
+    ds = gdal.Open(path)
+    raw_mb = ds.RasterXSize * ds.RasterYSize * ds.RasterCount * \
+             gdal.GetDataTypeSize(ds.GetRasterBand(1).DataType) / 8.0 / 1e6
+    ds = None
+    seconds = timed(full_read, repeat=1)
+    return {'tile_ms_p50': float(np.percentile(latencies, 50)),
+            'tile_ms_p95': float(np.percentile(latencies, 95)),
+            'window_mb_per_s': raw_mb / seconds}
+
+
+def configure_s3(endpoint):
+    """Point /vsis3/ and boto3 at an S3 compatible server running over plain HTTP"""
+    gdal.SetConfigOption('AWS_S3_ENDPOINT', endpoint)
+    gdal.SetConfigOption('AWS_HTTPS', 'NO')
+    gdal.SetConfigOption('AWS_VIRTUAL_HOSTING', 'FALSE')
+    return boto3.client('s3', endpoint_url='http://{}'.format(endpoint))
+
+
+def run_metadata():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'run_id': uuid.uuid4().hex, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': revision,
+            'gdal': gdal.VersionInfo('RELEASE_NAME')}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=2048)
+    parser.add_argument('--sample', nargs='*', default=[], help='Sample rasters to include in the matrix')
+    parser.add_argument('--blocksizes', nargs='*', default=['256', '512'])
+    parser.add_argument('--reads', type=int, default=50, help='Random tile reads per output')
+    parser.add_argument('--s3-endpoint', help='host:port of an S3 compatible server, ex. a local MinIO')
+    parser.add_argument('--bucket', default='cognition-benchmarks')
+    parser.add_argument('--output', default='cog_benchmarks.jsonl', help='JSON lines file results are appended to')
+    args = parser.parse_args()
+
+    rasters = synthetic_rasters(args.size)
+    for path in args.sample:
+        rasters[os.path.basename(path)] = RasterDataset(gdal.Open(path))
+    codecs = available_codecs()
+    client = configure_s3(args.s3_endpoint) if args.s3_endpoint else None
+    metadata = run_metadata()
+    tempdir = tempfile.mkdtemp()
+
+    rows = []
+    try:
+        for name, raster in rasters.items():
+            raw_size = raster.shape[0] * raster.shape[1] * raster.shape[2] * \
+                       gdal.GetDataTypeSize(raster.ds.GetRasterBand(1).DataType) / 8.0
+            for compression, predictor, zlevel, blocksize in matrix(raster, codecs, args.blocksizes):
+                profile = make_profile(compression, predictor, zlevel, blocksize)
+                start = time.perf_counter()
+                cog = raster.Cogify(profile=profile)
+                write_s = time.perf_counter() - start
+                cog_fname = cog.filename
+                cog = None
+                size = gdal.VSIStatL(cog_fname).size
+
+                local = os.path.join(tempdir, '{}.tif'.format(uuid.uuid4().hex))
+                with open(local, 'wb') as f:
+                    f.write(_read_vsi(cog_fname))
+                gdal.Unlink(cog_fname)
+
+                targets = [('local', local)]
+                if client:
+                    key = '{}/{}'.format(metadata['run_id'], os.path.basename(local))
+                    client.upload_file(local, args.bucket, key)
+                    targets.append(('s3', '/vsis3/{}/{}'.format(args.bucket, key)))
+
+                for storage, path in targets:
+                    row = {'raster': name, 'compression': compression, 'predictor': predictor, 'zlevel': zlevel,
+                           'blocksize': blocksize, 'write_s': write_s, 'size_mb': size / 1e6,
+                           'ratio': size / raw_size, 'storage': storage}
+                    row.update(read_metrics(path, args.reads))
+                    rows.append(row)
+                    with open(args.output, 'a') as f:
+                        f.write(json.dumps(dict(metadata, **row)) + '\n')
+                os.remove(local)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    print_table(rows, columns)
+    print("Appended {} results for run {} to {}".format(len(rows), metadata['run_id'], args.output))
+
+
+def _read_vsi(fname):
+    f = gdal.VSIFOpenL(fname, 'rb')
+    try:
+        gdal.VSIFSeekL(f, 0, 2)
+        size = gdal.VSIFTellL(f)
+        gdal.VSIFSeekL(f, 0, 0)
+        return gdal.VSIFReadL(1, size, f)
+    finally:
+        gdal.VSIFCloseL(f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import sys
+import os
+import time
+
+cognition_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+if cognition_path not in sys.path:
+    sys.path.append(cognition_path)
+
+
+def timed(func, number=1, repeat=3):
+    """Call `func` `number` times per run and return the best average seconds per call over `repeat` runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def print_table(rows, columns):
+    """Print a list of dicts as a fixed width table"""
+    widths = [max([len(str(col))] + [len(_fmt(row.get(col))) for row in rows]) for col in columns]
+    print('  '.join([str(col).ljust(w) for col, w in zip(columns, widths)]))
+    print('  '.join(['-' * w for w in widths]))
+    for row in rows:
+        print('  '.join([_fmt(row.get(col)).ljust(w) for col, w in zip(columns, widths)]))
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return '{:.4g}'.format(value)
+    return '' if value is None else str(value)
@@ -0,0 +1,69 @@
+"""
+Micro-benchmarks of geometry construction and export, comparing the previous GeoJSON round trip against the direct
+WKB/array path in cognition.pygdal.geometry.
+
+    python -m benchmarks.geometry
+"""
+import json
+import math
+from osgeo import ogr
+
+from benchmarks.common import timed, print_table
+from cognition.pygdal import geometry
+
+
+def ring(n, cx=0.0, cy=0.0, r=1.0):
+    coords = [[cx + r * math.cos(2 * math.pi * i / n), cy + r * math.sin(2 * math.pi * i / n)] for i in range(n)]
+    return coords + [coords[0]]
+
+samples = {
+    'Point': [1.0, 2.0],
+    'LineString': ring(64)[:-1],
+    'Polygon': [ring(64), ring(16, r=0.5)],
+    'MultiPoint': ring(64)[:-1],
+    'MultiLineString': [ring(64)[:-1], ring(32, cx=3)[:-1]],
+    'MultiPolygon': [[ring(64)], [ring(64, cx=3)], [ring(64, cy=3)]],
+}
+
+
+def legacy_listToGeom(geom_type, coords):
+    return ogr.CreateGeometryFromJson(json.dumps({"type": geom_type, "coordinates": coords}))
+
+
+def legacy_geomToList(geom):
+    return json.loads(geom.ExportToJson())['coordinates']
+
+
+def legacy_createWKTPolygon(points):
+    wkt = 'POLYGON (('
+    for point in points:
+        wkt = wkt + str(point[0]) + ' ' + str(point[1]) + ','
+    return wkt[:-1] + '))'
+
+
+def main(number=2000):
+    rows = []
+    for geom_type, coords in samples.items():
+        geom = geometry.listToGeom(geom_type, coords)
+        assert geom.Equals(legacy_listToGeom(geom_type, coords))
+        operations = [
+            ('create', lambda: legacy_listToGeom(geom_type, coords), lambda: geometry.listToGeom(geom_type, coords)),
+            ('export', lambda: legacy_geomToList(geom), lambda: geometry.geomToList(geom)),
+        ]
+        for name, legacy, fast in operations:
+            before = timed(legacy, number)
+            after = timed(fast, number)
+            rows.append({'geometry': geom_type, 'operation': name, 'legacy_us': before * 1e6,
+                         'fast_us': after * 1e6, 'speedup': before / after})
+
+    bounds = [(i, i + 1, i, i + 1) for i in range(10000)]
+    before = timed(lambda: [ogr.CreateGeometryFromWkt(legacy_createWKTPolygon(geometry.minMaxToFivePoints(b))) for b in bounds], 1)
+    after = timed(lambda: [ogr.CreateGeometryFromWkb(x) for x in geometry.boundsToWkb(bounds)], 1)
+    rows.append({'geometry': 'Polygon (bbox x10000)', 'operation': 'create', 'legacy_us': before * 1e6,
+                 'fast_us': after * 1e6, 'speedup': before / after})
+
+    print_table(rows, ['geometry', 'operation', 'legacy_us', 'fast_us', 'speedup'])
+
+
+if __name__ == '__main__':
+    main()
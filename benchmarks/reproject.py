@@ -0,0 +1,60 @@
+"""
+Reprojection throughput across resampling kernels, comparing a single threaded materialization of the warped VRT
+against the chunked, multithreaded warp profile.
+
+    python -m benchmarks.reproject [--size 4096] [--epsg 4326]
+"""
+import argparse
+import uuid
+import numpy as np
+from osgeo import gdal, osr
+
+from benchmarks.common import timed, print_table
+from cognition.pygdal.raster import RasterDataset
+from cognition.pygdal.warp import WarpBase
+
+
+class SingleThreaded(WarpBase):
+
+    def __init__(self, ds):
+        WarpBase.__init__(self, ds)
+        self.multithread = False
+        self.num_threads = 1
+        self.workers = 1
+
+
+def synthetic_raster(size, res=30.0):
+    ds = gdal.GetDriverByName('GTiff').Create('/vsimem/bench_reproject/{}.tif'.format(uuid.uuid4().hex), size, size, 1,
+                                              gdal.GDT_UInt16, options=['TILED=YES'])
+    ds.SetGeoTransform((500000.0, res, 0.0, 4000000.0, 0.0, -res))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32611)
+    ds.SetProjection(srs.ExportToWkt())
+    y, x = np.mgrid[0:size, 0:size]
+    ds.GetRasterBand(1).WriteArray((1000 + 500 * np.sin(x / 50.0) * np.cos(y / 70.0)).astype('uint16'))
+    ds.FlushCache()
+    return RasterDataset(ds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=4096)
+    parser.add_argument('--epsg', type=int, default=4326)
+    args = parser.parse_args()
+
+    raster = synthetic_raster(args.size)
+    rows = []
+    for kernel in ['near', 'bilinear', 'cubic', 'lanczos', 'average']:
+        for name, base in [('single threaded', SingleThreaded), ('chunked multithreaded', WarpBase)]:
+            def profile(ds, base=base):
+                p = base(ds)
+                p.resample = kernel
+                return p
+            seconds = timed(lambda: raster.Reproject(args.epsg, profile=profile, materialize=True), repeat=1)
+            rows.append({'kernel': kernel, 'profile': name, 'seconds': seconds,
+                         'mpix_per_s': args.size * args.size / seconds / 1e6})
+    print_table(rows, ['kernel', 'profile', 'seconds', 'mpix_per_s'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+HTTP requests issued by GDAL when opening and reading COGs from an S3 compatible stand-in (ex. a local MinIO), with
+GDAL defaults compared to the pygdal_config 's3' I/O profile.  GDAL talks to the server through a small counting
+proxy so every GET, HEAD and bucket listing is recorded.
+
+    python -m benchmarks.s3 --endpoint localhost:9000 [--bucket bench] [--files 20] [--reads 10]
+"""
+import argparse
+import collections
+import http.client
+import random
+import threading
+import time
+import uuid
+import boto3
+import numpy as np
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from osgeo import gdal, osr
+
+from benchmarks.common import print_table
+from cognition.pygdal.raster import RasterDataset
+from cognition.pygdal.config import pygdal_config
+
+
+_hop_by_hop = ('connection', 'keep-alive', 'transfer-encoding', 'upgrade', 'http2-settings', 'te', 'trailer',
+               'proxy-authorization', 'proxy-authenticate')
+
+
+class CountingProxy(ThreadingMixIn, HTTPServer):
+
+    """Forwards requests unchanged (including the Host header the request was signed with) and counts them"""
+
+    daemon_threads = True
+
+    def __init__(self, upstream):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _ProxyHandler)
+        self.upstream = upstream
+        self.counts = collections.Counter()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return '127.0.0.1:{}'.format(self.server_address[1])
+
+    def reset(self):
+        with self.lock:
+            self.counts = collections.Counter()
+            self.bytes = 0
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def forward(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        conn = http.client.HTTPConnection(self.server.upstream)
+        headers = {key: value for key, value in self.headers.items() if key.lower() not in _hop_by_hop}
+        conn.request(self.command, self.path, body, headers=headers)
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+
+        kind = self.command
+        if self.command == 'GET' and ('list-type' in self.path or 'delimiter' in self.path or 'prefix=' in self.path):
+            kind = 'LIST'
+        with self.server.lock:
+            self.server.counts[kind] += 1
+            self.server.bytes += len(data)
+
+        self.send_response(response.status)
+        for key, value in response.getheaders():
+            if key.lower() not in _hop_by_hop and (key.lower() != 'content-length' or self.command == 'HEAD'):
+                self.send_header(key, value)
+        if self.command != 'HEAD':
+            self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = forward
+
+    def log_message(self, *args):
+        pass
+
+
+def upload_cogs(client, bucket, prefix, count, size):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32611)
+    y, x = np.mgrid[0:size, 0:size]
+    keys = []
+    for i in range(count):
+        ds = gdal.GetDriverByName('MEM').Create('', size, size, 1, gdal.GDT_UInt16)
+        ds.SetGeoTransform((500000.0 + i * size * 30, 30.0, 0.0, 4000000.0, 0.0, -30.0))
+        ds.SetProjection(srs.ExportToWkt())
+        ds.GetRasterBand(1).WriteArray((1000 + 500 * np.sin((x + i) / 50.0) * np.cos(y / 70.0)).astype('uint16'))
+        cog = RasterDataset(ds).Cogify()
+        f = gdal.VSIFOpenL(cog.filename, 'rb')
+        gdal.VSIFSeekL(f, 0, 2)
+        length = gdal.VSIFTellL(f)
+        gdal.VSIFSeekL(f, 0, 0)
+        data = gdal.VSIFReadL(1, length, f)
+        gdal.VSIFCloseL(f)
+        gdal.Unlink(cog.filename)
+        key = '{}/asset_{}_B1.tif'.format(prefix, i)
+        client.put_object(Bucket=bucket, Key=key, Body=data)
+        keys.append(key)
+    return keys
+
+
+def workload(bucket, keys, reads, window):
+    """Open every asset and read random windows, like Grid.query does for each intersecting cell"""
+    rng = random.Random(0)
+    for key in keys:
+        ds = gdal.Open('/vsis3/{}/{}'.format(bucket, key))
+        band = ds.GetRasterBand(1)
+        for _ in range(reads):
+            xoff = rng.randrange(0, max(1, ds.RasterXSize - window))
+            yoff = rng.randrange(0, max(1, ds.RasterYSize - window))
+            band.ReadRaster(xoff, yoff, window, window)
+        ds = band = None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoint', required=True, help='host:port of the S3 compatible server')
+    parser.add_argument('--bucket', default='cognition-benchmarks')
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--size', type=int, default=2048)
+    parser.add_argument('--reads', type=int, default=10, help='Random window reads per file')
+    parser.add_argument('--window', type=int, default=256)
+    args = parser.parse_args()
+
+    client = boto3.client('s3', endpoint_url='http://{}'.format(args.endpoint))
+    prefix = 'bench_s3/{}'.format(uuid.uuid4().hex)
+    keys = upload_cogs(client, args.bucket, prefix, args.files, args.size)
+
+    proxy = CountingProxy(args.endpoint)
+    threading.Thread(target=proxy.serve_forever, daemon=True).start()
+    gdal.SetConfigOption('AWS_S3_ENDPOINT', proxy.endpoint)
+    gdal.SetConfigOption('AWS_HTTPS', 'NO')
+    gdal.SetConfigOption('AWS_VIRTUAL_HOSTING', 'FALSE')
+
+    rows = []
+    try:
+        for name in ['default', 's3']:
+            if hasattr(gdal, 'VSICurlClearCache'):
+                gdal.VSICurlClearCache()
+            proxy.reset()
+            start = time.perf_counter()
+            with pygdal_config.io_scope(name):
+                workload(args.bucket, keys, args.reads, args.window)
+            seconds = time.perf_counter() - start
+            counts = proxy.counts
+            rows.append({'profile': name, 'requests': sum(counts.values()), 'GET': counts['GET'],
+                         'HEAD': counts['HEAD'], 'LIST': counts['LIST'], 'mb': proxy.bytes / 1e6, 'seconds': seconds})
+    finally:
+        proxy.shutdown()
+        for key in keys:
+            client.delete_object(Bucket=args.bucket, Key=key)
+    print_table(rows, ['profile', 'requests', 'GET', 'HEAD', 'LIST', 'mb', 'seconds'])
+
+
+if __name__ == '__main__':
+    main()
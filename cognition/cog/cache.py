@@ -0,0 +1,172 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class TileCache(object):
+
+    """
+    Read-through cache of decoded COG tiles with two tiers: an in-memory LRU and an optional on-disk tier of .npy
+    files which are memory-mapped when read back.  Tiles evicted from memory spill to disk, tiles found on disk are
+    promoted back to memory.  Both tiers are bounded in bytes and evict least recently used tiles first.
+    Keys should identify the content of a tile, see `tile_key`.
+    """
+
+    def __init__(self, memory_bytes=256 * 1024 * 1024, disk_path=None, disk_bytes=2 * 1024 * 1024 * 1024):
+        """
+        :param memory_bytes: Size limit of the memory tier
+        :param disk_path: Directory of the disk tier, no disk tier when None.  Tiles already in the directory (ex. from
+                          a previous process) are reused.
+        :param disk_bytes: Size limit of the disk tier
+        """
+        self.memory_bytes = memory_bytes
+        self.disk_path = disk_path
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.reset_metrics()
+        if disk_path:
+            os.makedirs(disk_path, exist_ok=True)
+            files = [os.path.join(disk_path, x) for x in os.listdir(disk_path) if x.endswith('.npy')]
+            for path in sorted(files, key=os.path.getmtime):
+                self._disk[os.path.basename(path)] = os.path.getsize(path)
+                self._disk_size += self._disk[os.path.basename(path)]
+            for name in self._evict_disk():
+                _remove(os.path.join(disk_path, name))
+
+    def reset_metrics(self):
+        self._metrics = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'memory_evictions': 0, 'disk_evictions': 0}
+
+    def metrics(self):
+        """Hit, miss and eviction counts, hit rate and the size of each tier"""
+        with self._lock:
+            out = dict(self._metrics)
+            out.update({'memory_tiles': len(self._memory), 'memory_bytes': self._memory_size,
+                        'disk_tiles': len(self._disk), 'disk_bytes': self._disk_size})
+        requests = out['memory_hits'] + out['disk_hits'] + out['misses']
+        out['hit_rate'] = (out['memory_hits'] + out['disk_hits']) / float(requests) if requests else 0.0
+        return out
+
+    def get(self, key):
+        """Cached tile or None.  Tiles from the disk tier are read-only memory-mapped arrays."""
+        name = _disk_name(key)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._metrics['memory_hits'] += 1
+                return self._memory[key]
+            on_disk = name in self._disk
+            if not on_disk:
+                self._metrics['misses'] += 1
+                return None
+
+        #Disk I/O happens outside the lock so readers of the memory tier never wait on it
+        try:
+            array = np.load(os.path.join(self.disk_path, name), mmap_mode='r')
+        except (IOError, ValueError):
+            array = None
+        with self._lock:
+            if array is None:
+                if name in self._disk:
+                    self._disk_size -= self._disk.pop(name)
+                self._metrics['misses'] += 1
+                return None
+            if name in self._disk:
+                self._disk.move_to_end(name)
+            self._metrics['disk_hits'] += 1
+            evicted = self._put_memory(key, array)
+        self._spill(evicted)
+        return array
+
+    def put(self, key, array):
+        with self._lock:
+            evicted = self._put_memory(key, array)
+        self._spill(evicted)
+
+    def get_or_read(self, key, read):
+        """Return the cached tile, or call `read()` on a miss and cache its result"""
+        array = self.get(key)
+        if array is None:
+            array = read()
+            self.put(key, array)
+        return array
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            names = list(self._disk)
+            self._disk.clear()
+            self._disk_size = 0
+        for name in names:
+            _remove(os.path.join(self.disk_path, name))
+
+    def _put_memory(self, key, array):
+        """Add a tile to the memory tier, returns the (key, array) evicted to make room.  Call with the lock held."""
+        if key in self._memory:
+            self._memory_size -= self._memory.pop(key).nbytes
+        self._memory[key] = array
+        self._memory_size += array.nbytes
+        evicted = []
+        while self._memory_size > self.memory_bytes and self._memory:
+            old_key, old = self._memory.popitem(last=False)
+            self._memory_size -= old.nbytes
+            self._metrics['memory_evictions'] += 1
+            evicted.append((old_key, old))
+        return evicted
+
+    def _spill(self, evicted):
+        """Write tiles evicted from memory to the disk tier.  Call without the lock held."""
+        if not self.disk_path:
+            return
+        for key, array in evicted:
+            if array.nbytes > self.disk_bytes:
+                continue
+            name = _disk_name(key)
+            with self._lock:
+                if name in self._disk:
+                    self._disk.move_to_end(name)
+                    continue
+            path = os.path.join(self.disk_path, name)
+            #Write then rename so other processes sharing the directory never map a partial file
+            tmp = path + '.{}.tmp'.format(threading.get_ident())
+            with open(tmp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+            with self._lock:
+                if name not in self._disk:
+                    self._disk[name] = size
+                    self._disk_size += size
+                removed = self._evict_disk()
+            for old in removed:
+                _remove(os.path.join(self.disk_path, old))
+
+    def _evict_disk(self):
+        """Drop least recently used tiles from the disk tier index, returns the names of the files to remove"""
+        removed = []
+        while self._disk_size > self.disk_bytes and self._disk:
+            name, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._metrics['disk_evictions'] += 1
+            removed.append(name)
+        return removed
+
+
+def tile_key(path, etag, level, band, tx, ty):
+    """Cache key of one tile, the ETag (or any version id) makes updated objects miss instead of serving stale tiles"""
+    return '{}|{}|{}|{}|{}|{}'.format(path, etag or '', level, band, tx, ty)
+
+def _disk_name(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy'
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
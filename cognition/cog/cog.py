@@ -1,11 +1,17 @@
 import math
-from osgeo import gdal
+import os
+import uuid
+import numpy as np
+from osgeo import gdal, gdal_array
 import functools
 from multiprocessing import Pool
 
 from cognition.pygdal.geometry import Polygon, wktBoundBox
 from cognition.pygdal.raster import RasterDataset
 from cognition.pygdal.config import pygdal_config
+from cognition.cog.profiles import DefaultCOG, resolve
+from cognition.cog import tiff, overviews
+from cognition.cog.cache import tile_key
 
 
 
@@ -20,8 +26,95 @@ class COG(RasterDataset):
         return fname
 
 
-    def __init__(self, ds, id=None):
+    def __init__(self, ds, id=None, etag=None):
         RasterDataset.__init__(self, ds, id)
+        #Version of the stored object (ex. S3 ETag), part of the tile cache key
+        self.etag = etag
+
+    def read_window(self, window, bands=None, buf=None, cache=None, level=0):
+        """
+        Read a (xoff, yoff, xsize, ysize) window into an array of shape (bands, ysize, xsize), optionally through a
+        tile cache (see cognition.cog.cache.TileCache) so repeated reads of the same tiles don't hit storage.
+        :param cache: TileCache, tiles are cached decoded and keyed by filename, etag, level, band and tile index.
+        :param level: 0 for full resolution, n for the n-th overview (the window is in that level's pixels).
+        """
+        bands = bands or list(range(1, self.shape[2]+1))
+        if cache is None and level == 0:
+            return RasterDataset.read_window(self, window, bands, buf)
+        xoff, yoff, xsize, ysize = window
+        if buf is None:
+            dtype = gdal_array.GDALTypeCodeToNumericTypeCode(self.ds.GetRasterBand(bands[0]).DataType)
+            buf = np.empty((len(bands), ysize, xsize), dtype=dtype)
+        else:
+            buf = buf[:len(bands), :ysize, :xsize]
+
+        for idx, band_number in enumerate(bands):
+            band = self.ds.GetRasterBand(band_number)
+            if level:
+                band = band.GetOverview(level - 1)
+            if cache is None:
+                band.ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=buf[idx])
+                continue
+            bx, by = band.GetBlockSize()
+            for ty in range(yoff // by, (yoff + ysize - 1) // by + 1):
+                for tx in range(xoff // bx, (xoff + xsize - 1) // bx + 1):
+                    tile = cache.get_or_read(tile_key(self.filename, self.etag, level, band_number, tx, ty),
+                                             functools.partial(_read_tile, band, tx, ty))
+                    #Overlap of the tile and the window
+                    x0, y0 = max(xoff, tx * bx), max(yoff, ty * by)
+                    x1, y1 = min(xoff + xsize, tx * bx + tile.shape[1]), min(yoff + ysize, ty * by + tile.shape[0])
+                    buf[idx, y0-yoff:y1-yoff, x0-xoff:x1-xoff] = tile[y0-ty*by:y1-ty*by, x0-tx*bx:x1-tx*bx]
+        return buf
+
+    @pygdal_config.log_operation
+    def Update(self, ds, profile=DefaultCOG, **kwargs):
+        """
+        Create a new COG with the valid (not nodata) pixels of `ds` written over this COG.  Only the tiles touched by
+        `ds`, and the matching regions of each overview level (computed from the previous level), are re-encoded;
+        every other tile is copied byte for byte.
+        :param ds: RasterDataset on the pixel grid of the COG (same CRS, resolution and band count)
+        :param profile: COG profile (class or resolved instance) providing the overview resampling
+        """
+        fname = os.path.splitext(kwargs.pop('fname'))[0] + '.tif'
+        if abs(ds.xres - self.xres) > 1e-6 * self.xres or abs(ds.yres - self.yres) > 1e-6 * self.yres:
+            raise ValueError("Can only update a COG with rasters of the same resolution")
+        col = (ds.tlx - self.tlx) / self.xres
+        row = (self.tly - ds.tly) / self.yres
+        if abs(col - round(col)) > 1e-3 or abs(row - round(row)) > 1e-3:
+            raise ValueError("Can only update a COG with rasters aligned to its pixel grid")
+        if ds.shape[2] != self.shape[2]:
+            raise ValueError("Expected {} bands, got {}".format(self.shape[2], ds.shape[2]))
+
+        col, row = self.pixel_window(ds.extent)[:2]
+        xoff, yoff = max(col, 0), max(row, 0)
+        xsize = min(col + ds.shape[0], self.shape[0]) - xoff
+        ysize = min(row + ds.shape[1], self.shape[1]) - yoff
+        if xsize <= 0 or ysize <= 0:
+            return self
+
+        #Work on a byte copy, GDAL only re-encodes the blocks written to in update mode
+        work_fname = '/vsimem/cog_update/{}.tif'.format(uuid.uuid4().hex)
+        tiff.copy_file(self.filename, work_fname)
+        try:
+            work = gdal.Open(work_fname, gdal.GA_Update)
+            for i in range(self.shape[2]):
+                new = ds.ds.GetRasterBand(i+1).ReadAsArray(xoff - col, yoff - row, xsize, ysize)
+                nodata = ds.ds.GetRasterBand(i+1).GetNoDataValue()
+                band = work.GetRasterBand(i+1)
+                if nodata is not None:
+                    merged = band.ReadAsArray(xoff, yoff, xsize, ysize)
+                    valid = new != nodata
+                    merged[valid] = new[valid]
+                    new = merged
+                band.WriteArray(new, xoff, yoff)
+            band = None
+            overviews.update_overviews(work, (xoff, yoff, xsize, ysize), resolve(profile, self).overview_resampling())
+            work.FlushCache()
+            work = None
+            tiff.relayout(work_fname, fname)
+        finally:
+            gdal.Unlink(work_fname)
+        return COG(gdal.Open(fname))
 
     def offsets(self, filter=None):
         """
@@ -61,14 +154,39 @@ class COG(RasterDataset):
                     if tl_pix[0] <= item[0] <= br_pix[0] and tl_pix[1] <= item[1] <= br_pix[1]:
                         yield item
 
-    def blocks(self, offsets=None):
-        """Uses gdal.Translate to generate a VRT of each offset"""
+    def blocks(self, offsets=None, io_profile='s3', cache=None):
+        """
+        Uses gdal.Translate to generate a VRT of each offset
+        :param io_profile: Name of the pygdal_config I/O profile applied while generating each block
+        :param cache: Optional TileCache (see cognition.cog.cache).  Blocks are then read through the cache and written
+                      to GeoTIFFs in the temp directory, instead of VRTs which read from storage whenever opened.
+        """
         if not offsets:
             offsets = self.offsets()
         for item in offsets:
-            block = self.read_block(self, item)
+            with pygdal_config.io_scope(io_profile):
+                block = self.read_block(self, item) if cache is None else self.cached_block(item, cache)
             yield block
 
+    def cached_block(self, offset, cache):
+        """Read a (xoff, yoff, xsize, ysize) block through a TileCache into a GeoTIFF, returns its filename"""
+        xoff, yoff, xsize, ysize = offset
+        array = self.read_window(offset, cache=cache)
+        fname = pygdal_config.tempfiles.gen_file('tif', 'cached_block', uuid.uuid4().hex)
+        out = gdal.GetDriverByName('GTiff').Create(fname, xsize, ysize, self.shape[2],
+                                                   self.ds.GetRasterBand(1).DataType)
+        gt = self.gt
+        out.SetGeoTransform((gt[0] + xoff * gt[1], gt[1], 0.0, gt[3] + yoff * gt[5], 0.0, gt[5]))
+        out.SetProjection(self.ds.GetProjection())
+        for i in range(self.shape[2]):
+            out_band = out.GetRasterBand(i+1)
+            nodata = self.ds.GetRasterBand(i+1).GetNoDataValue()
+            if nodata is not None:
+                out_band.SetNoDataValue(nodata)
+            out_band.WriteArray(array[i])
+        out = None
+        return fname
+
     def embed(self, pixel_func, bands, offsets=None, multi=False, **kwargs):
         """Embeds a pixel function in all blocks"""
         blocks = list(self.blocks(offsets=offsets))
@@ -82,6 +200,10 @@ class COG(RasterDataset):
             embed_list.append(embedded)
         return embed_list
 
+def _read_tile(band, tx, ty):
+    bx, by = band.GetBlockSize()
+    return band.ReadAsArray(tx * bx, ty * by, min(bx, band.XSize - tx * bx), min(by, band.YSize - ty * by))
+
 def _embed(ds, pixel_func, bands, **kwargs):
     return RasterDataset(gdal.Open(ds)).EmbedFunction(pixel_func, bands, **kwargs)
 
@@ -0,0 +1,91 @@
+import math
+from osgeo import gdal
+
+
+def resampling_levels(resampling, count):
+    """Expand a resampling method, or a list of methods per overview level, to exactly `count` levels"""
+    if isinstance(resampling, str):
+        return [resampling] * count
+    resampling = list(resampling)
+    return (resampling + [resampling[-1]] * count)[:count]
+
+
+def build_overviews(ds, factors, resampling):
+    """
+    Build overviews progressively: each level is resampled from the previous (larger) level rather than from the
+    full resolution image, so every level costs roughly a quarter of the one before it.
+    :param ds: GDAL dataset
+    :param factors: Overview factors (ex. [2, 4, 8])
+    :param resampling: Resampling method, or list of methods per level (ex. ['LANCZOS', 'AVERAGE'])
+    """
+    if not factors:
+        return
+    resampling = resampling_levels(resampling, len(factors))
+    #Allocate every level without computing it
+    ds.BuildOverviews('NONE', factors)
+    for i in range(ds.RasterCount):
+        band = ds.GetRasterBand(i+1)
+        previous = band
+        for level in range(band.GetOverviewCount()):
+            overview = band.GetOverview(level)
+            gdal.RegenerateOverview(previous, overview, resampling[level])
+            previous = overview
+
+
+def update_overviews(ds, window, resampling, margin=8):
+    """
+    Recompute only the part of every overview level covering a modified window of the full resolution image.  Each
+    level is recomputed from the previous level, and `margin` pixels around the window are included in the resampling
+    so kernels with a wide footprint (ex. LANCZOS) don't leave seams at the edge of the updated region.  Levels whose
+    size isn't a whole fraction of the previous level's (odd sizes) are recomputed entirely.
+    :param window: (xoff, yoff, xsize, ysize) window of the full resolution image which changed
+    :param resampling: Resampling method, or list of methods per level
+    :return: List of the (xoff, yoff, xsize, ysize) windows updated at each overview level
+    """
+    band = ds.GetRasterBand(1)
+    count = band.GetOverviewCount()
+    resampling = resampling_levels(resampling, count)
+    updated = []
+    for i in range(ds.RasterCount):
+        band = ds.GetRasterBand(i+1)
+        nodata = band.GetNoDataValue()
+        previous, dirty = band, window
+        for level in range(count):
+            overview = band.GetOverview(level)
+            dirty = _update_region(previous, overview, dirty, resampling[level], nodata, margin)
+            if i == 0:
+                updated.append(dirty)
+            previous = overview
+    return updated
+
+
+def _update_region(src, dst, window, resampling, nodata, margin):
+    #GDAL maps overview pixels to source pixels with the ratio of the level sizes, so a region can only be recomputed
+    #on its own when that ratio is a whole number.  Otherwise recompute the whole level, which matches a full build.
+    if src.XSize % dst.XSize or src.YSize % dst.YSize:
+        gdal.RegenerateOverview(src, dst, resampling)
+        return (0, 0, dst.XSize, dst.YSize)
+    fx, fy = src.XSize // dst.XSize, src.YSize // dst.YSize
+    xoff, yoff, xsize, ysize = window
+
+    #Dirty window in the overview, and the same window grown by the margin
+    x0, y0 = xoff // fx, yoff // fy
+    x1 = min(dst.XSize, int(math.ceil((xoff + xsize) / float(fx))))
+    y1 = min(dst.YSize, int(math.ceil((yoff + ysize) / float(fy))))
+    mx0, my0 = max(0, x0 - margin), max(0, y0 - margin)
+    mx1, my1 = min(dst.XSize, x1 + margin), min(dst.YSize, y1 + margin)
+
+    #Matching window of the source level, exactly the margin window scaled by the level ratio
+    sx0, sy0, sx1, sy1 = mx0 * fx, my0 * fy, mx1 * fx, my1 * fy
+
+    driver = gdal.GetDriverByName('MEM')
+    src_mem = driver.Create('', sx1 - sx0, sy1 - sy0, 1, src.DataType)
+    dst_mem = driver.Create('', mx1 - mx0, my1 - my0, 1, src.DataType)
+    src_band, dst_band = src_mem.GetRasterBand(1), dst_mem.GetRasterBand(1)
+    if nodata is not None:
+        src_band.SetNoDataValue(nodata)
+        dst_band.SetNoDataValue(nodata)
+    src_band.WriteRaster(0, 0, sx1 - sx0, sy1 - sy0, src.ReadRaster(sx0, sy0, sx1 - sx0, sy1 - sy0))
+    gdal.RegenerateOverview(src_band, dst_band, resampling)
+    dst.WriteRaster(x0, y0, x1 - x0, y1 - y0, dst_band.ReadRaster(x0 - mx0, y0 - my0, x1 - x0, y1 - y0))
+    return (x0, y0, x1 - x0, y1 - y0)
@@ -1,7 +1,22 @@
 from osgeo import gdal
+import copy
+import uuid
+import time
+import xml.etree.ElementTree as ET
 import math
+import numpy as np
 from haversine import haversine
 
+from cognition.cog.overviews import resampling_levels
+
+#Creation option holding the compression level of each codec
+level_options = {
+    'DEFLATE': 'ZLEVEL',
+    'ZSTD': 'ZSTD_LEVEL',
+    'WEBP': 'WEBP_LEVEL',
+    'JPEG': 'JPEG_QUALITY',
+    'LERC': 'MAX_Z_ERROR',
+}
 
 class COGBase(object):
 
@@ -9,6 +24,11 @@ class COGBase(object):
 
     accepted = ["blocksize", "predictor", "compression", "predictor", "zlevel"]
 
+    #Whether `compression` also applies to the full resolution image rather than only to the overviews.  Off by
+    #default so existing profiles (ex. DefaultCOG, which would make full resolution Byte rasters lossy JPEG) keep
+    #their output, profiles choosing a codec for the whole file (ex. ProfilingCOG) turn it on.
+    compress_full_resolution = False
+
     def __init__(self, ds):
         self.ds = ds
 
@@ -22,6 +42,7 @@ class COGBase(object):
         self.__bigtiff = "IF_SAFER"
         self.__num_threads = "ALL_CPUS"
         self.__resample = "LANCZOS"
+        self.__overview_resample = None
 
         #Immutable (no setter) -- requirements of COG spec
         self.__tiled = "YES"
@@ -84,6 +105,15 @@ class COGBase(object):
     def resample(self, value):
         self.__resample = value
 
+    @property
+    def overview_resample(self):
+        return self.__overview_resample
+
+    @overview_resample.setter
+    def overview_resample(self, value):
+        """Resampling method per overview level (ex. ['LANCZOS', 'AVERAGE']), the last one is used for deeper levels"""
+        self.__overview_resample = value
+
     @property
     def tiled(self):
         return self.__tiled
@@ -111,6 +141,16 @@ class COGBase(object):
             math.log((2 * math.pi * 6378137) /
                      (self.get_resolution() * 256), 2))
 
+    def bind(self, ds):
+        """
+        Copy of this resolved profile for another raster (ex. each cell cut from one scene), keeping the codec
+        decisions without resolving the profile again.
+        """
+        profile = copy.copy(self)
+        profile.ds = ds
+        profile.__zoom = profile.get_zoom()
+        return profile
+
     def dumps(self):
         out_d = {}
         for item in self.accepted:
@@ -126,29 +166,54 @@ class COGBase(object):
                 break
         return overviews
 
+    def overview_resampling(self):
+        """Resampling method of each overview level, levels are computed from the previous level"""
+        return resampling_levels(self.overview_resample or self.resample, len(self.overviews()))
+
+    def full_resolution_compression(self):
+        """Compression of the full resolution image, None when only the overviews are compressed"""
+        return self.compression if self.compress_full_resolution else None
+
     def creation_options(self):
-        accepted = ["tiled", "blocksize", "num_threads", "bigtiff", "predictor", "zlevel"]
+        accepted = ["tiled", "blocksize", "num_threads", "bigtiff", "compression", "predictor", "zlevel"]
+        compression = self.full_resolution_compression()
         creation_list = []
         for item in accepted:
+            value = compression if item == "compression" else getattr(self, item)
+            if value is None:
+                continue
             if item == "blocksize":
-                creation_list.append(f"BLOCKXSIZE={getattr(self, item)}")
-                creation_list.append(f"BLOCKYSIZE={getattr(self, item)}")
+                creation_list.append(f"BLOCKXSIZE={value}")
+                creation_list.append(f"BLOCKYSIZE={value}")
+            elif item == "compression":
+                creation_list.append(f"COMPRESS={value}")
+            elif item == "zlevel":
+                creation_list.append(f"{level_options.get(compression, 'ZLEVEL')}={value}")
             else:
-                creation_list.append(f"{item.upper()}={getattr(self, item)}")
+                creation_list.append(f"{item.upper()}={value}")
         return creation_list
 
     def overview_opts(self):
-        gdal.SetConfigOption('TILED_OVERVIEW', 'YES')
-        gdal.SetConfigOption('GDAL_TIFF_OVR_BLOCKSIZE', self.blocksize)
-        gdal.SetConfigOption('BLOCKXSIZE_OVERVIEW', self.blocksize)
-        gdal.SetConfigOption('BLOCKYSIZE_OVERVIEW', self.blocksize)
-        gdal.SetConfigOption('NUM_THREADS_OVERVIEW', 'ALL_CPUS')
+        """GDAL configuration options used while building overviews, apply them with pygdal_config.scope"""
+        opts = {'TILED_OVERVIEW': 'YES',
+                'GDAL_TIFF_OVR_BLOCKSIZE': self.blocksize,
+                'BLOCKXSIZE_OVERVIEW': self.blocksize,
+                'BLOCKYSIZE_OVERVIEW': self.blocksize,
+                'NUM_THREADS_OVERVIEW': 'ALL_CPUS'}
         if self.compression:
-            gdal.SetConfigOption('COMPRESS_OVERVIEW', self.compression)
+            opts['COMPRESS_OVERVIEW'] = self.compression
         if self.predictor:
-            gdal.SetConfigOption('PREDICTOR_OVERVIEW', self.predictor)
-        if self.zlevel:
-            gdal.SetConfigOption('ZLEVEL_OVERVIEW', self.zlevel)
+            opts['PREDICTOR_OVERVIEW'] = self.predictor
+        if self.zlevel is not None and self.compression in ('DEFLATE', 'ZSTD'):
+            opts[level_options[self.compression] + '_OVERVIEW'] = self.zlevel
+        return opts
+
+
+def resolve(profile, ds):
+    """Resolve a profile class (or functools.partial) against a raster, or bind an already resolved profile to it"""
+    if isinstance(profile, COGBase):
+        return profile.bind(ds)
+    return profile(ds)
 
 
 class DefaultCOG(COGBase):
@@ -174,3 +239,180 @@ class DefaultCOG(COGBase):
             self.zlevel = '9'
 
 
+
+
+def smallest(result):
+    """Objective favouring the smallest output, encode time only breaks ties"""
+    return result['rel_size'] + 1e-6 * result['rel_time']
+
+def fastest(result):
+    """Objective favouring the fastest encode, output size only breaks ties"""
+    return result['rel_time'] + 1e-6 * result['rel_size']
+
+def tradeoff(size_weight=1.0, time_weight=0.1):
+    """
+    Objective weighing output size against encode time.  Both are relative to the best candidate (1.0 is best), so
+    with the defaults a candidate which encodes twice as fast is worth being up to 10% larger.
+    """
+    def objective(result):
+        return size_weight * result['rel_size'] + time_weight * result['rel_time']
+    return objective
+
+
+def available_codecs():
+    """Compression methods supported by the GTiff driver of this GDAL build"""
+    options = gdal.GetDriverByName('GTiff').GetMetadataItem('DMD_CREATIONOPTIONLIST') or ''
+    try:
+        root = ET.fromstring(options)
+    except ET.ParseError:
+        return []
+    for option in root.iter('Option'):
+        if option.get('name') == 'COMPRESS':
+            return [value.text.strip() for value in option.iter('Value')]
+    return []
+
+
+class ProfilingCOG(COGBase):
+
+    """
+    Chooses compression, predictor, level and blocksize by trial encoding a sample of the raster's tiles with every
+    candidate codec and scoring the results with an objective.  The chosen settings and the measurements behind
+    them are kept in `decision`.  Use functools.partial to pass arguments when handing the class to Cogify.  Unlike
+    DefaultCOG the chosen codec compresses the full resolution image as well as the overviews.
+    """
+
+    compress_full_resolution = True
+
+    def __init__(self, ds, objective=None, blocksizes=('512',), sample_tiles=8, lossy=False, candidates=None):
+        """
+        :param objective: Callable scoring a trial result (lower is better), defaults to `tradeoff()`.  A result has
+                          keys compression, predictor, zlevel, blocksize, size (bytes), time (seconds), ratio
+                          (compressed/raw size) and rel_size/rel_time (relative to the best candidate).
+        :param blocksizes: Candidate blocksizes
+        :param sample_tiles: Maximum number of tiles sampled from the raster
+        :param lossy: Also consider lossy codecs (JPEG, WEBP)
+        :param candidates: Optional list of (compression, predictor, zlevel) tuples replacing the default candidates
+        """
+        COGBase.__init__(self, ds)
+        self.objective = objective or tradeoff()
+        self.sample_tiles = sample_tiles
+        self.lossy = lossy
+
+        blocksizes = [str(x) for x in blocksizes]
+        sample = self.sample(max([int(x) for x in blocksizes]))
+        try:
+            results = []
+            for blocksize in blocksizes:
+                for compression, predictor, zlevel in candidates or self.candidates():
+                    results.append(_trial_encode(sample, blocksize, compression, predictor, zlevel))
+        finally:
+            sample = None
+        results = [x for x in results if x]
+        if not results:
+            raise ValueError("None of the candidate codecs could encode the raster")
+
+        min_size = max(min([x['size'] for x in results]), 1)
+        min_time = max(min([x['time'] for x in results]), 1e-9)
+        for result in results:
+            result['rel_size'] = result['size'] / float(min_size)
+            result['rel_time'] = result['time'] / min_time
+            result['score'] = self.objective(result)
+        results.sort(key=lambda x: x['score'])
+
+        best = results[0]
+        self.blocksize = best['blocksize']
+        self.compression = best['compression']
+        self.predictor = best['predictor']
+        self.zlevel = best['zlevel']
+        self.decision = {'compression': self.compression,
+                         'predictor': self.predictor,
+                         'zlevel': self.zlevel,
+                         'blocksize': self.blocksize,
+                         'candidates': results}
+
+    def dumps(self):
+        out_d = COGBase.dumps(self)
+        out_d['decision'] = self.decision
+        return out_d
+
+    def candidates(self):
+        """Default (compression, predictor, zlevel) candidates for the raster's data type and band count"""
+        codecs = available_codecs()
+        bitdepth = self.ds.bitdepth
+        if 'Float' in bitdepth:
+            predictors = [None, '3']
+        elif bitdepth == 'Byte':
+            predictors = [None]
+        else:
+            predictors = [None, '2']
+
+        candidates = []
+        for predictor in predictors:
+            candidates.append(('LZW', predictor, None))
+            for zlevel in ('1', '6', '9'):
+                candidates.append(('DEFLATE', predictor, zlevel))
+            if 'ZSTD' in codecs:
+                for zlevel in ('1', '9', '15'):
+                    candidates.append(('ZSTD', predictor, zlevel))
+        if 'LERC' in codecs and bitdepth != 'Byte':
+            #MAX_Z_ERROR=0 is lossless
+            candidates.append(('LERC', None, '0'))
+        if self.lossy and bitdepth == 'Byte':
+            if self.ds.shape[2] in (1, 3):
+                candidates.append(('JPEG', None, '75'))
+            if 'WEBP' in codecs and self.ds.shape[2] in (3, 4):
+                candidates.append(('WEBP', None, '75'))
+        return candidates
+
+    def sample(self, blocksize):
+        """
+        Copy up to `sample_tiles` tiles spread evenly over the raster side by side into an in-memory raster.
+        """
+        cols, rows, count = self.ds.shape
+        xsize, ysize = min(blocksize, cols), min(blocksize, rows)
+        across, down = cols // xsize, rows // ysize
+        step = max(1, int(math.ceil(math.sqrt(across * down / float(self.sample_tiles)))))
+        tiles = [(x * xsize, y * ysize) for y in range(0, down, step) for x in range(0, across, step)]
+        if len(tiles) > self.sample_tiles:
+            #Pick candidates evenly across the whole list, truncating it would only keep the top rows
+            tiles = [tiles[i] for i in np.linspace(0, len(tiles) - 1, self.sample_tiles).astype(int)]
+
+        band = self.ds.ds.GetRasterBand(1)
+        sample = gdal.GetDriverByName('MEM').Create('', xsize * len(tiles), ysize, count, band.DataType)
+        for i in range(count):
+            in_band = self.ds.ds.GetRasterBand(i+1)
+            out_band = sample.GetRasterBand(i+1)
+            for idx, (xoff, yoff) in enumerate(tiles):
+                out_band.WriteRaster(idx * xsize, 0, xsize, ysize, in_band.ReadRaster(xoff, yoff, xsize, ysize))
+        return sample
+
+
+def _trial_encode(sample, blocksize, compression, predictor, zlevel):
+    """Encode a sample raster with one candidate and measure the output size and encode time"""
+    options = ['TILED=YES', f'BLOCKXSIZE={blocksize}', f'BLOCKYSIZE={blocksize}', f'COMPRESS={compression}']
+    if predictor:
+        options.append(f'PREDICTOR={predictor}')
+    if zlevel is not None:
+        options.append(f"{level_options.get(compression, 'ZLEVEL')}={zlevel}")
+    fname = '/vsimem/profiling/{}.tif'.format(uuid.uuid4().hex)
+    start = time.perf_counter()
+    try:
+        out = gdal.Translate(fname, sample, creationOptions=options)
+    except RuntimeError:
+        out = None
+    if out is None:
+        gdal.Unlink(fname)
+        return None
+    out = None
+    elapsed = time.perf_counter() - start
+    size = gdal.VSIStatL(fname).size
+    gdal.Unlink(fname)
+    raw = sample.RasterXSize * sample.RasterYSize * sample.RasterCount * \
+          gdal.GetDataTypeSize(sample.GetRasterBand(1).DataType) // 8
+    return {'compression': compression,
+            'predictor': predictor,
+            'zlevel': zlevel,
+            'blocksize': blocksize,
+            'size': size,
+            'time': elapsed,
+            'ratio': size / float(raw)}
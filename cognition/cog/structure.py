@@ -0,0 +1,188 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from osgeo import gdal
+
+from cognition.cog import tiff
+
+
+class HeaderCache(object):
+
+    """
+    Thread safe LRU cache of the leading bytes of files, keyed by (path, version) where the version (ETag or size)
+    changes when a file is rewritten, so stale headers are never served.  Bounded by the total size of the cached
+    bytes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (requested size, data) or None, data is shorter than the requested size when the file is"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def put(self, key, size, data):
+        with self._lock:
+            current = self._items.pop(key, None)
+            if current is not None:
+                self.nbytes -= len(current[1])
+                if current[0] > size:
+                    size, data = current
+            self._items[key] = (size, data)
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes and self._items:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+header_cache = HeaderCache()
+
+
+class PrefixReader(object):
+
+    """
+    Reader serving a file from one read of its first `prefix_size` bytes.  COGs keep every IFD at the start of the
+    file so the whole structure is usually parsed from that single (ranged) request.  Reads past the prefix (ex. the
+    trailing IFDs of a file which isn't a COG) are served by ranged reads of just the requested bytes.
+    """
+
+    def __init__(self, path, prefix_size=16384, cache=header_cache, version=None):
+        """
+        :param version: ETag (or any version id) of the file, part of the cache key.  Defaults to the file size.
+        """
+        self.path = path
+        self.cache = cache
+        self.requests = 0
+        self._reader = None
+        key = (path, version if version is not None else _size(path)) if cache else None
+        cached = cache.get(key) if cache else None
+        if cached is not None and (cached[0] >= prefix_size or len(cached[1]) < cached[0]):
+            self._size, self._prefix = cached
+        else:
+            self._size, self._prefix = prefix_size, self._read(0, prefix_size)
+            if cache:
+                cache.put(key, prefix_size, self._prefix)
+
+    def _read(self, offset, size):
+        if self._reader is None:
+            self._reader = tiff.VSIReader(self.path)
+        self.requests += 1
+        return self._reader.read(offset, size)
+
+    def read(self, offset, size):
+        end = offset + size
+        #A prefix shorter than requested holds the whole file
+        if end <= len(self._prefix) or len(self._prefix) < self._size:
+            return self._prefix[offset:end]
+        return self._read(offset, size)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+
+def validate_structure(path, prefix_size=16384, cache=header_cache, check_tiled=True, version=None):
+    """
+    Check that a file has a cloud optimized GeoTIFF structure by parsing only its header and IFD chain, without
+    opening it as a GDAL dataset.  Applies the same rules, and returns the same (errors, details) tuple, as
+    cognition.cog.validate.validate.
+    :param version: ETag (or any version id) of the file used to key the header cache, defaults to the file size
+    """
+    reader = PrefixReader(path, prefix_size, cache, version)
+    try:
+        source = tiff.TiffFile(reader.read)
+        main, overviews = source.images()
+        errors = _check(source, main, overviews, check_tiled)
+        details = {'ifd_offsets': {'main': main.offset},
+                   'data_offsets': {'main': main.item(tiff.TILE_OFFSETS, 0) or main.item(273, 0)}}
+        for i, ovr in enumerate(overviews):
+            details['ifd_offsets']['overview_%d' % i] = ovr.offset
+            details['data_offsets']['overview_%d' % i] = ovr.item(tiff.TILE_OFFSETS, 0) or ovr.item(273, 0)
+        details['requests'] = reader.requests
+        return errors, details
+    except tiff.TiffError as e:
+        return ["Invalid file : {}".format(e)], {}
+    finally:
+        reader.close()
+
+
+def _size(path):
+    stat = gdal.VSIStatL(path)
+    return stat.size if stat is not None else None
+
+
+def _check(source, main, overviews, check_tiled):
+    errors = []
+    if main.width >= 512 or main.height >= 512:
+        if check_tiled and not main.tiled and main.width > 1024:
+            errors += ["The file is greater than 512xH or Wx512, but is not tiled"]
+        if not overviews:
+            errors += ["The file is greater than 512xH or Wx512, but has no overviews"]
+
+    if main.offset != (16 if source.bigtiff else 8) or main is not source.ifds[0]:
+        errors += ["The offset of the main IFD should be 8 for ClassicTIFF or 16 for BigTIFF. "
+                   "It is %d instead" % main.offset]
+
+    ifd_offsets = [main.offset]
+    previous = main
+    for i, ovr in enumerate(overviews):
+        if ovr.width > previous.width or ovr.height > previous.height:
+            if i == 0:
+                errors += ["First overview has larger dimension than main band"]
+            else:
+                errors += ["Overview of index %d has larger dimension than overview of index %d" % (i, i-1)]
+        if check_tiled and not ovr.tiled and ovr.width > 1024:
+            errors += ["Overview of index %d is not tiled" % i]
+        ifd_offsets.append(ovr.offset)
+        if ifd_offsets[-1] < ifd_offsets[-2]:
+            if i == 0:
+                errors += ["The offset of the IFD for overview of index %d is %d, whereas it should be greater than "
+                           "the one of the main image, which is at byte %d" % (i, ifd_offsets[-1], ifd_offsets[-2])]
+            else:
+                errors += ["The offset of the IFD for overview of index %d is %d, whereas it should be greater than "
+                           "the one of index %d, which is at byte %d" % (i, ifd_offsets[-1], i-1, ifd_offsets[-2])]
+        previous = ovr
+
+    data_offsets = [ifd.item(tiff.TILE_OFFSETS, 0) or ifd.item(273, 0) or 0 for ifd in [main] + overviews]
+    if data_offsets[-1] < ifd_offsets[-1]:
+        if overviews:
+            errors += ["The offset of the first block of the smallest overview should be after its IFD"]
+        else:
+            errors += ["The offset of the first block of the image should be after its IFD"]
+    for i in range(len(data_offsets)-2, 0, -1):
+        if data_offsets[i] < data_offsets[i+1]:
+            errors += ["The offset of the first block of overview of index %d should be after the one of the "
+                       "overview of index %d" % (i-1, i)]
+    if len(data_offsets) >= 2 and data_offsets[0] < data_offsets[1]:
+        errors += ["The offset of the first block of the main resolution image should be after the one of the "
+                   "overview of index %d" % (len(overviews) - 1)]
+    return errors
+
+
+def validate_many(paths, workers=16, prefix_size=16384, cache=header_cache, versions=None):
+    """
+    Validate many stored COGs concurrently (ex. an archive audit over /vsis3/ paths).
+    :param versions: Optional dict of path: ETag (ex. from the bucket listing) keying the header cache
+    :return: dict mapping each path to its list of errors (empty when the file is a valid COG)
+    """
+    def run(path):
+        try:
+            return path, validate_structure(path, prefix_size, cache, version=(versions or {}).get(path))[0]
+        except Exception as e:
+            return path, ["Could not validate: {}".format(e)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(run, paths))
@@ -0,0 +1,551 @@
+import math
+import struct
+import xml.etree.ElementTree as ET
+from osgeo import gdal
+
+#Baseline and GeoTIFF tags used when reading and writing COG structure
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+SAMPLES_PER_PIXEL = 277
+PLANAR_CONFIG = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+EXTRA_SAMPLES = 338
+SAMPLE_FORMAT = 339
+JPEG_TABLES = 347
+YCBCR_SUBSAMPLING = 530
+REFERENCE_BLACK_WHITE = 532
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+GEO_KEY_DIRECTORY = 34735
+GEO_DOUBLE_PARAMS = 34736
+GEO_ASCII_PARAMS = 34737
+GDAL_METADATA = 42112
+GDAL_NODATA = 42113
+
+compression_names = {
+    1: None,
+    5: 'LZW',
+    7: 'JPEG',
+    8: 'DEFLATE',
+    32773: 'PACKBITS',
+    32946: 'DEFLATE',
+    34887: 'LERC',
+    34925: 'LZMA',
+    50000: 'ZSTD',
+    50001: 'WEBP',
+}
+
+#TIFF field type: (struct format of one value, number of struct values per TIFF value)
+field_types = {
+    1: ('B', 1),
+    2: ('s', 1),
+    3: ('H', 1),
+    4: ('I', 1),
+    5: ('I', 2),
+    6: ('b', 1),
+    7: ('s', 1),
+    8: ('h', 1),
+    9: ('i', 1),
+    10: ('i', 2),
+    11: ('f', 1),
+    12: ('d', 1),
+    16: ('Q', 1),
+    17: ('q', 1),
+    18: ('Q', 1),
+}
+
+SHORT = 3
+LONG = 4
+DOUBLE = 12
+LONG8 = 16
+
+
+class TiffError(Exception):
+    pass
+
+
+class VSIReader(object):
+
+    """Random access reader over any GDAL virtual file system path (local, /vsimem/, /vsis3/, ...)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = gdal.VSIFOpenL(path, 'rb')
+        if self._f is None:
+            raise TiffError("Could not open {}".format(path))
+
+    def read(self, offset, size):
+        gdal.VSIFSeekL(self._f, offset, 0)
+        return gdal.VSIFReadL(1, size, self._f)
+
+    def close(self):
+        if self._f is not None:
+            gdal.VSIFCloseL(self._f)
+            self._f = None
+
+
+class IFD(object):
+
+    """One image file directory.  Tag values stored outside the IFD are only read when requested."""
+
+    def __init__(self, tiff, offset, entries, next_offset, size):
+        self.tiff = tiff
+        self.offset = offset
+        self.entries = entries #tag: (type, count, inline bytes or None, value offset)
+        self.next_offset = next_offset
+        self.size = size #Size in bytes of the IFD itself, excluding out of line values
+        self._values = {}
+
+    def __contains__(self, tag):
+        return tag in self.entries
+
+    def get(self, tag, default=None):
+        """Decoded tag value, a tuple of numbers (or bytes for ASCII/UNDEFINED tags)"""
+        if tag not in self.entries:
+            return default
+        if tag not in self._values:
+            ftype, count, inline, offset = self.entries[tag]
+            data = inline if inline is not None else self.tiff.read(offset, count * _type_size(ftype))
+            self._values[tag] = _decode(self.tiff.byteorder, ftype, count, data)
+        return self._values[tag]
+
+    def item(self, tag, index, default=None):
+        """Single element of a tag value, reading only that element when the value is stored out of line"""
+        if tag not in self.entries:
+            return default
+        if tag in self._values or self.entries[tag][2] is not None:
+            value = self.get(tag)
+            return value[index] if index < len(value) else default
+        ftype, count, _, offset = self.entries[tag]
+        if index >= count:
+            return default
+        size = _type_size(ftype)
+        return _decode(self.tiff.byteorder, ftype, 1, self.tiff.read(offset + index * size, size))[0]
+
+    def first(self, tag, default=None):
+        value = self.get(tag)
+        return value[0] if value else default
+
+    def value_offset(self, tag):
+        """Byte offset of an out of line tag value, None when the value is stored inline"""
+        return self.entries[tag][3] if tag in self.entries and self.entries[tag][2] is None else None
+
+    @property
+    def width(self):
+        return self.first(IMAGE_WIDTH)
+
+    @property
+    def height(self):
+        return self.first(IMAGE_LENGTH)
+
+    @property
+    def tiled(self):
+        return TILE_WIDTH in self.entries
+
+    @property
+    def is_overview(self):
+        return bool(self.first(NEW_SUBFILE_TYPE, 0) & 1)
+
+    @property
+    def is_mask(self):
+        return bool(self.first(NEW_SUBFILE_TYPE, 0) & 4)
+
+    @property
+    def compression(self):
+        return compression_names.get(self.first(COMPRESSION, 1), 'UNKNOWN')
+
+
+class TiffFile(object):
+
+    """
+    Minimal (Big)TIFF structure parser.  Only the header and the IFD chain are read, through a `read(offset, size)`
+    callable, so it works with a prefix of the file or ranged reads against object storage.
+    """
+
+    def __init__(self, read):
+        self.read = read
+        header = read(0, 16)
+        if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+            raise TiffError("Not a TIFF file")
+        self.byteorder = '<' if header[:2] == b'II' else '>'
+        magic = _unpack(self.byteorder + 'H', header[2:4])[0]
+        if magic == 42:
+            self.bigtiff = False
+            self.first_ifd = _unpack(self.byteorder + 'I', header[4:8])[0]
+        elif magic == 43:
+            self.bigtiff = True
+            self.first_ifd = _unpack(self.byteorder + 'Q', header[8:16])[0]
+        else:
+            raise TiffError("Invalid TIFF magic number {}".format(magic))
+        self._ifds = None
+
+    @property
+    def ifds(self):
+        if self._ifds is None:
+            self._ifds = []
+            offset = self.first_ifd
+            seen = set()
+            while offset and offset not in seen:
+                seen.add(offset)
+                ifd = self._read_ifd(offset)
+                self._ifds.append(ifd)
+                offset = ifd.next_offset
+        return self._ifds
+
+    def images(self):
+        """Return (main IFD, [overview IFDs by decreasing size]) ignoring masks"""
+        images = [x for x in self.ifds if not x.is_mask]
+        if not images:
+            raise TiffError("TIFF file has no images")
+        return images[0], sorted([x for x in images[1:] if x.is_overview], key=lambda x: -x.width)
+
+    def _read_ifd(self, offset):
+        bo = self.byteorder
+        if self.bigtiff:
+            count_fmt, count_size, entry_size, offset_fmt, offset_size = 'Q', 8, 20, 'Q', 8
+        else:
+            count_fmt, count_size, entry_size, offset_fmt, offset_size = 'H', 2, 12, 'I', 4
+        count = _unpack(bo + count_fmt, self.read(offset, count_size))[0]
+        size = count_size + count * entry_size + offset_size
+        data = self.read(offset + count_size, count * entry_size + offset_size)
+        if len(data) < count * entry_size + offset_size:
+            raise TiffError("Truncated IFD at offset {}".format(offset))
+        entries = {}
+        for i in range(count):
+            entry = data[i * entry_size:(i + 1) * entry_size]
+            tag, ftype = _unpack(bo + 'HH', entry[:4])
+            if ftype not in field_types:
+                continue
+            value_count = _unpack(bo + offset_fmt, entry[4:4 + offset_size])[0]
+            raw = entry[4 + offset_size:]
+            if value_count * _type_size(ftype) <= offset_size:
+                entries[tag] = (ftype, value_count, raw[:value_count * _type_size(ftype)], None)
+            else:
+                entries[tag] = (ftype, value_count, None, _unpack(bo + offset_fmt, raw)[0])
+        next_offset = _unpack(bo + offset_fmt, data[count * entry_size:])[0]
+        return IFD(self, offset, entries, next_offset, size)
+
+
+def _unpack(fmt, data):
+    """struct.unpack raising TiffError when the data is short, ex. a truncated file"""
+    try:
+        return struct.unpack(fmt, data)
+    except struct.error as e:
+        raise TiffError("Truncated or corrupt TIFF: {}".format(e))
+
+def _type_size(ftype):
+    fmt, n = field_types[ftype]
+    return struct.calcsize('<' + fmt) * n
+
+def _decode(byteorder, ftype, count, data):
+    fmt, n = field_types[ftype]
+    if fmt == 's':
+        return bytes(data)
+    return _unpack('{}{}{}'.format(byteorder, count * n, fmt), data)
+
+def _encode(byteorder, ftype, values):
+    fmt, n = field_types[ftype]
+    if fmt == 's':
+        return bytes(values)
+    return struct.pack('{}{}{}'.format(byteorder, len(values), fmt), *values)
+
+
+def write_tiff(fname, images, byteorder='<', bigtiff=False):
+    """
+    Write a tiled TIFF with cloud optimized layout: all IFDs first (in the order given, main image then overviews),
+    followed by tile data from the last image to the first.
+    :param images: List of (tags, tiles) where tags maps tag to (type, values) and tiles is a list of tile bytes.
+                   TileOffsets/TileByteCounts are filled in by the writer, as is NewSubfileType unless given (ex. for
+                   masks, which follow the image they belong to).
+    """
+    bo = byteorder
+    if bigtiff:
+        count_fmt, entry_size, offset_fmt, offset_size, header_size, offset_type = 'Q', 20, 'Q', 8, 16, LONG8
+    else:
+        count_fmt, entry_size, offset_fmt, offset_size, header_size, offset_type = 'H', 12, 'I', 4, 8, LONG
+
+    #First pass: add the tile layout tags (offsets are placeholders) and compute the size of each IFD
+    images = [(dict(tags), tiles) for tags, tiles in images]
+    for idx, (tags, tiles) in enumerate(images):
+        if NEW_SUBFILE_TYPE not in tags:
+            tags[NEW_SUBFILE_TYPE] = (LONG, (1 if idx > 0 else 0,))
+        tags[TILE_OFFSETS] = (offset_type, (0,) * len(tiles))
+        tags[TILE_BYTE_COUNTS] = (offset_type, tuple(len(x) for x in tiles))
+
+    def ifd_size(tags):
+        size = struct.calcsize(bo + count_fmt) + len(tags) * entry_size + offset_size
+        for ftype, values in tags.values():
+            length = len(_encode(bo, ftype, values))
+            if length > offset_size:
+                size += length + (length % 2)
+        return size
+
+    ifd_offsets = []
+    position = header_size
+    for tags, _ in images:
+        ifd_offsets.append(position)
+        position += ifd_size(tags)
+
+    #Tile data is written smallest overview first, full resolution last
+    for tags, tiles in reversed(images):
+        offsets = []
+        for tile in tiles:
+            offsets.append(position if len(tile) else 0)
+            position += len(tile)
+        tags[TILE_OFFSETS] = (offset_type, tuple(offsets))
+    if not bigtiff and position > 2**32 - 1:
+        raise TiffError("Data exceeds 4GB, write a BigTIFF instead")
+
+    out = bytearray()
+    if bigtiff:
+        out += (b'II' if bo == '<' else b'MM') + struct.pack(bo + 'HHHQ', 43, 8, 0, ifd_offsets[0])
+    else:
+        out += (b'II' if bo == '<' else b'MM') + struct.pack(bo + 'HI', 42, ifd_offsets[0])
+
+    for idx, (tags, _) in enumerate(images):
+        extra = bytearray()
+        extra_offset = ifd_offsets[idx] + struct.calcsize(bo + count_fmt) + len(tags) * entry_size + offset_size
+        entries = bytearray(struct.pack(bo + count_fmt, len(tags)))
+        for tag in sorted(tags):
+            ftype, values = tags[tag]
+            data = _encode(bo, ftype, values)
+            count = len(data) // _type_size(ftype)
+            entries += struct.pack(bo + 'HH' + offset_fmt, tag, ftype, count)
+            if len(data) <= offset_size:
+                entries += data + b'\x00' * (offset_size - len(data))
+            else:
+                entries += struct.pack(bo + offset_fmt, extra_offset + len(extra))
+                extra += data + (b'\x00' if len(data) % 2 else b'')
+        next_ifd = ifd_offsets[idx + 1] if idx + 1 < len(images) else 0
+        entries += struct.pack(bo + offset_fmt, next_ifd)
+        out += entries + extra
+
+    f = gdal.VSIFOpenL(fname, 'wb')
+    if f is None:
+        raise TiffError("Could not open {} for writing".format(fname))
+    try:
+        gdal.VSIFWriteL(bytes(out), 1, len(out), f)
+        for tags, tiles in reversed(images):
+            for tile in tiles:
+                if tile:
+                    gdal.VSIFWriteL(tile, 1, len(tile), f)
+    finally:
+        gdal.VSIFCloseL(f)
+
+
+#Tags copied from each source image when copying tiles, everything else is either rewritten or dropped
+_copied_tags = [BITS_PER_SAMPLE, COMPRESSION, PHOTOMETRIC, SAMPLES_PER_PIXEL, PLANAR_CONFIG, PREDICTOR, TILE_WIDTH,
+                TILE_LENGTH, EXTRA_SAMPLES, SAMPLE_FORMAT, JPEG_TABLES, YCBCR_SUBSAMPLING, REFERENCE_BLACK_WHITE,
+                GDAL_NODATA]
+_geo_tags = [MODEL_PIXEL_SCALE, GEO_KEY_DIRECTORY, GEO_DOUBLE_PARAMS, GEO_ASCII_PARAMS]
+#Per-sample tags, reduced to one value when a single band is extracted
+_sample_tags = [BITS_PER_SAMPLE, SAMPLE_FORMAT]
+
+
+def plan_tile_copy(tiff, window, factors, blocksize, compression, predictor, band=None):
+    """
+    Check whether a pixel window of a tiled (Geo)TIFF can be copied into a new COG tile for tile, and plan the copy.
+    The window must lie inside the image, start on a tile boundary at every requested overview factor, and the
+    source's tiling, compression and predictor must match the requested ones.
+    :param window: (xoff, yoff, xsize, ysize) window of the full resolution image
+    :param factors: Overview factors of the output (ex. [2, 4, 8])
+    :param band: Copy a single band (1-indexed), requires a single band or band-separate (planar) source
+    :return: None if the window cannot be copied, otherwise a list of (ifd, window, tile indices) per output level,
+             each level followed by its mask when the source has an internal mask
+    """
+    main, overviews = tiff.images()
+    xoff, yoff, xsize, ysize = window
+    if not main.tiled or main.first(TILE_WIDTH) != int(blocksize) or main.first(TILE_LENGTH) != int(blocksize):
+        return None
+    if main.compression != (compression.upper() if compression else None):
+        return None
+    if main.first(PREDICTOR, 1) != int(predictor or 1):
+        return None
+    if MODEL_TRANSFORMATION in main:
+        return None
+    if xoff < 0 or yoff < 0 or xoff + xsize > main.width or yoff + ysize > main.height:
+        return None
+    samples = main.first(SAMPLES_PER_PIXEL, 1)
+    planar = main.first(PLANAR_CONFIG, 1)
+    if band is not None and samples > 1 and planar != 2:
+        return None
+
+    levels = [(main, 1)]
+    for factor in factors:
+        width = int(math.ceil(main.width / float(factor)))
+        match = [x for x in overviews if x.width == width]
+        if not match:
+            return None
+        levels.append((match[0], factor))
+
+    #Internal masks (NewSubfileType 4, or 5 for overviews) are copied along with the level they belong to
+    masks = [x for x in tiff.ifds if x.is_mask]
+    level_masks = []
+    for ifd, _ in levels:
+        match = [x for x in masks if (x.width, x.height, x.is_overview) == (ifd.width, ifd.height, ifd.is_overview)]
+        level_masks.append(match[0] if match else None)
+    if any(level_masks) and not all(level_masks):
+        return None
+
+    plan = []
+    for (ifd, factor), mask in zip(levels, level_masks):
+        tw, th = ifd.first(TILE_WIDTH), ifd.first(TILE_LENGTH)
+        if not ifd.tiled or tw != main.first(TILE_WIDTH) or th != main.first(TILE_LENGTH):
+            return None
+        if (xoff // factor) % tw or (yoff // factor) % th or xoff % factor or yoff % factor:
+            return None
+        level_window = (xoff // factor, yoff // factor,
+                        int(math.ceil(xsize / float(factor))), int(math.ceil(ysize / float(factor))))
+        across = int(math.ceil(ifd.width / float(tw)))
+        down = int(math.ceil(ifd.height / float(th)))
+        band_offset = (band - 1) * across * down if (band is not None and planar == 2) else 0
+        tx0, ty0 = level_window[0] // tw, level_window[1] // th
+        window_indices = []
+        for ty in range(int(math.ceil(level_window[3] / float(th)))):
+            for tx in range(int(math.ceil(level_window[2] / float(tw)))):
+                window_indices.append((ty0 + ty) * across + tx0 + tx)
+        indices = [band_offset + i for i in window_indices]
+        if band is None and planar == 2:
+            #Band-separate source copied whole, tiles of every band follow each other
+            indices = [i + b * across * down for b in range(samples) for i in indices]
+        plan.append((ifd, level_window, indices))
+        if mask is not None:
+            if not mask.tiled or mask.first(TILE_WIDTH) != tw or mask.first(TILE_LENGTH) != th:
+                return None
+            plan.append((mask, level_window, window_indices))
+    return plan
+
+
+def copy_tiles(tiff, plan, fname, band=None, gap=65536):
+    """
+    Execute a plan from plan_tile_copy, writing a COG to `fname` from the compressed source tiles without decoding
+    them.  Neighbouring tiles are fetched with a single ranged read when they are less than `gap` bytes apart.
+    """
+    images = []
+    for idx, (ifd, window, indices) in enumerate(plan):
+        offsets = ifd.get(TILE_OFFSETS)
+        counts = ifd.get(TILE_BYTE_COUNTS)
+        tiles = _read_ranges(tiff.read, [(offsets[i], counts[i]) for i in indices], gap)
+
+        tags = {}
+        for tag in _copied_tags + (_geo_tags if idx == 0 else []):
+            if tag in ifd:
+                tags[tag] = (ifd.entries[tag][0], ifd.get(tag))
+        tags[IMAGE_WIDTH] = (LONG, (window[2],))
+        tags[IMAGE_LENGTH] = (LONG, (window[3],))
+        tags[NEW_SUBFILE_TYPE] = (LONG, ((1 if ifd.is_overview else 0) | (4 if ifd.is_mask else 0),))
+        if idx == 0 and GDAL_METADATA in ifd:
+            metadata = _band_metadata(ifd.get(GDAL_METADATA), band) if band is not None else ifd.get(GDAL_METADATA)
+            tags[GDAL_METADATA] = (ifd.entries[GDAL_METADATA][0], metadata)
+        if band is not None and ifd.first(SAMPLES_PER_PIXEL, 1) > 1:
+            tags[SAMPLES_PER_PIXEL] = (SHORT, (1,))
+            tags[PLANAR_CONFIG] = (SHORT, (1,))
+            tags[PHOTOMETRIC] = (SHORT, (1,))
+            tags.pop(EXTRA_SAMPLES, None)
+            for tag in _sample_tags:
+                if tag in tags:
+                    tags[tag] = (tags[tag][0], (tags[tag][1][band - 1],))
+        if idx == 0:
+            tiepoint = ifd.get(MODEL_TIEPOINT)
+            scale = ifd.get(MODEL_PIXEL_SCALE)
+            if tiepoint and scale:
+                x = tiepoint[3] + (window[0] - tiepoint[0]) * scale[0]
+                y = tiepoint[4] - (window[1] - tiepoint[1]) * scale[1]
+                tags[MODEL_TIEPOINT] = (DOUBLE, (0.0, 0.0, 0.0, x, y, 0.0))
+        images.append((tags, tiles))
+
+    total = sum([len(tile) for _, tiles in images for tile in tiles])
+    write_tiff(fname, images, byteorder=tiff.byteorder, bigtiff=total > 2**32 - 2**24)
+
+
+def _band_metadata(metadata, band):
+    """
+    Reduce GDAL_METADATA XML to the dataset items and the items of `band` (1-indexed), renumbered as the only band
+    """
+    try:
+        root = ET.fromstring(metadata.rstrip(b'\x00'))
+    except ET.ParseError:
+        return metadata
+    for item in list(root):
+        sample = item.get('sample')
+        if sample is None:
+            continue
+        if int(sample) != band - 1:
+            root.remove(item)
+        else:
+            item.set('sample', '0')
+    return ET.tostring(root) + b'\x00'
+
+
+def _read_ranges(read, ranges, gap):
+    """Read (offset, size) ranges, coalescing ranges which are close together into one read"""
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+    out = [b''] * len(ranges)
+    group = []
+
+    def flush():
+        start = ranges[group[0]][0]
+        end = max([ranges[i][0] + ranges[i][1] for i in group])
+        data = read(start, end - start)
+        for i in group:
+            out[i] = bytes(data[ranges[i][0] - start:ranges[i][0] - start + ranges[i][1]])
+
+    for i in order:
+        offset, size = ranges[i]
+        if not size:
+            continue
+        if group and offset - max([ranges[j][0] + ranges[j][1] for j in group]) > gap:
+            flush()
+            group = []
+        group.append(i)
+    if group:
+        flush()
+    return out
+
+
+def relayout(src_fname, fname):
+    """
+    Rewrite a tiled TIFF with internal overviews (ex. a COG modified in place, whose rewritten tiles were appended at
+    the end of the file) into cloud optimized layout by copying its compressed tiles and internal masks.
+    """
+    reader = VSIReader(src_fname)
+    try:
+        source = TiffFile(reader.read)
+        main, overviews = source.images()
+        factors = [int(round(main.width / float(x.width))) for x in overviews]
+        plan = plan_tile_copy(source, (0, 0, main.width, main.height), factors, main.first(TILE_WIDTH),
+                              main.compression, main.first(PREDICTOR, 1))
+        if not plan:
+            raise TiffError("{} can't be rewritten as a COG, it must be tiled with square tiles".format(src_fname))
+        copy_tiles(source, plan, fname)
+    finally:
+        reader.close()
+
+
+def copy_file(src_fname, fname, chunksize=64 * 1024 * 1024):
+    """Byte for byte copy between any two GDAL virtual file system paths"""
+    src = gdal.VSIFOpenL(src_fname, 'rb')
+    if src is None:
+        raise TiffError("Could not open {}".format(src_fname))
+    dst = gdal.VSIFOpenL(fname, 'wb')
+    if dst is None:
+        gdal.VSIFCloseL(src)
+        raise TiffError("Could not open {} for writing".format(fname))
+    try:
+        while True:
+            data = gdal.VSIFReadL(1, chunksize, src)
+            if not data:
+                break
+            gdal.VSIFWriteL(data, 1, len(data), dst)
+    finally:
+        gdal.VSIFCloseL(src)
+        gdal.VSIFCloseL(dst)
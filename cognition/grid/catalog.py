@@ -0,0 +1,153 @@
+import json
+import sqlite3
+import threading
+import datetime
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS assets (
+    key TEXT PRIMARY KEY,
+    geohash TEXT NOT NULL,
+    sensor TEXT NOT NULL,
+    date TEXT NOT NULL,
+    band INTEGER,
+    etag TEXT,
+    cols INTEGER,
+    rows INTEGER,
+    gt TEXT,
+    epsg INTEGER,
+    ingested TEXT
+);
+CREATE INDEX IF NOT EXISTS assets_lookup ON assets (geohash, sensor, date, band);
+CREATE TABLE IF NOT EXISTS cells (
+    geohash TEXT PRIMARY KEY
+);
+"""
+
+columns = ['key', 'geohash', 'sensor', 'date', 'band', 'etag', 'cols', 'rows', 'gt', 'epsg', 'ingested']
+
+
+class Catalog(object):
+
+    """
+    SQLite catalog of the assets stored in a grid, one row per asset with its cell, sensor, date, band, key, ETag,
+    shape and geotransform.  Lookups by (geohash, sensor, date range, bands) use one index range scan per cell, so
+    queries resolve their assets without listing the bucket.
+    """
+
+    def __init__(self, path=':memory:'):
+        """
+        :param path: SQLite database file, created if it doesn't exist
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            if path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_schema)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM assets').fetchone()[0]
+
+    def add(self, key, geohash, sensor, date, band=None, etag=None, cols=None, rows=None, gt=None, epsg=None):
+        """Record (or replace) one asset.  `key` is the object key within the grid's bucket."""
+        self.add_many([{'key': key, 'geohash': geohash, 'sensor': sensor, 'date': date, 'band': band, 'etag': etag,
+                        'cols': cols, 'rows': rows, 'gt': gt, 'epsg': epsg}])
+
+    def add_many(self, records):
+        """Record many assets (dicts with the arguments of `add`) in one transaction"""
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        rows = []
+        for record in records:
+            row = dict(record, date=_date(record['date']), ingested=now)
+            row['gt'] = json.dumps(list(row['gt'])) if row.get('gt') is not None else None
+            rows.append(tuple(row.get(col) for col in columns))
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO assets ({}) VALUES ({})'.format(
+                ', '.join(columns), ', '.join('?' * len(columns))), rows)
+
+    def remove(self, key):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM assets WHERE key = ?', (key,))
+
+    def find(self, geohashes, sensor, start, end=None, bands=None):
+        """
+        Assets of a sensor in the given cells between two dates (inclusive), ordered by cell, date and band.
+        :param start: First date (datetime.date/datetime or 'YYYY-MM-DD')
+        :param end: Last date, defaults to `start`
+        :param bands: Optional list of band numbers, assets stored without a band number only match when None
+        :return: List of dicts with the catalog columns, `gt` decoded to a list
+        """
+        start = _date(start)
+        end = _date(end) if end is not None else start
+        sql = 'SELECT * FROM assets WHERE geohash = ? AND sensor = ? AND date BETWEEN ? AND ?'
+        if bands is not None:
+            bands = [int(x) for x in bands]
+            sql += ' AND band IN ({})'.format(', '.join('?' * len(bands)))
+        sql += ' ORDER BY date, band'
+        out = []
+        with self._lock:
+            for geohash in geohashes:
+                params = [geohash, sensor, start, end] + (bands or [])
+                out.extend([_record(row) for row in self._conn.execute(sql, params)])
+        return out
+
+    def add_cells(self, geohashes):
+        """Record the cells of the grid, including cells without any asset yet"""
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO cells (geohash) VALUES (?)', [(x,) for x in geohashes])
+
+    def geohashes(self):
+        """Geohashes of every recorded cell and of every cell with assets"""
+        with self._lock:
+            rows = self._conn.execute('SELECT geohash FROM cells UNION SELECT DISTINCT geohash FROM assets').fetchall()
+        return [row[0] for row in rows]
+
+    def dates(self, geohash, sensor):
+        """Sorted list of the dates with assets of a sensor in a cell"""
+        with self._lock:
+            rows = self._conn.execute('SELECT DISTINCT date FROM assets WHERE geohash = ? AND sensor = ? ORDER BY date',
+                                      (geohash, sensor)).fetchall()
+        return [row[0] for row in rows]
+
+    @classmethod
+    def from_bucket(cls, bucket, path=':memory:'):
+        """
+        Build a catalog from one listing of a grid's bucket (keys of form geohash/sensor/YYYY-MM-DD/name_B<n>.tif), to
+        migrate grids ingested before the catalog existed.  Every cell is recorded, shapes and geotransforms of assets
+        are left empty.
+        """
+        catalog = cls(path)
+        records = []
+        cells = set()
+        for obj in bucket.objects.all():
+            parts = obj.key.split('/')
+            cells.add(parts[0])
+            if len(parts) != 4 or not obj.key.lower().endswith(('.tif', '.tiff')):
+                continue
+            records.append({'key': obj.key, 'geohash': parts[0], 'sensor': parts[1], 'date': parts[2],
+                            'band': band_number(obj.key), 'etag': obj.e_tag})
+        catalog.add_cells(cells)
+        catalog.add_many(records)
+        return catalog
+
+
+def band_number(key):
+    """Band number from an asset name of form <name>_B<n>.<ext>, None when the asset isn't a single band"""
+    stem = key.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+    name, sep, band = stem.rpartition('_B')
+    return int(band) if sep and band.isdigit() else None
+
+def _date(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+def _record(row):
+    record = dict(zip(row.keys(), row))
+    if record['gt'] is not None:
+        record['gt'] = json.loads(record['gt'])
+    return record
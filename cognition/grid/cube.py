@@ -0,0 +1,34 @@
+from cognition.grid.mosaic import Mosaic
+
+
+class Cube(Mosaic):
+
+    """
+    A preallocated array of shape (dates, bands, rows, cols) covering a query extent across a range of dates, optionally
+    memory-mapped to a .npy file so cubes larger than memory can be filled and processed out of core.  As with Mosaic,
+    the extent is snapped to the pixel grid of the assets so tiles are read straight into their slice of the array.
+    """
+
+    def __init__(self, extent, dates, bands, xres, yres, dtype, nodata=None, origin=None, path=None):
+        """
+        :param dates: Dates of the cube's first axis
+        :param bands: Band numbers of the cube's second axis
+        Other parameters are the same as Mosaic.
+        """
+        self.dates = list(dates)
+        self.bands = list(bands)
+        Mosaic.__init__(self, extent, xres, yres, len(self.bands), dtype, nodata=nodata, origin=origin, path=path)
+
+    def _shape(self, count):
+        return (len(self.dates), count, self.rows, self.cols)
+
+    def _metadata(self):
+        return dict(Mosaic._metadata(self), dates=[str(x) for x in self.dates], bands=self.bands)
+
+    def add(self, ds, date_index, index, band=1, cache=None, level=0):
+        """
+        Read the part of a raster which overlaps the cube into date `date_index` and band `index` (both 0-indexed).
+        Other parameters are the same as Mosaic.add.
+        """
+        coverage = self.coverage[date_index, index:index+1] if self.coverage is not None else None
+        return self._read(ds, self.array[date_index, index:index+1], band, cache, level, coverage)
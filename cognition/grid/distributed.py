@@ -0,0 +1,295 @@
+"""
+Distributed ingest.  Planning expands scenes into one task per output asset (scene x cell x band), which is written
+to a manifest and loaded into a shared queue.  Workers on any number of nodes claim tasks from the queue, ingest them
+with Grid.ingest and record their completion.  Asset keys only depend on the task, so a task which is retried (ex.
+after its worker died and its lease expired) overwrites the same asset and processing is idempotent.
+
+    python -m cognition.grid.distributed plan --root BUCKET --scenes scenes.jsonl --manifest tasks.jsonl
+    python -m cognition.grid.distributed enqueue --manifest tasks.jsonl --queue tasks.db
+    python -m cognition.grid.distributed work --root BUCKET --queue tasks.db [--catalog catalog.db]
+
+Each line of scenes.jsonl is a JSON object with the `path`, `sensor` and `date` (YYYY-MM-DD) of a scene.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import threading
+import traceback
+
+from cognition.cog import profiles
+from cognition.grid.grid import Grid
+
+
+def task_id(scene, sensor, date, geohash, band):
+    key = json.dumps([scene, sensor, date, geohash, band])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def plan(grid, scenes, split_bands=True, **options):
+    """
+    Expand scenes into ingest tasks, one per (scene, cell, band) written by Grid.ingest.
+    :param grid: Grid the scenes are ingested into
+    :param scenes: Iterable of (path, config) pairs, config holding the `sensor` and `date` as passed to Grid.ingest
+    :param options: Grid.ingest options applied to every task (epsg, update, cog_profile as a profile name)
+    :return: List of task dicts
+    """
+    tasks = []
+    for path, config in scenes:
+        date = config['date'].strftime('%Y-%m-%d') if hasattr(config['date'], 'strftime') else config['date']
+        for geohash, band in grid.ingest_plan(path, split_bands=split_bands):
+            tasks.append({'id': task_id(path, config['sensor'], date, geohash, band), 'scene': path,
+                          'sensor': config['sensor'], 'date': date, 'geohash': geohash, 'band': band,
+                          'options': dict(options, split_bands=split_bands)})
+    return tasks
+
+
+def write_manifest(tasks, path):
+    """Serialize tasks to a JSON lines manifest"""
+    with open(path, 'w') as f:
+        for task in tasks:
+            f.write(json.dumps(task) + '\n')
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class TaskQueue(object):
+
+    """
+    Base class of the queues workers claim tasks from.  Subclass it to run on a hosted queue (ex. SQS or a database
+    shared by the cluster), `SQLiteQueue` serves single machines and small clusters sharing a local disk.
+    """
+
+    def put(self, tasks):
+        """Add tasks, tasks already in the queue (by id) are left unchanged"""
+        raise NotImplementedError
+
+    def claim(self, worker, count=1, lease=3600):
+        """
+        Claim up to `count` tasks for `lease` seconds, after which unfinished tasks become claimable again.  Claimed
+        tasks should share their scene so the worker opens (and reprojects) it once.  Returns a list of task dicts.
+        """
+        raise NotImplementedError
+
+    def complete(self, task, worker):
+        raise NotImplementedError
+
+    def fail(self, task, worker, error):
+        raise NotImplementedError
+
+    def counts(self):
+        """Number of tasks in each state"""
+        raise NotImplementedError
+
+
+class SQLiteQueue(TaskQueue):
+
+    """
+    Task queue in a SQLite database.  Claims run in an immediate transaction so concurrent workers, threads or
+    processes, never claim the same task.  SQLite locking is unreliable on network file systems, so workers should run
+    on the machine holding the database.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        """
+        :param path: SQLite database file, created if it doesn't exist
+        :param max_attempts: Claims of a task before it is marked failed
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id TEXT PRIMARY KEY,
+                    scene TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_until REAL,
+                    error TEXT,
+                    completed TEXT
+                );
+                CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, scene);
+            """)
+
+    def put(self, tasks):
+        with self._lock:
+            self._transaction(lambda: self._conn.executemany(
+                'INSERT OR IGNORE INTO tasks (id, scene, payload) VALUES (?, ?, ?)',
+                [(task['id'], task['scene'], json.dumps(task)) for task in tasks]))
+
+    def claim(self, worker, count=1, lease=3600):
+        claimable = "(status = 'pending' OR (status = 'claimed' AND lease_until < ? AND attempts < ?))"
+
+        def claim():
+            now = time.time()
+            #Tasks whose last worker died (ex. killed by running out of memory) with no attempts left
+            self._conn.execute("UPDATE tasks SET status = 'failed', error = 'Lease expired after the last attempt' "
+                               "WHERE status = 'claimed' AND lease_until < ? AND attempts >= ?",
+                               (now, self.max_attempts))
+            row = self._conn.execute('SELECT scene FROM tasks WHERE {} ORDER BY rowid LIMIT 1'.format(claimable),
+                                     (now, self.max_attempts)).fetchone()
+            if row is None:
+                return []
+            rows = self._conn.execute('SELECT id, payload FROM tasks WHERE {} AND scene = ? ORDER BY rowid LIMIT ?'.format(
+                claimable), (now, self.max_attempts, row[0], count)).fetchall()
+            self._conn.executemany("UPDATE tasks SET status = 'claimed', worker = ?, lease_until = ?, "
+                                   "attempts = attempts + 1 WHERE id = ?", [(worker, now + lease, x[0]) for x in rows])
+            return [json.loads(x[1]) for x in rows]
+
+        with self._lock:
+            return self._transaction(claim)
+
+    def complete(self, task, worker):
+        """Mark a task done, ignored when `worker` no longer holds its claim (its lease expired and it was reclaimed)"""
+        with self._lock:
+            self._transaction(lambda: self._conn.execute(
+                "UPDATE tasks SET status = 'done', error = NULL, completed = ? "
+                "WHERE id = ? AND worker = ? AND status = 'claimed'",
+                (datetime.datetime.now(datetime.timezone.utc).isoformat(), task['id'], worker)))
+
+    def fail(self, task, worker, error):
+        """
+        Return the task to the queue, or mark it failed once it used all its attempts.  Ignored when `worker` no longer
+        holds its claim.
+        """
+        with self._lock:
+            self._transaction(lambda: self._conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ? "
+                "WHERE id = ? AND worker = ? AND status = 'claimed'", (self.max_attempts, error, task['id'], worker)))
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall()
+        return dict(rows)
+
+    def _transaction(self, func):
+        #BEGIN IMMEDIATE takes the write lock up front so two claims can't select the same tasks
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func()
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+        return result
+
+
+def work(grid, queue, worker=None, batch=16, lease=3600):
+    """
+    Worker loop: claim tasks and ingest them until the queue has nothing left to claim.
+    :param grid: Grid the tasks are ingested into, with its catalog if assets should be recorded
+    :param queue: TaskQueue
+    :param worker: Name recorded with each task, defaults to host:pid
+    :param batch: Tasks claimed at once, ideally a multiple of the bands per scene so cells are processed together
+    :param lease: Seconds a claim lasts, longer than ingesting a batch takes
+    :return: Number of tasks completed
+    """
+    worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+    completed = 0
+    while True:
+        tasks = queue.claim(worker, batch, lease)
+        if not tasks:
+            return completed
+        completed += process(grid, queue, tasks, worker)
+
+
+def process(grid, queue, tasks, worker):
+    """
+    Ingest claimed tasks of one scene.  Cells needing the same bands are ingested together, so the scene is opened (and
+    reprojected) once per group rather than once per task.
+    """
+    groups = {}
+    for task in tasks:
+        key = (task['scene'], task['sensor'], task['date'], json.dumps(task['options'], sort_keys=True))
+        groups.setdefault(key, {}).setdefault(task['geohash'], []).append(task)
+
+    completed = 0
+    for (scene, sensor, date, options), cells in groups.items():
+        options = json.loads(options)
+        by_bands = {}
+        for geohash, cell_tasks in cells.items():
+            bands = tuple(sorted(set([task['band'] for task in cell_tasks]), key=lambda x: x or 0))
+            by_bands.setdefault(bands, []).append(geohash)
+        for bands, geohashes in by_bands.items():
+            group = [task for geohash in geohashes for task in cells[geohash]]
+            config = {'sensor': sensor, 'date': datetime.datetime.strptime(date, '%Y-%m-%d')}
+            try:
+                grid.ingest(scene, config, cog_profile=getattr(profiles, options.get('cog_profile') or 'DefaultCOG'),
+                            split_bands=options.get('split_bands', True), epsg=options.get('epsg'),
+                            update=options.get('update', False), cells=geohashes,
+                            bands=None if None in bands else list(bands))
+            except Exception:
+                error = traceback.format_exc()
+                for task in group:
+                    queue.fail(task, worker, error)
+                continue
+            for task in group:
+                queue.complete(task, worker)
+            completed += len(group)
+    return completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plan and run distributed ingests')
+    subparsers = parser.add_subparsers(dest='command')
+
+    plan_parser = subparsers.add_parser('plan', help='Expand scenes into a task manifest')
+    plan_parser.add_argument('--root', required=True, help='Bucket of the grid')
+    plan_parser.add_argument('--scenes', required=True, help='JSON lines file of scenes (path, sensor, date)')
+    plan_parser.add_argument('--manifest', required=True)
+    plan_parser.add_argument('--no-split-bands', action='store_true')
+    plan_parser.add_argument('--epsg', type=int)
+    plan_parser.add_argument('--update', action='store_true')
+    plan_parser.add_argument('--cog-profile', help='Name of a profile in cognition.cog.profiles')
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='Load a task manifest into a queue')
+    enqueue_parser.add_argument('--manifest', required=True)
+    enqueue_parser.add_argument('--queue', required=True, help='SQLite database of the queue')
+
+    work_parser = subparsers.add_parser('work', help='Claim and ingest tasks until the queue is drained')
+    work_parser.add_argument('--root', required=True, help='Bucket of the grid')
+    work_parser.add_argument('--queue', required=True, help='SQLite database of the queue')
+    work_parser.add_argument('--catalog', help='SQLite catalog ingested assets are recorded in')
+    work_parser.add_argument('--batch', type=int, default=16)
+    work_parser.add_argument('--lease', type=int, default=3600)
+    work_parser.add_argument('--max-attempts', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        with open(args.scenes) as f:
+            scenes = [json.loads(line) for line in f if line.strip()]
+        options = {key: value for key, value in [('epsg', args.epsg), ('update', args.update),
+                                                 ('cog_profile', args.cog_profile)] if value}
+        tasks = plan(Grid(args.root), [(x['path'], x) for x in scenes], split_bands=not args.no_split_bands, **options)
+        write_manifest(tasks, args.manifest)
+        print("Planned {} tasks from {} scenes".format(len(tasks), len(scenes)))
+    elif args.command == 'enqueue':
+        queue = SQLiteQueue(args.queue)
+        queue.put(read_manifest(args.manifest))
+        print(queue.counts())
+    elif args.command == 'work':
+        queue = SQLiteQueue(args.queue, max_attempts=args.max_attempts)
+        completed = work(Grid(args.root, catalog=args.catalog), queue, batch=args.batch, lease=args.lease)
+        print("Completed {} tasks, queue: {}".format(completed, queue.counts()))
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
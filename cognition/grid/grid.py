@@ -6,14 +6,25 @@ from shapely.geometry import shape
 from shapely.ops import transform
 import boto3
 import json
+import uuid
+import tempfile
+import datetime
+import collections
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from osgeo import gdal
+from osgeo import gdal, gdal_array, osr
 
 from cognition.index.indices import get_tree
 from cognition.query.geohash import bbox_query
 from cognition.pygdal.raster import RasterDataset, BandStack
+from cognition.pygdal.config import pygdal_config
 from cognition.cog.cog import COG
+from cognition.cog import tiff
+from cognition.cog.profiles import DefaultCOG, resolve
+from cognition.grid.mosaic import Mosaic, snap_extent
+from cognition.grid.cube import Cube
+from cognition.grid.catalog import Catalog, band_number
 
 s3 = boto3.resource('s3')
 
@@ -105,7 +116,8 @@ class Cell(object):
         "Upload a grid cell to s3://{root}{geohash}/{metadata.json}"
         data = {'bounds': self.bounds,
                 'centroid': self.centroid,
-                'geometry': self.__geo_interface__}
+                'geometry': self.__geo_interface__,
+                'epsg': self.settings.get('epsg')}
         try:
             object = s3.Object(self.settings['root'], os.path.join(self.geohash, 'metadata.json'))
             object.put(Body=json.dumps(data))
@@ -143,11 +155,23 @@ class Grid(object):
         bucket = s3.Bucket(root)
         return list(set([os.path.split(x.key)[0].split('/')[0] for x in bucket.objects.all()]))
 
-    def __init__(self, root):
+    def __init__(self, root, catalog=None):
+        """
+        :param catalog: Optional Catalog (or path of its SQLite file) recording the cells of the grid and every asset
+                        ingested, the grid is then opened and queried without listing the bucket.
+        """
         self.root = root
-        self.geohashes = self.get_geohashes(root)
         self._index = None
         self.bucket = s3.Bucket(self.root)
+        self.catalog = Catalog(catalog) if isinstance(catalog, str) else catalog
+        #With a catalog the bucket is only listed once, to record the cells of a grid the catalog doesn't know yet
+        self.geohashes = self.catalog.geohashes() if self.catalog is not None else []
+        if not self.geohashes:
+            self.geohashes = self.get_geohashes(root)
+            if self.catalog is not None:
+                self.catalog.add_cells(self.geohashes)
+        #Optional TileCache shared by every query on this grid
+        self.tile_cache = None
 
     @property
     def index(self):
@@ -164,85 +188,393 @@ class Grid(object):
         else:
             self.index = get_tree(self.geohashes, index_name)
 
-    def ingest(self, img_path, config, multi=False, cog_profile=None, split_bands=True):
-        """Method to ingest an image into the architecture"""
+    def ingest(self, img_path, config, multi=False, cog_profile=None, split_bands=True, epsg=None, warp_profile=None,
+               update=False, cells=None, bands=None, warp_dir=None):
+        """
+        Method to ingest an image into the architecture.  If the image's CRS differs from the grid's, the whole scene
+        is warped once into a tiled intermediate in the grid CRS and every cell is cut from that intermediate.  Each
+        cell window is read once for all bands, and skipped entirely when the source's compressed tiles can be copied.
+        :param epsg: EPSG of the grid, only needed for grids deployed before cell metadata recorded it.
+        :param warp_profile: Optional warp profile (see cognition.pygdal.warp) used for that reprojection.
+        :param warp_dir: Directory the reprojected intermediate is written to (and deleted from once the scene is
+                         ingested), defaults to the system temp directory.  Pass '/vsimem/' to keep it in memory.
+        :param update: Merge the scene into assets which already exist for the date instead of replacing them, only
+                       re-encoding the tiles and overview regions the scene covers (ex. a partial new acquisition).
+        :param cells: Optional geohashes to restrict the ingest to, other intersecting cells are skipped.
+        :param bands: Optional band numbers to restrict a split ingest to (see cognition.grid.distributed).
+        """
         if not self.index:
             # Build the default index is index is not set
             self.build_index()
         ds = RasterDataset(gdal.Open(img_path))
-        res = bbox_query(ds.extent, self.index, 12)
+        res = bbox_query(_geographic_extent(ds), self.index, 12)
+        if cells is not None:
+            res = [geohash for geohash in res if geohash in cells]
         fname = os.path.split(img_path)[-1]
 
-        #Setting up a package of raster data we will iterate over
+        cells = {}
+        for geohash in res:
+            metadata = s3.Object(self.root, os.path.join(geohash, 'metadata.json')).get()['Body'].read()
+            cells[geohash] = json.loads(metadata.decode('utf-8'))
+        grid_epsg = epsg or next((meta['epsg'] for meta in cells.values() if meta.get('epsg')), None)
+
+        warped = None
+        grid_srs = None
+        if grid_epsg:
+            grid_srs = osr.SpatialReference()
+            grid_srs.ImportFromEPSG(grid_epsg)
+        #Compare spatial references rather than EPSG codes, projections read from ENVI/ERDAS headers often have none
+        if grid_srs and not ds.srs.srs.IsSame(grid_srs):
+            print("Reprojecting {} to EPSG:{}".format(fname, grid_epsg))
+            warp_kwargs = {'profile': warp_profile} if warp_profile else {}
+            ds = warped = ds.Reproject(grid_srs, materialize=True, out_dir=warp_dir or tempfile.gettempdir(),
+                                       **warp_kwargs)
+
+        profile = cog_profile or DefaultCOG
+        split = os.path.splitext(fname)
         if split_bands:
-            package = ds.SplitBands()
+            outputs = [(band, split[0] + '_B{}'.format(band) + split[1]) for band in range(1, ds.shape[2]+1)
+                       if bands is None or band in bands]
         else:
-            package = [ds]
+            outputs = [(None, fname)]
+        #Resolve the profile once per output (ex. ProfilingCOG trial encodes), every cell binds it to its own window
+        profiles = {band: _resolve_profile(ds, profile, band) for band, _ in outputs}
+
+        #Parse the TIFF structure of the scene once, every cell's tile copy plans against it
+        reader = source = None
+        if ds.ds.GetDriver().ShortName == 'GTiff':
+            try:
+                reader = tiff.VSIReader(ds.filename)
+                source = tiff.TiffFile(reader.read)
+            except tiff.TiffError:
+                source = None
 
-        args = []
-        #Figuring out all the operations we want to perform
-        for geohash in res:
-            meta = json.loads(s3.Object(self.root, os.path.join(geohash, 'metadata.json')).get()['Body'].read().decode('utf-8'))
-            bounds = meta['bounds']
-            for idx, asset in enumerate(package):
-                if split_bands:
-                    split = os.path.splitext(fname)
-                    band_fname = split[0] + '_B{}'.format(idx+1) + split[1]
-                    prefix = os.path.join(self.root, geohash, config['sensor'], config['date'].strftime('%Y-%m-%d'))
-                    args.append(
-                        {'grid_bounds': bounds,
-                         'prefix': prefix,
-                         'fname': band_fname,
-                         'data': asset,
-                         }
-                        )
-                else:
-                    prefix = os.path.join(self.root, geohash, config['sensor'], config['date'].strftime('%Y-%m-%d'))
-                    args.append({'grid_bounds': bounds,
-                                 'prefix': prefix,
-                                 'fname': fname,
-                                 'data': asset})
-
-        #Performing the operations
-        for item in args:
-            print("Processing {}".format(os.path.join(item['prefix'], item['fname'])))
-            clip = item['data'].BboxClip(item['grid_bounds'])
-            if cog_profile:
-                cog = clip.Cogify(profile=cog_profile)
-            else:
-                cog = clip.Cogify()
-            cog.Upload(item['prefix'], name=item['fname'])
+        try:
+            for geohash, meta in cells.items():
+                bounds = meta['bounds']
+                prefix = os.path.join(self.root, geohash, config['sensor'], config['date'].strftime('%Y-%m-%d'))
+
+                #Assets already in the cell are updated in place when requested, only the tiles the scene covers change
+                updates, pending = [], []
+                for band, out_name in outputs:
+                    print("Processing {}".format(os.path.join(prefix, out_name)))
+                    existing = '/vsis3/{}'.format(os.path.join(prefix, out_name))
+                    if update and gdal.VSIStatL(existing) is not None:
+                        updates.append((band, out_name, existing))
+                        continue
+                    #Copy the compressed source tiles when they line up with the cell, otherwise clip and re-encode
+                    cog = ds.TileCopy(bounds, profile=profiles[band], band=band, source=source)
+                    if cog:
+                        self._publish(cog, prefix, out_name, geohash, config, band)
+                    else:
+                        pending.append((band, out_name))
+
+                #Read the cell window once for all bands and write every band's COG from that read
+                if pending:
+                    for (band, out_name), clip in zip(pending, self._clip_bands(ds, bounds, pending, split_bands)):
+                        self._publish(clip.Cogify(profile=profiles[band]), prefix, out_name, geohash, config, band)
+                footprint = [max(bounds[0], ds.extent[0]), min(bounds[1], ds.extent[1]),
+                             max(bounds[2], ds.extent[2]), min(bounds[3], ds.extent[3])]
+                #Cells are selected from the lon/lat extent, so a cell may not overlap the scene in the grid CRS
+                if updates and footprint[0] < footprint[1] and footprint[2] < footprint[3]:
+                    clips = self._clip_bands(ds, footprint, updates, split_bands)
+                    for (band, out_name, existing), clip in zip(updates, clips):
+                        cog = COG(gdal.Open(existing)).Update(clip, profile=profiles[band])
+                        self._publish(cog, prefix, out_name, geohash, config, band)
+        finally:
+            if reader:
+                reader.close()
+
+        if warped:
+            warped_fname = warped.filename
+            warped = ds = None
+            gdal.Unlink(warped_fname)
+
+    def ingest_plan(self, img_path, split_bands=True):
+        """List the (geohash, band) outputs `ingest` would write for an image, band is None when not splitting bands"""
+        if not self.index:
+            self.build_index()
+        ds = RasterDataset(gdal.Open(img_path))
+        bands = list(range(1, ds.shape[2]+1)) if split_bands else [None]
+        return [(geohash, band) for geohash in bbox_query(_geographic_extent(ds), self.index, 12) for band in bands]
+
+    def _publish(self, cog, prefix, out_name, geohash, config, band):
+        """Upload an asset and record it in the catalog"""
+        response = cog.Upload(prefix, name=out_name)
+        if self.catalog is not None:
+            date = config['date'].strftime('%Y-%m-%d')
+            self.catalog.add(os.path.join(geohash, config['sensor'], date, out_name), geohash, config['sensor'], date,
+                             band=band, etag=(response or {}).get('ETag'), cols=cog.shape[0], rows=cog.shape[1],
+                             gt=cog.gt, epsg=_epsg(cog))
 
-    def query(self, extent, temporal, sensor, bands):
+    @staticmethod
+    def _clip_bands(ds, bbox, items, split_bands):
+        if split_bands:
+            return ds.BboxSplit(bbox, bands=[item[0] for item in items])
+        return [ds.BboxClip(bbox)]
+
+    def query(self, extent, temporal, sensor, bands, mosaic=None, io_profile='s3', cache=None, workers=4, path=None):
+        """
+        Query the assets of a sensor on a date, or range of dates, which intersect an extent.
+        :param temporal: Date of the assets, or (start, end) tuple of dates (inclusive).  A range returns an OrderedDict
+                         of date: result in date order for every date with assets, see `iter_query`.
+        :param mosaic: By default a list of BandStack objects (one per block per cell) is returned.  Pass 'array' to
+                       read every intersecting tile directly into one preallocated array covering the extent, or 'vrt'
+                       to assemble a single VRT mosaic of the extent.  Both return one RasterDataset.
+        :param io_profile: Name of the pygdal_config I/O profile assets are opened and read with.  VRT results are read
+                           lazily, wrap reads of them in pygdal_config.io_scope for the same tuning.
+        :param cache: TileCache (see cognition.cog.cache) tiles are read through, defaults to the grid's `tile_cache`.
+                      Repeated queries of the same cells then don't download tiles again.  With a cache, BandStack and
+                      VRT results are built over blocks materialized from cached tiles rather than over the assets.
+        :param workers: Dates of a range read concurrently
+        :param path: With mosaic='array', optional .npy file the mosaic is memory-mapped to with a geotransform sidecar
+                     (see cognition.pygdal.arrayfile), for extents larger than memory.  See `cube` for date ranges.
+        """
+        if path and mosaic != 'array':
+            raise ValueError("Only array mosaics can be written to an array file")
+        if isinstance(temporal, (tuple, list)):
+            if path:
+                raise ValueError("Use Grid.cube to write a date range to an array file")
+            return collections.OrderedDict(self.iter_query(extent, temporal[0], temporal[1], sensor, bands, mosaic,
+                                                           io_profile, cache, workers))
+        dates, etags = self._resolve(extent, temporal, temporal, sensor, bands)
+        with pygdal_config.io_scope(io_profile):
+            return self._query(extent, dates.get(_as_date(temporal), {}), etags, mosaic, io_profile,
+                               cache or self.tile_cache, path)
+
+    def iter_query(self, extent, start, end, sensor, bands, mosaic='array', io_profile='s3', cache=None, workers=4):
+        """
+        Stream the time series of an extent: yields (date, result) for every date between `start` and `end` (inclusive)
+        with assets, in date order.  The assets of the whole range are resolved up front with one range scan of the
+        catalog (or one listing per cell starting at `start`), then up to `workers` dates are read concurrently ahead
+        of the consumer.  Arguments are the same as `query`.
+        """
+        dates, etags = self._resolve(extent, start, end, sensor, bands)
+        cache = cache or self.tile_cache
+
+        def read(assets):
+            with pygdal_config.io_scope(io_profile):
+                return self._query(extent, assets, etags, mosaic, io_profile, cache)
+
+        read = pygdal_config.bind(read)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            #Bound the dates in flight so results are produced no faster than they're consumed
+            pending = collections.deque()
+            for date, assets in dates.items():
+                pending.append((date, executor.submit(read, assets)))
+                if len(pending) > workers:
+                    date, future = pending.popleft()
+                    yield date, future.result()
+            while pending:
+                date, future = pending.popleft()
+                yield date, future.result()
+
+    def cube(self, extent, start, end, sensor, bands, level=0, path=None, io_profile='s3', cache=None, workers=8):
+        """
+        Read an extent across a range of dates into one Cube (see cognition.grid.cube) of shape
+        (dates, bands, rows, cols), for every date between `start` and `end` (inclusive) with assets.  Every asset is
+        fetched concurrently straight into its slice of the preallocated array, use `Cube.masked` for nodata masking.
+        :param level: Overview level to read (0 for full resolution), ex. 2 for a quick look at a quarter resolution.
+        :param path: Optional .npy file the cube is memory-mapped to, for cubes larger than memory.
+        :param workers: Assets read concurrently
+        Other parameters are the same as `query`.  Returns None when no asset matches.
+        """
+        dates, etags = self._resolve(extent, start, end, sensor, bands)
+        items = [(t, item) for t, assets in enumerate(dates.values()) for files in assets.values() for item in files]
+        if not items:
+            return None
+        band_numbers = sorted(set([band_number(item) for _, item in items]))
+        cache = cache or self.tile_cache
+
+        with pygdal_config.io_scope(io_profile):
+            sample = COG(gdal.Open('/vsis3/{}'.format(items[0][1])))
+            xres, yres = sample.xres, sample.yres
+            if level:
+                overview = sample.ds.GetRasterBand(1).GetOverview(level - 1)
+                xres *= int(round(sample.shape[0] / float(overview.XSize)))
+                yres *= int(round(sample.shape[1] / float(overview.YSize)))
+            ds_cube = Cube(extent, dates.keys(), band_numbers, xres, yres,
+                           gdal_array.GDALTypeCodeToNumericTypeCode(sample.ds.GetRasterBand(1).DataType),
+                           nodata=sample.nodatavalue, origin=(sample.tlx, sample.tly), path=path)
+            ds_cube.srs = sample.srs.ExportToWkt()
+            sample = overview = None
+
+        def read(item):
+            t, fname = item
+            with pygdal_config.io_scope(io_profile):
+                ds_cube.add(COG(gdal.Open('/vsis3/{}'.format(fname)), etag=etags.get(fname)), t,
+                            band_numbers.index(band_number(fname)), cache=cache, level=level)
+
+        #Every asset fills its own slice of the cube, so they can be written concurrently
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(pygdal_config.bind(read), items))
+        ds_cube.flush()
+        return ds_cube
+
+    def _resolve(self, extent, start, end, sensor, bands):
+        """Cells intersecting the extent and their assets between two dates, see `_find_assets`"""
         res = bbox_query(extent, self.index, 12)
+        etags = {}
+        return self._find_assets(res, start, end, sensor, bands, etags), etags
+
+    def _query(self, extent, assets, etags, mosaic, io_profile, cache, path=None):
+        if mosaic == 'array':
+            return self._mosaic_array(extent, assets, cache, etags, path)
+        elif mosaic == 'vrt':
+            return self._mosaic_vrt(extent, assets, cache, etags)
+        elif mosaic:
+            raise ValueError("Unknown mosaic type '{}', expected 'array' or 'vrt'".format(mosaic))
 
         band_stack = []
-        # for i in bands:
-        #     args['band'+str(i)] = []
-        for hash in res:
-            prefix = os.path.join(hash, sensor, temporal.strftime('%Y-%m-%d'))
-            # First find all files that match the query within this grid (this will be handled by STAC in later versions)
-            files = [os.path.join(self.root, x.key) for x in self.bucket.objects.filter(Prefix=prefix) if int(os.path.splitext(x.key)[0][-1]) in bands]
-            if len(files) > 0:
-                # Now find all of the offsets within the query extent
-                # Open one COG as a sample (assuming other assets of same sensor are similar)
-                ds = COG(gdal.Open('/vsis3/{}'.format(files[0])))
-                offsets = list(ds.offsets(filter=extent))
-                ds = None
-                band_list = []
-                for item in files:
-                    blocks = COG(gdal.Open('/vsis3/{}'.format(item))).blocks(offsets=offsets)
-                    band_list.append(blocks)
-                band_zipped = zip(*band_list)
-                for item in band_zipped:
-                    band_stack.append(BandStack(item))
+        for files in assets.values():
+            # Now find all of the offsets within the query extent
+            # Open one COG as a sample (assuming other assets of same sensor are similar)
+            ds = COG(gdal.Open('/vsis3/{}'.format(files[0])))
+            offsets = list(ds.offsets(filter=extent))
+            ds = None
+            band_list = []
+            for item in files:
+                blocks = COG(gdal.Open('/vsis3/{}'.format(item)), etag=etags.get(item)).blocks(
+                    offsets=offsets, io_profile=io_profile, cache=cache)
+                band_list.append(blocks)
+            band_zipped = zip(*band_list)
+            for item in band_zipped:
+                band_stack.append(BandStack(item))
         return band_stack
 
+    def _find_assets(self, hashes, start, end, sensor, bands, etags=None):
+        """
+        Find the files of each cell matching the query between two dates (inclusive), returns an OrderedDict sorted by
+        date of date: {geohash: [files sorted by band]}
+        :param etags: Optional dictionary filled with the ETag of each file
+        """
+        start, end = _as_date(start), _as_date(end)
+        dates = {}
+        if self.catalog is not None:
+            #The catalog is indexed on (geohash, sensor, date, band) so this is one range scan per cell
+            for record in self.catalog.find(hashes, sensor, start, end, bands=bands):
+                fname = os.path.join(self.root, record['key'])
+                dates.setdefault(_as_date(record['date']), {}).setdefault(record['geohash'], []).append(fname)
+                if etags is not None:
+                    etags[fname] = record['etag']
+        else:
+            # Keys of a cell are listed in date order, so start the listing at the first date and stop after the last
+            for hash in hashes:
+                prefix = os.path.join(hash, sensor) + '/'
+                marker = prefix + start.strftime('%Y-%m-%d')
+                for x in self.bucket.objects.filter(Prefix=prefix, Marker=marker):
+                    date = x.key[len(prefix):].split('/')[0]
+                    if date > end.strftime('%Y-%m-%d'):
+                        break
+                    if band_number(x.key) in bands:
+                        fname = os.path.join(self.root, x.key)
+                        dates.setdefault(_as_date(date), {}).setdefault(hash, []).append(fname)
+                        if etags is not None:
+                            etags[fname] = x.e_tag
+            for assets in dates.values():
+                for files in assets.values():
+                    files.sort(key=band_number)
+        return collections.OrderedDict(sorted(dates.items()))
+
+    def _mosaic_array(self, extent, assets, cache=None, etags=None, path=None):
+        """
+        Read every asset intersecting the extent into one preallocated array, one band per requested band
+        :param path: Optional .npy file the array is memory-mapped to
+        """
+        files = [item for files in assets.values() for item in files]
+        if not files:
+            return None
+        band_numbers = sorted(set([band_number(x) for x in files]))
+        sample = COG(gdal.Open('/vsis3/{}'.format(files[0])))
+        ds_mosaic = Mosaic(extent, sample.xres, sample.yres, len(band_numbers),
+                           gdal_array.GDALTypeCodeToNumericTypeCode(sample.ds.GetRasterBand(1).DataType),
+                           nodata=sample.nodatavalue, origin=(sample.tlx, sample.tly), path=path)
+        ds_mosaic.srs = srs = sample.srs.ExportToWkt()
+        sample = None
+        for item in files:
+            ds_mosaic.add(COG(gdal.Open('/vsis3/{}'.format(item)), etag=(etags or {}).get(item)),
+                          band_numbers.index(band_number(item)), cache=cache)
+        ds_mosaic.flush()
+        return ds_mosaic.to_raster(srs)
+
+    def _mosaic_vrt(self, extent, assets, cache=None, etags=None):
+        """
+        Build one VRT per band over all intersecting cells and stack them
+        :param cache: Optional TileCache, the VRTs are then built over blocks read through the cache rather than over
+                      the assets in storage
+        """
+        files = [item for files in assets.values() for item in files]
+        if not files:
+            return None
+        sample = COG(gdal.Open('/vsis3/{}'.format(files[0])))
+        # Snap the extent to the pixel grid of the assets so the VRT does not resample
+        bounds = snap_extent(extent, sample.xres, sample.yres, (sample.tlx, sample.tly))
+        band_vrts = []
+        for band in sorted(set([band_number(x) for x in files])):
+            fname = '/vsimem/mosaic/{}_B{}.vrt'.format(str(uuid.uuid4().hex), band)
+            sources = ['/vsis3/{}'.format(x) for x in files if band_number(x) == band]
+            if cache is not None:
+                sources = [block for x in files if band_number(x) == band
+                           for block in self._cached_blocks(x, extent, cache, (etags or {}).get(x))]
+            gdal.BuildVRT(fname, sources,
+                          outputBounds=(bounds[0], bounds[2], bounds[1], bounds[3]),
+                          xRes=sample.xres, yRes=sample.yres, srcNodata=sample.nodatavalue)
+            band_vrts.append(fname)
+        return BandStack(band_vrts)
+
+    @staticmethod
+    def _cached_blocks(item, extent, cache, etag):
+        ds = COG(gdal.Open('/vsis3/{}'.format(item)), etag=etag)
+        return [ds.cached_block(offset, cache) for offset in ds.offsets(filter=extent)]
+
 
 
 def _uploadcell(cell):
     cell.upload()
 
+def _resolve_profile(ds, profile, band=None):
+    """Resolve a COG profile against one band (or all bands) of a scene"""
+    view_fname = '/vsimem/profile/{}.vrt'.format(uuid.uuid4().hex)
+    view = gdal.Translate(view_fname, ds.ds, format='VRT', bandList=[band] if band else None)
+    try:
+        return resolve(profile, RasterDataset(view))
+    finally:
+        view = None
+        gdal.Unlink(view_fname)
+
+def _epsg(ds):
+    """EPSG code of a raster, None when its spatial reference has no authority code (ex. ENVI/ERDAS WKT)"""
+    try:
+        return ds.epsg
+    except (TypeError, ValueError):
+        return None
+
+def _geographic_extent(ds, densify=21):
+    """
+    Extent of a raster in EPSG:4326 of form (xmin, xmax, ymin, ymax).  Cells are looked up by geohash, which is lon/lat,
+    so projected extents are transformed first.  Edges are densified as they curve once reprojected.
+    """
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    if ds.srs.srs.IsSame(wgs84):
+        return ds.extent
+    xmin, xmax, ymin, ymax = ds.extent
+    steps = [i / float(densify - 1) for i in range(densify)]
+    xs = [xmin + (xmax - xmin) * t for t in steps]
+    ys = [ymin + (ymax - ymin) * t for t in steps]
+    ring = [(x, ymax) for x in xs] + [(xmax, y) for y in ys] + [(x, ymin) for x in xs] + [(xmin, y) for y in ys]
+    project = partial(pyproj.transform, pyproj.Proj(ds.srs.ExportToProj4()), pyproj.Proj(init='epsg:4326'))
+    lons, lats = project([x for x, y in ring], [y for x, y in ring])
+    return [min(lons), max(lons), min(lats), max(lats)]
+
+def _as_date(value):
+    """datetime.date of a date, datetime or 'YYYY-MM-DD' string"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
 def read_vsimem(fn):
     '''Retrieve XML string from /vsimem/*.vrt'''
     vsifile = gdal.VSIFOpenL(fn,'r')
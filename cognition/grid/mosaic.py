@@ -0,0 +1,154 @@
+import os
+import math
+import numpy as np
+from osgeo import gdal_array
+
+from cognition.pygdal.raster import RasterDataset
+from cognition.pygdal import arrayfile
+
+
+def snap_extent(extent, xres, yres, origin):
+    """
+    Snap an extent of form (xmin, xmax, ymin, ymax) outward to the pixel grid passing through `origin` (x, y).
+    """
+    ox, oy = origin
+    return [ox + math.floor((extent[0] - ox) / xres + 1e-9) * xres,
+            ox + math.ceil((extent[1] - ox) / xres - 1e-9) * xres,
+            oy - math.ceil((oy - extent[2]) / yres - 1e-9) * yres,
+            oy - math.floor((oy - extent[3]) / yres + 1e-9) * yres]
+
+
+class Mosaic(object):
+
+    """
+    A preallocated array covering a query extent.  The extent is snapped outward to the pixel grid of the source
+    assets, so fetched tiles are read straight into their slice of the array without resampling or intermediate copies.
+    """
+
+    def __init__(self, extent, xres, yres, count, dtype, nodata=None, origin=None, path=None):
+        """
+        :param extent: Extent of the mosaic of form (xmin, xmax, ymin, ymax)
+        :param xres: Pixel width of the mosaic (and of every asset added to it)
+        :param yres: Pixel height of the mosaic (positive)
+        :param count: Number of bands
+        :param dtype: NumPy dtype of the mosaic
+        :param nodata: Fill value for pixels not covered by any asset
+        :param origin: Optional (x, y) of any pixel corner of the source grid, used to snap the extent
+        :param path: Optional .npy file the mosaic is memory-mapped to (see cognition.pygdal.arrayfile), created or
+                     overwritten along with its geotransform sidecar
+        """
+        self.xres = xres
+        self.yres = yres
+        self.nodata = nodata
+        self.path = path
+        #WKT of the spatial reference, set by the caller
+        self.srs = None
+        xmin, xmax, ymin, ymax = snap_extent(extent, xres, yres, origin or (extent[0], extent[3]))
+        self.gt = (xmin, xres, 0.0, ymax, 0.0, -yres)
+        self.cols = int(round((xmax - xmin) / xres))
+        self.rows = int(round((ymax - ymin) / yres))
+        self.array = self._allocate(count, dtype)
+        #Without a nodata value uncovered pixels can't be told from data, so track the pixels assets were read into
+        self.coverage = self._allocate_coverage() if nodata is None else None
+
+    def _allocate(self, count, dtype):
+        shape = self._shape(count)
+        if self.path:
+            return arrayfile.create(self.path, shape, dtype, fill=self.fill, **self._metadata())
+        return np.full(shape, self.fill, dtype=dtype)
+
+    def _allocate_coverage(self):
+        if self.path:
+            return np.lib.format.open_memmap(os.path.splitext(self.path)[0] + '_coverage.npy', mode='w+', dtype=bool,
+                                             shape=self.array.shape)
+        return np.zeros(self.array.shape, dtype=bool)
+
+    def _shape(self, count):
+        return (count, self.rows, self.cols)
+
+    def _metadata(self):
+        return {'gt': list(self.gt), 'srs': self.srs, 'nodata': self.nodata}
+
+    def flush(self):
+        """Write a memory-mapped mosaic and its sidecar to disk"""
+        if self.path:
+            self.array.flush()
+            if self.coverage is not None:
+                self.coverage.flush()
+            arrayfile.write_metadata(self.path, **self._metadata())
+
+    @property
+    def fill(self):
+        return self.nodata if self.nodata is not None else 0
+
+    @property
+    def extent(self):
+        return [self.gt[0], self.gt[0] + self.cols * self.xres, self.gt[3] - self.rows * self.yres, self.gt[3]]
+
+    def add(self, ds, index, band=1, cache=None, level=0):
+        """
+        Read the part of a raster which overlaps the mosaic directly into band `index` (0-indexed) of the mosaic.
+        :param ds: RasterDataset sharing the resolution of the mosaic (at `level`).
+        :param band: Band of `ds` to read.
+        :param cache: Optional TileCache the tiles are read through, `ds` must be a COG.
+        :param level: Overview level of `ds` to read (0 for full resolution), `ds` must be a COG.
+        :return: The (xoff, yoff, xsize, ysize) window of the mosaic that was filled, or None if there is no overlap.
+        """
+        coverage = self.coverage[index:index+1] if self.coverage is not None else None
+        return self._read(ds, self.array[index:index+1], band, cache, level, coverage)
+
+    def masked(self):
+        """
+        The array as a NumPy masked array (without copying it) masking nodata pixels, which includes every pixel no
+        asset covered.  When the assets have no nodata value the pixels no asset covered are masked instead.
+        """
+        if self.nodata is None:
+            return np.ma.masked_array(self.array, mask=~self.coverage)
+        if isinstance(self.nodata, float) and math.isnan(self.nodata):
+            return np.ma.masked_invalid(self.array, copy=False)
+        return np.ma.masked_equal(self.array, self.nodata, copy=False)
+
+    def _read(self, ds, array, band, cache, level, coverage=None):
+        """
+        Read `band` of `ds` into `array`, a view of shape (1, rows, cols) over the mosaic's pixel grid, and mark the
+        window read in `coverage`, a boolean view of the same shape
+        """
+        cols, rows = ds.shape[0], ds.shape[1]
+        xres, yres = ds.xres, ds.yres
+        if level:
+            overview = ds.ds.GetRasterBand(band).GetOverview(level - 1)
+            cols, rows = overview.XSize, overview.YSize
+            xres *= int(round(ds.shape[0] / float(cols)))
+            yres *= int(round(ds.shape[1] / float(rows)))
+        if abs(xres - self.xres) > 1e-6 * self.xres or abs(yres - self.yres) > 1e-6 * self.yres:
+            raise ValueError("Can only mosaic rasters with a resolution of {}x{}, got {}x{}".format(
+                self.xres, self.yres, xres, yres))
+        col = int(round((ds.tlx - self.gt[0]) / self.xres))
+        row = int(round((self.gt[3] - ds.tly) / self.yres))
+        xoff, yoff = max(col, 0), max(row, 0)
+        xsize = min(col + cols, self.cols) - xoff
+        ysize = min(row + rows, self.rows) - yoff
+        if xsize <= 0 or ysize <= 0:
+            return None
+        if cache is not None or level:
+            ds.read_window((xoff - col, yoff - row, xsize, ysize), bands=[band],
+                           buf=array[:, yoff:yoff+ysize, xoff:xoff+xsize], cache=cache, level=level)
+        else:
+            ds.ds.GetRasterBand(band).ReadAsArray(xoff - col, yoff - row, xsize, ysize,
+                                                  buf_obj=array[0, yoff:yoff+ysize, xoff:xoff+xsize])
+        if coverage is not None:
+            coverage[:, yoff:yoff+ysize, xoff:xoff+xsize] = True
+        return (xoff, yoff, xsize, ysize)
+
+    def to_raster(self, srs):
+        """
+        Wrap the mosaic array in a RasterDataset without copying it.
+        :param srs: WKT of the mosaic's spatial reference
+        """
+        ds = gdal_array.OpenArray(self.array)
+        ds.SetGeoTransform(self.gt)
+        ds.SetProjection(srs)
+        if self.nodata is not None:
+            for i in range(ds.RasterCount):
+                ds.GetRasterBand(i+1).SetNoDataValue(self.nodata)
+        return RasterDataset(ds)
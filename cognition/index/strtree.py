@@ -0,0 +1,119 @@
+import math
+import numpy as np
+
+
+class STRtree(object):
+
+    """
+    Packed R-tree bulk loaded with the Sort-Tile-Recursive algorithm.  The tree is immutable and stored entirely in
+    flat NumPy arrays (one set per level), so it is cheap to build, query and persist to disk.  Bounds use the
+    standard GDAL representation (xmin,xmax,ymin,ymax).
+    """
+
+    def __init__(self, bounds, ids=None, capacity=16, _levels=None):
+        """
+        :param bounds: Array of shape (n, 4) with the envelope of each item
+        :param ids: Optional array of n identifiers (ex. feature ids) returned by queries, defaults to the item index
+        :param capacity: Maximum number of children per node
+        """
+        self.capacity = capacity
+        bounds = np.asarray(bounds, dtype='f8').reshape(-1, 4)
+        ids = np.arange(len(bounds)) if ids is None else np.asarray(ids)
+        if _levels is not None:
+            self.bounds, self.ids, self.levels = bounds, ids, _levels
+            return
+
+        order = _str_order(bounds, capacity)
+        self.bounds = bounds[order]
+        self.ids = ids[order]
+
+        #Each level is a tuple of (bounds, start, count) where start/count index into the level below
+        self.levels = []
+        level_bounds = self.bounds
+        while len(level_bounds) > capacity or not self.levels:
+            node_bounds, start, count = _group(level_bounds, capacity)
+            if len(node_bounds) > capacity:
+                #Sort this level before grouping it into parents, children are only ever reordered once
+                order = _str_order(node_bounds, capacity)
+                node_bounds, start, count = node_bounds[order], start[order], count[order]
+            self.levels.append((node_bounds, start, count))
+            level_bounds = node_bounds
+
+    def __len__(self):
+        return len(self.ids)
+
+    def query(self, bbox):
+        """
+        Find all items whose envelope intersects a bounding box of form (xmin,xmax,ymin,ymax).
+        :return: Array of ids, ordered so that spatially close items are adjacent
+        """
+        if len(self.ids) == 0:
+            return self.ids
+        top = self.levels[-1][0]
+        nodes = np.nonzero(_intersects(top, bbox))[0]
+        for level in range(len(self.levels) - 1, -1, -1):
+            _, start, count = self.levels[level]
+            children = _expand(start[nodes], count[nodes])
+            child_bounds = self.levels[level - 1][0] if level > 0 else self.bounds
+            nodes = children[_intersects(child_bounds[children], bbox)]
+        return self.ids[nodes]
+
+    def save(self, path):
+        """Persist the tree to a .npz file"""
+        arrays = {'bounds': self.bounds, 'ids': self.ids, 'capacity': np.array(self.capacity)}
+        for idx, (bounds, start, count) in enumerate(self.levels):
+            arrays['level{}_bounds'.format(idx)] = bounds
+            arrays['level{}_start'.format(idx)] = start
+            arrays['level{}_count'.format(idx)] = count
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a tree written by STRtree.save"""
+        with np.load(path) as data:
+            levels = []
+            while 'level{}_bounds'.format(len(levels)) in data:
+                idx = len(levels)
+                levels.append((data['level{}_bounds'.format(idx)],
+                               data['level{}_start'.format(idx)],
+                               data['level{}_count'.format(idx)]))
+            return cls(data['bounds'], data['ids'], int(data['capacity']), _levels=levels)
+
+
+def _str_order(bounds, capacity):
+    """Sort-Tile-Recursive ordering: slice by x center, then sort each slice by y center"""
+    n = len(bounds)
+    if n == 0:
+        return np.arange(0)
+    cx = (bounds[:, 0] + bounds[:, 1]) / 2
+    cy = (bounds[:, 2] + bounds[:, 3]) / 2
+    slices = int(math.ceil(math.sqrt(math.ceil(n / float(capacity)))))
+    by_x = np.argsort(cx, kind='mergesort')
+    slice_of = np.empty(n, dtype='int64')
+    slice_of[by_x] = np.arange(n) // (slices * capacity)
+    return np.lexsort((cy, slice_of))
+
+def _group(bounds, capacity):
+    """Pack consecutive entries into nodes of `capacity` children"""
+    n = len(bounds)
+    start = np.arange(0, max(n, 1), capacity)
+    count = np.minimum(capacity, n - start)
+    if n == 0:
+        return np.empty((0, 4)), start[:0], count[:0]
+    node_bounds = np.stack([np.minimum.reduceat(bounds[:, 0], start),
+                            np.maximum.reduceat(bounds[:, 1], start),
+                            np.minimum.reduceat(bounds[:, 2], start),
+                            np.maximum.reduceat(bounds[:, 3], start)], axis=1)
+    return node_bounds, start, count
+
+def _expand(start, count):
+    """Concatenate the ranges [start, start+count) without a Python loop"""
+    total = int(count.sum())
+    if total == 0:
+        return np.arange(0)
+    offsets = np.repeat(start - np.concatenate([[0], np.cumsum(count)[:-1]]), count)
+    return offsets + np.arange(total)
+
+def _intersects(bounds, bbox):
+    return (bounds[:, 0] <= bbox[1]) & (bounds[:, 1] >= bbox[0]) & (bounds[:, 2] <= bbox[3]) & (bounds[:, 3] >= bbox[2])
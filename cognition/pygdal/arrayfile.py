@@ -0,0 +1,46 @@
+"""
+Memory-mapped array files: a .npy file holding the array, and a JSON sidecar of the same name holding its
+georeferencing (geotransform, spatial reference and nodata value).  Readers and queries fill them in place, so results
+larger than memory can be produced and processed out of core without extra copies.
+"""
+import os
+import json
+import numpy as np
+
+
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def create(path, shape, dtype, fill=None, **metadata):
+    """
+    Create (or overwrite) an array file and its sidecar, returning the writable memory-mapped array.
+    :param fill: Initial value of every element, new files are otherwise zero filled
+    :param metadata: JSON serializable sidecar entries, ex. gt, srs and nodata
+    """
+    array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+    if fill is not None and fill != 0:
+        array[...] = fill
+    write_metadata(path, **metadata)
+    return array
+
+
+def write_metadata(path, **metadata):
+    """Write (or update) entries of the sidecar of an array file"""
+    current = read_metadata(path) if os.path.exists(sidecar_path(path)) else {}
+    current.update(metadata)
+    with open(sidecar_path(path), 'w') as f:
+        json.dump(current, f, default=str)
+
+
+def read_metadata(path):
+    with open(sidecar_path(path)) as f:
+        return json.load(f)
+
+
+def load(path, mode='r'):
+    """
+    Open an array file, returns (memory-mapped array, sidecar metadata).
+    :param mode: 'r' for read only, 'r+' to modify the file in place
+    """
+    return np.load(path, mmap_mode=mode), read_metadata(path)
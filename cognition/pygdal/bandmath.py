@@ -0,0 +1,211 @@
+import ast
+import re
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+
+class BandMathError(ValueError):
+    pass
+
+
+_binops = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Pow: np.power,
+}
+
+_unaryops = {
+    ast.USub: np.negative,
+}
+
+_functions = {
+    'sqrt': np.sqrt,
+    'abs': np.absolute,
+    'log': np.log,
+    'exp': np.exp,
+}
+
+#Operations which always produce floating point output
+_float_ops = (np.true_divide, np.power, np.sqrt, np.log, np.exp)
+
+_band_name = re.compile(r'^b(\d+)$')
+
+
+def _number(node):
+    if isinstance(node, ast.Constant):
+        value = node.value
+    elif isinstance(node, ast.Num):
+        value = node.n
+    else:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+class Expression(object):
+
+    """
+    Compiles a band math expression such as `(b2-b1)/(b2+b1)` into a flat list of NumPy ufunc calls.  Bands are
+    referenced as b1, b2, ... (1-indexed, matching GDAL band numbers).  Every intermediate result is written in-place
+    into a small pool of reusable buffers so evaluating a tile allocates at most a handful of arrays regardless of
+    expression size.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.bands = []
+        self.program = []
+        self.registers = 0
+        self.floating = False
+
+        try:
+            tree = ast.parse(expression, mode='eval')
+        except SyntaxError as e:
+            raise BandMathError("Invalid band math expression '{}': {}".format(expression, e))
+        self._free = []
+        self.result = self._compile(tree.body)
+        del self._free
+        self.bands = sorted(self.bands)
+
+    def _register(self):
+        if self._free:
+            return self._free.pop()
+        self.registers += 1
+        return ('reg', self.registers - 1)
+
+    def _release(self, operand):
+        if operand[0] == 'reg':
+            self._free.append(operand)
+
+    def _emit(self, func, operands):
+        """Write the output into the first consumed register so the operation happens in-place"""
+        if func in _float_ops:
+            self.floating = True
+        out = None
+        for operand in operands:
+            if operand[0] == 'reg' and out is None:
+                out = operand
+            else:
+                self._release(operand)
+        if not out:
+            out = self._register()
+        self.program.append((func, operands, out))
+        return out
+
+    def _compile(self, node):
+        if isinstance(node, ast.BinOp) and type(node.op) in _binops:
+            left = self._compile(node.left)
+            right = self._compile(node.right)
+            return self._emit(_binops[type(node.op)], [left, right])
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _unaryops:
+            return self._emit(_unaryops[type(node.op)], [self._compile(node.operand)])
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.UAdd):
+            return self._compile(node.operand)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _functions:
+            if len(node.args) != 1 or node.keywords:
+                raise BandMathError("{}() takes exactly one argument".format(node.func.id))
+            return self._emit(_functions[node.func.id], [self._compile(node.args[0])])
+        elif isinstance(node, ast.Name):
+            match = _band_name.match(node.id)
+            if not match or int(match.group(1)) < 1:
+                raise BandMathError("Unknown name '{}', bands are referenced as b1, b2, ...".format(node.id))
+            band = int(match.group(1))
+            if band not in self.bands:
+                self.bands.append(band)
+            return ('band', band)
+        elif _number(node) is not None:
+            #A float literal would be truncated by integer arithmetic, ex. b1*0.5 on a Byte band
+            if isinstance(_number(node), float):
+                self.floating = True
+            return ('const', _number(node))
+        raise BandMathError("Unsupported syntax in band math expression: {}".format(ast.dump(node)))
+
+    def dtype(self, band_dtypes):
+        """
+        Working (and default output) dtype of the expression.  Inputs are promoted with NumPy's rules; expressions
+        containing division, powers, transcendental functions or float literals are promoted to at least Float32, and
+        integer arithmetic is promoted to at least Int32 so Byte/UInt16 sums and differences cannot wrap around.
+        """
+        #Constant expressions have no inputs and are evaluated in Float32
+        dtype = np.result_type(*(band_dtypes or [np.float32]))
+        if self.floating or dtype.kind == 'f':
+            return np.result_type(dtype, np.float32)
+        return np.result_type(dtype, np.int32)
+
+    def evaluate(self, arrays, out=None, nodata=None, out_nodata=None, engine='numpy', shape=None):
+        """
+        Evaluate the expression on one tile.
+        :param arrays: dict mapping band number to ndarray (all of the same shape).
+        :param out: Optional output array the result is written into.
+        :param shape: Shape of the tile, only needed for constant expressions (which reference no bands) without `out`.
+        :param nodata: Optional dict mapping band number to nodata value.  Pixels which are nodata in any referenced
+                       band are set to `out_nodata` in the output.
+        :param out_nodata: Value assigned to masked and non-finite pixels.
+        :param engine: 'numpy' or 'numexpr'.
+        :return: Array containing the result.
+        """
+        missing = [b for b in self.bands if b not in arrays]
+        if missing:
+            raise BandMathError("Missing input arrays for bands: {}".format(missing))
+        if self.bands:
+            shape = arrays[self.bands[0]].shape
+        elif out is not None:
+            shape = out.shape
+        elif shape is None:
+            raise BandMathError("'{}' references no bands, pass `out` or `shape` to evaluate it".format(
+                self.expression))
+        dtype = self.dtype([arrays[b].dtype for b in self.bands])
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if engine == 'numexpr':
+                if not numexpr:
+                    raise BandMathError("The numexpr engine was requested but numexpr is not installed")
+                local_dict = {'b{}'.format(b): arrays[b].astype(dtype, copy=False) for b in self.bands}
+                result = numexpr.evaluate(self.expression, local_dict=local_dict)
+                if result.shape != shape:
+                    #Constant expressions evaluate to a scalar
+                    result = np.full(shape, result, dtype=result.dtype)
+            else:
+                result = self._run(arrays, shape, dtype)
+
+            if out is None:
+                out = result if result.dtype == dtype else result.astype(dtype)
+            elif out is not result:
+                np.copyto(out, result, casting='unsafe')
+
+            if out_nodata is not None:
+                if out.dtype.kind == 'f':
+                    out[~np.isfinite(out)] = out_nodata
+                if nodata:
+                    for band, value in nodata.items():
+                        if band in self.bands and value is not None:
+                            out[arrays[band] == value] = out_nodata
+        return out
+
+    def _run(self, arrays, shape, dtype):
+        registers = [None] * self.registers
+
+        def resolve(operand):
+            if operand[0] == 'band':
+                return arrays[operand[1]]
+            elif operand[0] == 'const':
+                return operand[1]
+            return registers[operand[1]]
+
+        for func, operands, out in self.program:
+            if registers[out[1]] is None:
+                registers[out[1]] = np.empty(shape, dtype=dtype)
+            func(*[resolve(x) for x in operands], out=registers[out[1]], dtype=dtype, casting='unsafe')
+
+        if self.result[0] == 'band':
+            return arrays[self.result[1]].astype(dtype)
+        elif self.result[0] == 'const':
+            return np.full(shape, self.result[1], dtype=dtype)
+        return registers[self.result[1]]
@@ -2,8 +2,18 @@ import os
 import uuid
 import shutil
 import json
+import threading
+import contextlib
 
-from osgeo import ogr, osr
+from osgeo import gdal, ogr, osr
+
+#GDAL configuration options set by the scopes active on each thread
+_local = threading.local()
+
+#Size of the /vsicurl/ cache shared across handles.  GDAL reads it once, when the first /vsi file is accessed, so it
+#can't be part of a (thread-local) I/O profile and is set process wide unless the environment already sets it.
+if gdal.GetConfigOption('CPL_VSIL_CURL_CACHE_SIZE') is None:
+    gdal.SetConfigOption('CPL_VSIL_CURL_CACHE_SIZE', str(256 * 1024 * 1024))
 
 
 class ConfigHandler(object):
@@ -30,7 +40,8 @@ class ConfigHandler(object):
                 pygdal_config.files.append(parent_id)
                 pygdal_config.incr_op_count(operation)
             fname = pygdal_config.tempfiles.gen_file('vrt', operation, child_id)
-            return func(*args, **kwargs, fname=fname)
+            with pygdal_config.scope():
+                return func(*args, **kwargs, fname=fname)
         return wrapper
 
     def __init__(self):
@@ -40,6 +51,30 @@ class ConfigHandler(object):
                            "intermediates": [],
                            "outputs": []}
 
+        #GDAL configuration options applied (per thread) while any operation runs.  GDAL_VRT_ENABLE_PYTHON is not one of
+        #them: it is set process wide (see raster.py) so VRTs with pixel functions also read outside of any scope.
+        self.gdal_options = {}
+        #Named sets of GDAL options tuned for an I/O pattern, applied with io_scope
+        self.io_profiles = {
+            'default': {},
+            's3': {
+                #Don't list the "directory" of every file opened
+                'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+                'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif,.TIF,.tiff,.vrt,.ovr',
+                #Cache ranges already downloaded per file handle (the /vsicurl/ cache shared across handles is sized
+                #process wide, see CPL_VSIL_CURL_CACHE_SIZE above)
+                'VSI_CACHE': 'TRUE',
+                'VSI_CACHE_SIZE': str(64 * 1024 * 1024),
+                #Fewer, larger requests
+                'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+                'GDAL_HTTP_MULTIPLEX': 'YES',
+                'GDAL_HTTP_VERSION': '2TLS',
+                'GDAL_BAND_BLOCK_CACHE': 'HASHSET',
+                #Megabytes, process wide
+                'GDAL_CACHEMAX': 512,
+            },
+        }
+
         self.files = []
         self.opcount = {}
         self.tempfiles = TempfileHandler()
@@ -71,6 +106,54 @@ class ConfigHandler(object):
         else:
             self.opcount[op_name]+=1
 
+    @contextlib.contextmanager
+    def scope(self, options=None, **kwargs):
+        """
+        Context manager applying GDAL configuration options to the current thread only, restoring the previous values
+        on exit.  Scopes nest, and `gdal_options` fill in any option not set by an enclosing scope.  Unlike
+        gdal.SetConfigOption this lets threads run with different options (ex. Cogify with different profiles).
+        Threads started inside a scope don't inherit it, wrap their target with `bind`.
+        """
+        active = self.current()
+        new = {key: value for key, value in self.gdal_options.items() if key not in active}
+        new.update(options or {})
+        new.update(kwargs)
+        previous = {key: active.get(key) for key in new}
+        _apply(new)
+        try:
+            yield
+        finally:
+            _apply(previous)
+
+    @contextlib.contextmanager
+    def io_scope(self, name='s3', **kwargs):
+        """
+        Scope applying a named I/O profile from `io_profiles`.  Options read when a file is opened (ex.
+        GDAL_DISABLE_READDIR_ON_OPEN, VSI_CACHE) must be in scope when opening, others (ex. range merging) when reading.
+        GDAL_CACHEMAX can't be scoped as GDAL has one block cache per process, it is only ever grown to the
+        profile's value.
+        """
+        if name not in self.io_profiles:
+            raise ValueError("Unknown I/O profile '{}', expected one of {}".format(name, sorted(self.io_profiles)))
+        options = dict(self.io_profiles[name], **kwargs)
+        cachemax = options.pop('GDAL_CACHEMAX', None)
+        if cachemax is not None and gdal.GetCacheMax() < int(cachemax) * 1024 * 1024:
+            gdal.SetCacheMax(int(cachemax) * 1024 * 1024)
+        with self.scope(options):
+            yield
+
+    def current(self):
+        """GDAL configuration options set by the scopes active on the current thread"""
+        return dict(getattr(_local, 'options', {}))
+
+    def bind(self, func):
+        """Wrap a function so it runs, on whichever thread calls it, with the options active where it was bound"""
+        options = self.current()
+        def wrapper(*args, **kwargs):
+            with self.scope(options):
+                return func(*args, **kwargs)
+        return wrapper
+
     def SetConfigOption(self, key, value):
         self.args.update({key:value})
 
@@ -99,8 +182,7 @@ class TempfileHandler(object):
             return os.path.join(pygdal_config.tempdir, func, fname)
         else:
             fpath = os.path.join(pygdal_config.tempdir, func)
-            if not os.path.exists(fpath):
-                os.makedirs(fpath)
+            os.makedirs(fpath, exist_ok=True)
             return os.path.join(fpath, fname)
 
     def cleanup(self, folder=None):
@@ -139,6 +221,18 @@ class OperationHandler(object):
                                            "args": arguments})
 
 
+def _apply(options):
+    if not hasattr(_local, 'options'):
+        _local.options = {}
+    for key, value in options.items():
+        value = None if value is None else str(value)
+        gdal.SetThreadLocalConfigOption(key, value)
+        if value is None:
+            _local.options.pop(key, None)
+        else:
+            _local.options[key] = value
+
+
 def deserialize(arg_list):
     for idx, arg in enumerate(arg_list):
         if type(arg) == ogr.Feature:
@@ -1,7 +1,28 @@
 from osgeo import osr, ogr
-import json
+import struct
+import numpy as np
 import cognition.pygdal as pg
 
+#ISO WKB geometry type codes, 1000 is added for geometries with a Z coordinate
+wkb_types = {
+    'Point': 1,
+    'LineString': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiLine': 5,
+    'MultiPolygon': 6
+}
+
+_multi_parts = {
+    4: 'Point',
+    5: 'LineString',
+    6: 'Polygon'
+}
+
+#Layout of a little endian WKB polygon with a single five point ring, used to pack bounding boxes in bulk
+_bbox_wkb = np.dtype([('order', 'u1'), ('type', '<u4'), ('rings', '<u4'), ('points', '<u4'), ('coords', '<f8', (5, 2))])
+
 class GeometryBase(object):
 
     def __init__(self, data, type):
@@ -286,19 +307,99 @@ def createGeom(data, type):
         if len([x for x in base_list if data.startswith(x)]) > 0:
             return ogr.CreateGeometryFromWkt(data)
         return ogr.CreateGeometryFromJson('''{}'''.format(data))
-    elif isinstance(data, list):
-        return listToGeom(type, data)
+    elif isinstance(data, (list, np.ndarray)):
+        return arrayToGeom(type, data)
+    elif isinstance(data, (bytes, bytearray)):
+        return ogr.CreateGeometryFromWkb(bytes(data))
     elif isinstance(data, ogr.Geometry):
         return data
     return
 
 def listToGeom(geom_type, coords):
-    geoj = {"type": geom_type, "coordinates": coords}
-    geom = ogr.CreateGeometryFromJson(json.dumps(geoj))
-    return geom
+    return arrayToGeom(geom_type, coords)
+
+def arrayToGeom(geom_type, coords):
+    """
+    Build an ogr.Geometry directly from coordinates by packing them into WKB.  Coordinates follow GeoJSON nesting and
+    may be lists or NumPy arrays (ex. a Polygon is a list of (n, 2) or (n, 3) rings).
+    """
+    return ogr.CreateGeometryFromWkb(packWkb(geom_type, coords))
+
+def packWkb(geom_type, coords):
+    """Pack GeoJSON-nested coordinates (lists or NumPy arrays) into little endian ISO WKB"""
+    code = wkb_types[geom_type]
+    if code in _multi_parts:
+        parts = [packWkb(_multi_parts[code], part) for part in coords]
+        dims = 3 if parts and struct.unpack('<I', parts[0][1:5])[0] > 1000 else 2
+        return struct.pack('<BII', 1, code + (1000 if dims == 3 else 0), len(parts)) + b''.join(parts)
+    if code == 3:
+        rings = [_coord_array(ring) for ring in coords]
+        dims = rings[0].shape[1] if rings else 2
+        body = b''.join([struct.pack('<I', len(ring)) + ring.tobytes() for ring in rings])
+        return struct.pack('<BII', 1, code + (1000 if dims == 3 else 0), len(rings)) + body
+    points = _coord_array(coords)
+    dims = points.shape[-1]
+    if code == 1:
+        return struct.pack('<BI', 1, code + (1000 if dims == 3 else 0)) + points.reshape(-1).tobytes()
+    return struct.pack('<BII', 1, code + (1000 if dims == 3 else 0), len(points)) + points.tobytes()
+
+def _coord_array(coords):
+    points = np.ascontiguousarray(coords, dtype='<f8')
+    if points.size == 0:
+        return points.reshape(0, 2)
+    return points
+
+def boundsToWkb(bounds):
+    """
+    Pack many bounding boxes into WKB polygons at once.
+    :param bounds: Array-like of shape (n, 4) in the format (xmin,xmax,ymin,ymax)
+    :return: List of WKB polygons
+    """
+    bounds = np.asarray(bounds, dtype='f8').reshape(-1, 4)
+    packed = np.empty(len(bounds), dtype=_bbox_wkb)
+    packed['order'] = 1
+    packed['type'] = 3
+    packed['rings'] = 1
+    packed['points'] = 5
+    coords = packed['coords']
+    coords[:, [0, 1, 4], 0] = bounds[:, [0]]
+    coords[:, [2, 3], 0] = bounds[:, [1]]
+    coords[:, [0, 3, 4], 1] = bounds[:, [2]]
+    coords[:, [1, 2], 1] = bounds[:, [3]]
+    buf = packed.tobytes()
+    size = _bbox_wkb.itemsize
+    return [buf[i:i+size] for i in range(0, len(buf), size)]
+
+def isRectangle(geom):
+    """Check if a geometry is a polygon forming an axis aligned rectangle (ex. a bounding box or grid cell)"""
+    if geom.GetGeometryName() != 'POLYGON' or geom.GetGeometryCount() != 1:
+        return False
+    xmin, xmax, ymin, ymax = geom.GetEnvelope()
+    env_area = (xmax - xmin) * (ymax - ymin)
+    if env_area <= 0:
+        return False
+    for x, y in geom.GetGeometryRef(0).GetPoints(2):
+        if x not in (xmin, xmax) or y not in (ymin, ymax):
+            return False
+    return abs(geom.Area() - env_area) <= 1e-9 * env_area
 
 def geomToList(geom):
-    return json.loads(geom.ExportToJson())['coordinates']
+    return _to_coords(geom, lambda points: points.tolist())
+
+def geomToArray(geom):
+    """Export the coordinates of a geometry as GeoJSON-nested NumPy arrays of shape (n, dims)"""
+    return _to_coords(geom, lambda points: points)
+
+def _to_coords(geom, leaf):
+    count = geom.GetGeometryCount()
+    name = geom.GetGeometryName()
+    if name == 'POINT':
+        if geom.CoordinateDimension() == 2:
+            return leaf(np.array(geom.GetPoint_2D()))
+        return leaf(np.array(geom.GetPoint()))
+    elif count == 0:
+        return leaf(np.array(geom.GetPoints() or [], dtype='f8').reshape(-1, geom.CoordinateDimension()))
+    return [_to_coords(geom.GetGeometryRef(i), leaf) for i in range(count)]
 
 def createTransformer(in_epsg, out_epsg):
     """
@@ -318,8 +419,7 @@ def wktBoundBox(bounds):
     :param bounds: an extent tuple in the format (xmin,xmax,ymin,ymax)
     :return: A wkt string
     '''
-    list = minMaxToFivePoints(bounds)
-    return ogr.CreateGeometryFromWkt(createWKTPolygon(list))
+    return ogr.CreateGeometryFromWkb(boundsToWkb(bounds)[0])
 
 
 def minMaxToFivePoints(points):
@@ -337,7 +437,4 @@ def createWKTPolygon(points):
     :param points: a list of points in a Polygon
     :return: a WKT Polygon string
     '''
-    wkt = 'POLYGON (('
-    for point in points:
-        wkt = wkt + str(point[0]) + ' ' + str(point[1]) + ','
-    return wkt[:-1] + '))'
\ No newline at end of file
+    return 'POLYGON ((' + ','.join([str(point[0]) + ' ' + str(point[1]) for point in points]) + '))'
\ No newline at end of file
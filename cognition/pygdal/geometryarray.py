@@ -0,0 +1,182 @@
+import numpy as np
+from osgeo import ogr
+
+import cognition.pygdal as pg
+from cognition.pygdal.geometry import GeometryBase, boundsToWkb, isRectangle
+
+#Maps OGR geometry names to the names understood by OpenGeometry
+geometry_names = {
+    'POINT': 'Point',
+    'LINESTRING': 'LineString',
+    'POLYGON': 'Polygon',
+    'MULTIPOINT': 'MultiPoint',
+    'MULTILINESTRING': 'MultiLine',
+    'MULTIPOLYGON': 'MultiPolygon'
+}
+
+#Layout of a little endian 2D WKB point
+_point_wkb = np.dtype([('order', 'u1'), ('type', '<u4'), ('xy', '<f8', (2,))])
+
+
+class GeometryArray(object):
+
+    """
+    A collection of many geometries stored as one contiguous WKB buffer (plus offsets) and an (n, 4) array of bounds
+    in the format (xmin,xmax,ymin,ymax).  Spatial predicates are evaluated for the whole collection at once: envelopes
+    are compared with NumPy first and the exact OGR predicate only runs on the remaining candidates, returning
+    boolean arrays instead of dispatching one Python call per pair.
+    """
+
+    def __init__(self, wkb, offsets, bounds):
+        """
+        :param wkb: Bytes containing every geometry's WKB back to back
+        :param offsets: Array of n+1 byte offsets, geometry i is wkb[offsets[i]:offsets[i+1]]
+        :param bounds: Array of shape (n, 4) in the format (xmin,xmax,ymin,ymax)
+        """
+        self.wkb = wkb
+        self.offsets = np.asarray(offsets, dtype='int64')
+        self.bounds = np.asarray(bounds, dtype='f8').reshape(-1, 4)
+        self._geoms = None
+
+    @classmethod
+    def from_wkb(cls, wkb_list, bounds=None):
+        """Build from a list of WKB geometries, bounds are computed if not passed"""
+        if bounds is None:
+            bounds = [ogr.CreateGeometryFromWkb(x).GetEnvelope() for x in wkb_list]
+        offsets = np.zeros(len(wkb_list) + 1, dtype='int64')
+        np.cumsum([len(x) for x in wkb_list], out=offsets[1:])
+        return cls(b''.join(wkb_list), offsets, bounds)
+
+    @classmethod
+    def from_geometries(cls, geoms):
+        """Build from an iterable of ogr.Geometry or Geometry classes"""
+        geoms = [x.geom if isinstance(x, GeometryBase) else x for x in geoms]
+        return cls.from_wkb([bytes(x.ExportToWkb(ogr.wkbNDR)) for x in geoms], [x.GetEnvelope() for x in geoms])
+
+    @classmethod
+    def from_bounds(cls, bounds):
+        """Build a collection of rectangles from an (n, 4) array of (xmin,xmax,ymin,ymax) bounds"""
+        return cls.from_wkb(boundsToWkb(bounds), bounds)
+
+    @classmethod
+    def from_vector(cls, vector):
+        """Build from the geometries of a Vector, in feature order"""
+        wkb_list = []
+        bounds = []
+        for feat in vector.features:
+            geom = feat.GetGeometryRef()
+            wkb_list.append(bytes(geom.ExportToWkb(ogr.wkbNDR)))
+            bounds.append(geom.GetEnvelope())
+        return cls.from_wkb(wkb_list, bounds)
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def __getitem__(self, idx):
+        geom = self.geometry(idx)
+        return pg.OpenGeometry(geom, geometry_names[geom.GetGeometryName()])
+
+    def geometry(self, idx):
+        """Return geometry `idx` as an ogr.Geometry"""
+        if self._geoms is not None:
+            return self._geoms[idx]
+        return ogr.CreateGeometryFromWkb(self.wkb[self.offsets[idx]:self.offsets[idx+1]])
+
+    def cache(self):
+        """Decode every geometry once and keep it, speeds up repeated predicates on the same collection"""
+        if self._geoms is None:
+            self._geoms = [self.geometry(i) for i in range(len(self))]
+        return self
+
+    def EnvelopeIntersects(self, bbox):
+        """
+        Vectorized envelope test against a bounding box in the format (xmin,xmax,ymin,ymax)
+        :return: Boolean array
+        """
+        b = self.bounds
+        return (b[:, 0] <= bbox[1]) & (b[:, 1] >= bbox[0]) & (b[:, 2] <= bbox[3]) & (b[:, 3] >= bbox[2])
+
+    def EnvelopeWithin(self, bbox, strict=False):
+        """
+        Vectorized test of each envelope lying inside a bounding box in the format (xmin,xmax,ymin,ymax)
+        :return: Boolean array
+        """
+        b = self.bounds
+        if strict:
+            return (b[:, 0] > bbox[0]) & (b[:, 1] < bbox[1]) & (b[:, 2] > bbox[2]) & (b[:, 3] < bbox[3])
+        return (b[:, 0] >= bbox[0]) & (b[:, 1] <= bbox[1]) & (b[:, 2] >= bbox[2]) & (b[:, 3] <= bbox[3])
+
+    def EnvelopeContains(self, bbox):
+        """
+        Vectorized test of each envelope containing a bounding box in the format (xmin,xmax,ymin,ymax)
+        :return: Boolean array
+        """
+        b = self.bounds
+        return (b[:, 0] <= bbox[0]) & (b[:, 1] >= bbox[1]) & (b[:, 2] <= bbox[2]) & (b[:, 3] >= bbox[3])
+
+    def Intersects(self, geom):
+        """Boolean array of which geometries intersect `geom`"""
+        geom = _ogr(geom)
+        env = geom.GetEnvelope()
+        out = self.EnvelopeIntersects(env)
+        #Anything whose envelope lies inside a rectangle must intersect it
+        known = self.EnvelopeWithin(env) if isRectangle(geom) else None
+        return self._refine(out, known, lambda x: x.Intersects(geom))
+
+    def Within(self, geom):
+        """Boolean array of which geometries are within `geom`"""
+        geom = _ogr(geom)
+        env = geom.GetEnvelope()
+        out = self.EnvelopeWithin(env)
+        known = self.EnvelopeWithin(env, strict=True) if isRectangle(geom) else None
+        return self._refine(out, known, lambda x: x.Within(geom))
+
+    def Contains(self, geom):
+        """Boolean array of which geometries contain `geom`"""
+        geom = _ogr(geom)
+        return self._refine(self.EnvelopeContains(geom.GetEnvelope()), None, lambda x: x.Contains(geom))
+
+    def query(self, geom, predicate='intersects'):
+        """Index array of the geometries satisfying a predicate ('intersects', 'within' or 'contains') with `geom`"""
+        predicates = {'intersects': self.Intersects, 'within': self.Within, 'contains': self.Contains}
+        return np.nonzero(predicates[predicate](geom))[0]
+
+    def _refine(self, candidates, known, predicate):
+        """Run the exact predicate on envelope candidates which are not already known to be true"""
+        todo = candidates & ~known if known is not None else candidates
+        for idx in np.nonzero(todo)[0]:
+            candidates[idx] = predicate(self.geometry(idx))
+        return candidates
+
+    def ReprojectFast(self, transformer):
+        """
+        Reproject every geometry with an osr.CoordinateTransformation() object (see geometry.createTransformer).
+        Collections of 2D points are transformed in a single call.
+        :return: New GeometryArray
+        """
+        if self._is_points():
+            points = np.frombuffer(self.wkb, dtype=_point_wkb)
+            xy = np.array(transformer.TransformPoints(points['xy'].tolist()))[:, :2]
+            out = points.copy()
+            out['xy'] = xy
+            bounds = np.stack([xy[:, 0], xy[:, 0], xy[:, 1], xy[:, 1]], axis=1)
+            return GeometryArray(out.tobytes(), self.offsets.copy(), bounds)
+        geoms = []
+        for idx in range(len(self)):
+            geom = self.geometry(idx).Clone()
+            geom.Transform(transformer)
+            geoms.append(geom)
+        return GeometryArray.from_geometries(geoms)
+
+    def _is_points(self):
+        size = _point_wkb.itemsize
+        if len(self) == 0 or len(self.wkb) != size * len(self):
+            return False
+        points = np.frombuffer(self.wkb, dtype=_point_wkb)
+        return bool(np.all(points['order'] == 1) and np.all(points['type'] == 1))
+
+
+def _ogr(geom):
+    if isinstance(geom, GeometryBase):
+        return geom.geom
+    return geom
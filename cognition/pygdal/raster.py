@@ -4,15 +4,23 @@ import multiprocessing
 import os
 import functools
 import xml.etree.ElementTree as ET
+import threading
+import queue
 import boto3
+import numpy as np
+from osgeo import gdal_array
 
 from cognition.pygdal.projection import SpatialRef
 from cognition.pygdal.vector import Vector
-from cognition.pygdal.geometry import Polygon
+from cognition.pygdal.geometry import boundsToWkb
 from cognition.pygdal.utils import clip_wrapper as clip
 from cognition.pygdal.config import pygdal_config
-from cognition.cog.profiles import DefaultCOG
-from cognition.cog.validate import validate
+from cognition.pygdal import arrayfile
+from cognition.pygdal.bandmath import Expression
+from cognition.pygdal import warp
+from cognition.pygdal.warp import DefaultWarp
+from cognition.cog.profiles import DefaultCOG, resolve
+from cognition.cog import tiff, overviews, structure
 
 gdal.SetConfigOption('GDAL_VRT_ENABLE_PYTHON', 'YES')
 
@@ -102,14 +110,144 @@ class Raster(object):
     def blocksize(self):
         return self.ds.GetRasterBand(1).GetBlockSize()
 
+    @property
+    def rotated(self):
+        gt = self.gt
+        return gt[2] != 0 or gt[4] != 0
+
+    def pixel_window(self, bbox):
+        """
+        Convert a bounding box of form (xmin, xmax, ymin, ymax) to a (xoff, yoff, xsize, ysize) pixel window snapped to
+        the nearest pixel edges.  The window is not clamped and may extend past the raster.
+        """
+        gt = self.gt
+        xoff = int(round((bbox[0] - gt[0]) / gt[1]))
+        xend = int(round((bbox[1] - gt[0]) / gt[1]))
+        yoff = int(round((bbox[3] - gt[3]) / gt[5]))
+        yend = int(round((bbox[2] - gt[3]) / gt[5]))
+        return (xoff, yoff, xend - xoff, yend - yoff)
+
+    def windows(self, blocksize=None):
+        """
+        Generator of (xoff, yoff, xsize, ysize) windows covering the raster.  Windows are aligned to the native block
+        size unless a different (xsize, ysize) blocksize is passed.
+        """
+        xsize, ysize = blocksize or self.blocksize
+        cols, rows = self.shape[:2]
+        for yoff in range(0, rows, ysize):
+            for xoff in range(0, cols, xsize):
+                yield (xoff, yoff, min(xsize, cols - xoff), min(ysize, rows - yoff))
+
 class RasterDataset(Raster):
 
     def __init__(self, ds, id=None):
         Raster.__init__(self, ds, id)
 
+    def read_window(self, window, bands=None, buf=None):
+        """
+        Read a (xoff, yoff, xsize, ysize) window into an array of shape (bands, ysize, xsize).
+        :param bands: Optional list of band numbers to read, defaults to all bands.
+        :param buf: Optional array of shape (>=bands, >=ysize, >=xsize) which is read into instead of allocating.
+        """
+        with pygdal_config.scope():
+            return _read_window(self.ds, window, bands or list(range(1, self.shape[2]+1)), buf)
+
+    def iter_blocks(self, bands=None, buf=None, prefetch=0, blocksize=None, out=None):
+        """
+        Generator yielding (window, ndarray) pairs for every block of the raster, where window is of form
+        (xoff, yoff, xsize, ysize) and the array has shape (bands, ysize, xsize) and the promoted dtype of the bands.
+        Blocks are aligned to the native block size unless a different (xsize, ysize) blocksize is passed.
+
+        :param bands: Optional list of band numbers to read, defaults to all bands.
+        :param buf: Optional array of shape (bands, ysize, xsize) reused for every block.  Each yielded array is a view
+                    of `buf` and is overwritten by the next block.
+        :param prefetch: Number of blocks read ahead in a background thread.  The background thread reads into a ring
+                         of `2 * prefetch + 2` buffers (up to `prefetch + 1` of which are queued or being read ahead of
+                         the consumer), so a yielded array stays valid until `prefetch + 1` further blocks have been
+                         requested.  Cannot be combined with `buf`.  Datasets which can't be reopened by
+                         filename (ex. MEM datasets) are read synchronously instead.
+        :param out: Optional .npy file (see cognition.pygdal.arrayfile) of shape (bands, rows, cols), created with the
+                    raster's geotransform sidecar.  Blocks are read straight into their slice of the memory-mapped file
+                    and each yielded array is a view of it which stays valid, so the whole raster can be processed (and
+                    modified in place) out of core.  Cannot be combined with `buf`.
+        """
+        bands = bands or list(range(1, self.shape[2]+1))
+        if buf is not None and (prefetch or out):
+            raise ValueError("A caller provided buffer cannot be combined with prefetching or an output file")
+        dtype = _bands_dtype(self.ds, bands)
+        if out:
+            out = arrayfile.create(out, (len(bands), self.shape[1], self.shape[0]), dtype, gt=list(self.gt),
+                                   srs=self.ds.GetProjection(), nodata=self.nodatavalue, bands=bands)
+        #GDAL datasets may not be shared across threads, prefetch through a separate handle or read synchronously
+        reader_ds = None
+        if prefetch and self.filename and self.ds.GetDriver().ShortName != 'MEM':
+            reader_ds = gdal.Open(self.filename)
+        if reader_ds is None:
+            for window in self.windows(blocksize):
+                with pygdal_config.scope():
+                    block = _read_window(self.ds, window, bands, buf if out is None else _window_view(out, window))
+                yield window, block
+            return
+
+        xsize, ysize = blocksize or self.blocksize
+        #Blocks queued and being read ahead, plus the prefetch + 1 most recently yielded blocks
+        ring = []
+        if out is None:
+            ring = [np.empty((len(bands), ysize, xsize), dtype=dtype) for _ in range(2 * prefetch + 2)]
+        blocks = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def reader():
+            try:
+                for idx, window in enumerate(self.windows(blocksize)):
+                    target = ring[idx % len(ring)] if out is None else _window_view(out, window)
+                    item = (window, _read_window(reader_ds, window, bands, target))
+                    while not stop.is_set():
+                        try:
+                            blocks.put(item, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if stop.is_set():
+                        return
+                item = done
+            except Exception as e:
+                item = e
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        thread = threading.Thread(target=pygdal_config.bind(reader), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = blocks.get()
+                if item is done:
+                    break
+                elif isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
     @pygdal_config.log_operation
-    def Reproject(self, out_srs, **kwargs):
+    def Reproject(self, out_srs, profile=DefaultWarp, materialize=False, out_dir=None, **kwargs):
+        """
+        Reproject the raster to a new spatial reference.  By default this creates a warped VRT.
+        :param profile: Warp profile (see cognition.pygdal.warp) controlling threading, warp memory, approximate
+                        transformer tolerance and target aligned pixels.  Extra kwargs are passed to gdal.Warp and
+                        take precedence over the profile.
+        :param materialize: Write the result to a tiled GeoTIFF, warping chunks of the output concurrently.
+        :param out_dir: Directory the materialized GeoTIFF is written to, defaults to the pygdal temp directory
+                        (/vsimem/, so in memory, unless TEMP_SAVE is set).
+        """
         fname = kwargs.pop('fname')
+        profile = profile(self)
         args = {'in': self.srs.srs}
         if type(out_srs) == int:
             args['out'] = 'EPSG: {}'.format(out_srs)
@@ -117,50 +255,156 @@ class RasterDataset(Raster):
             args['out'] = out_srs
         elif type(out_srs) == SpatialRef:
             args['out'] = out_srs.srs
-        warped = gdal.Warp(fname,
-                           self.ds,
-                           srcSRS=args['in'],
-                           dstSRS=args['out'],
-                           format='VRT',
-                           **kwargs)
+        options = profile.warp_options(materialize)
+        options.update(kwargs)
+        with pygdal_config.scope(profile.config):
+            if profile.target_aligned_pixels and 'xRes' not in options:
+                #Target aligned pixels requires an explicit resolution, use the one the warper would pick
+                suggested = gdal.Warp('', self.ds, srcSRS=args['in'], dstSRS=args['out'], format='VRT')
+                gt = suggested.GetGeoTransform()
+                options.update({'xRes': gt[1], 'yRes': abs(gt[5]), 'targetAlignedPixels': True})
+                suggested = None
+            warped = gdal.Warp(fname,
+                               self.ds,
+                               srcSRS=args['in'],
+                               dstSRS=args['out'],
+                               format='VRT',
+                               **options)
+            if materialize:
+                warped = None
+                out_fname = os.path.splitext(fname)[0] + '.tif'
+                if out_dir:
+                    out_fname = os.path.join(out_dir, os.path.basename(out_fname))
+                return RasterDataset(warp.materialize(fname, out_fname, profile))
         return RasterDataset(warped, id=fname)
 
+    def TileWindows(self, pixel_x, pixel_y, x_overlap=0, y_overlap=0):
+        """
+        Computes a tile grid over the raster without creating any geometries.  Tiles are `pixel_x` by `pixel_y` pixels
+        and consecutive tiles overlap by `x_overlap`/`y_overlap` pixels; tiles along the right and bottom edges are
+        truncated to the raster.
+        :return: Tuple of two (n, 4) arrays ordered row by row: pixel windows of form (xoff, yoff, xsize, ysize) and
+                 bounds of form (xmin, xmax, ymin, ymax).
+        """
+        step_x = pixel_x - x_overlap
+        step_y = pixel_y - y_overlap
+        if step_x <= 0 or step_y <= 0:
+            raise ValueError("Tile overlap must be smaller than the tile size")
+        cols, rows = self.shape[:2]
+        yoff, xoff = np.meshgrid(np.arange(0, max(rows - y_overlap, 1), step_y),
+                                 np.arange(0, max(cols - x_overlap, 1), step_x),
+                                 indexing='ij')
+        xoff = xoff.ravel()
+        yoff = yoff.ravel()
+        xsize = np.minimum(pixel_x, cols - xoff)
+        ysize = np.minimum(pixel_y, rows - yoff)
+        windows = np.stack([xoff, yoff, xsize, ysize], axis=1)
+
+        gt = self.gt
+        bounds = np.stack([gt[0] + xoff * gt[1],
+                           gt[0] + (xoff + xsize) * gt[1],
+                           gt[3] + (yoff + ysize) * gt[5],
+                           gt[3] + yoff * gt[5]], axis=1)
+        return windows, bounds
+
     @pygdal_config.log_operation
-    def TileGrid(self, pixel_x, pixel_y, x_overlap=0, y_overlap=0, **kwargs):
+    def TileGrid(self, pixel_x, pixel_y, x_overlap=0, y_overlap=0, driver='Memory', **kwargs):
+        """
+        Writes the tile grid computed by TileWindows to a polygon layer, with the pixel window of each tile stored as
+        attributes.  Features are written in a single transaction to an in-memory layer by default; pass
+        driver='GPKG' (or any other OGR driver) to write to disk.
+        """
         fname = kwargs.pop('fname')
-        extent = self.extent
-        width = extent[1] - extent[0]
-        height = extent[3] - extent[2]
-        step_x = float(pixel_x * self.xres)
-        step_y = float(pixel_y * self.yres)
-        rows = int(round(width / step_y))
-        cols = int(round(height / step_x))
-
-        out_ds = gdal.GetDriverByName('ESRI Shapefile').Create(fname, 0, 0, 0)
-        out_lyr = out_ds.CreateLayer(fname, self.srs.srs, ogr.wkbPolygon)
-
-        for col in range(cols):
-            for row in range(rows):
-                x = extent[0] + (col * step_x - cols * (x_overlap * self.xres))
-                y = extent[3] - (row * step_y - row * (y_overlap * self.yres))
-                xmax = x + step_x
-                ymin = y - step_y
-                poly = Polygon([[[x, y], [xmax, y], [xmax, ymin], [x, ymin], [x, y]]]).ExportToGeom()
-                out_feat = ogr.Feature(out_lyr.GetLayerDefn())
-                out_feat.SetGeometry(poly)
-                out_lyr.CreateFeature(out_feat)
+        if driver == 'GPKG':
+            fname = os.path.splitext(fname)[0] + '.gpkg'
+        windows, bounds = self.TileWindows(pixel_x, pixel_y, x_overlap, y_overlap)
+
+        out_ds = ogr.GetDriverByName(driver).CreateDataSource(fname)
+        out_lyr = out_ds.CreateLayer(os.path.splitext(os.path.basename(fname))[0], self.srs.srs, ogr.wkbPolygon)
+        fields = ['xoff', 'yoff', 'xsize', 'ysize']
+        for field in fields:
+            out_lyr.CreateField(ogr.FieldDefn(field, ogr.OFTInteger))
+        defn = out_lyr.GetLayerDefn()
+
+        out_lyr.StartTransaction()
+        for window, wkb in zip(windows.tolist(), boundsToWkb(bounds)):
+            out_feat = ogr.Feature(defn)
+            out_feat.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+            for idx, field in enumerate(fields):
+                out_feat.SetField(field, window[idx])
+            out_lyr.CreateFeature(out_feat)
+        out_lyr.CommitTransaction()
         out_lyr = None
         return Vector(out_ds)
 
-    def Clip(self, vector_data, **gdalwarp_opts):
-        clips = clip(self, vector_data.ds, self.srs.srs, **gdalwarp_opts)
+    def Clip(self, vector_data, workers=1, **gdalwarp_opts):
+        """
+        Clip the raster by each feature of a Vector.  Features whose envelope does not intersect the raster are skipped
+        using the vector's spatial index, and the remaining features are clipped in spatial order.
+        :param workers: Number of threads clipping batches of features concurrently.
+        """
+        extent = self.extent
+        vector_srs = vector_data.lyr.GetSpatialRef()
+        if vector_srs and not self.srs.srs.IsSame(vector_srs):
+            bbox = ogr.CreateGeometryFromWkb(boundsToWkb(extent)[0])
+            #Densify so the transformed envelope also covers curved edges
+            bbox.Segmentize(min(extent[1] - extent[0], extent[3] - extent[2]) / 16)
+            bbox.Transform(osr.CoordinateTransformation(self.srs.srs, vector_srs))
+            extent = bbox.GetEnvelope()
+        fids = vector_data.spatial_index().query(extent)
+        clips = clip(self, vector_data.ds, self.srs.srs, fids=fids, workers=workers, **gdalwarp_opts)
         return ClipHandler(clips)
 
     @pygdal_config.log_operation
     def BboxClip(self, bbox, **gdaltranslate_opts): #xmin, xmax, ymin, ymax
         fname = gdaltranslate_opts.pop('fname')
+        if not self.rotated:
+            #Pixel aligned window, no resampling
+            return RasterDataset(gdal.Translate(fname, self.ds, srcWin=self.pixel_window(bbox), **gdaltranslate_opts))
         return RasterDataset(gdal.Translate(fname, self.ds, projWin=[bbox[0], bbox[3], bbox[1], bbox[2]], **gdaltranslate_opts))
 
+    @pygdal_config.log_operation
+    def BboxSplit(self, bbox, bands=None, **kwargs): #xmin, xmax, ymin, ymax
+        """
+        Clip a bounding box and split it into single band in-memory rasters with one read of the source, so each
+        block of a pixel-interleaved source is decompressed once instead of once per band.  Parts of the bounding box
+        outside the raster are filled with the nodata value (or 0).
+        :param bands: Optional list of band numbers, defaults to all bands.
+        :return: List of RasterDataset, one per band.
+        """
+        fname = kwargs.pop('fname')
+        bands = bands or list(range(1, self.shape[2]+1))
+        if self.rotated:
+            return [self.BboxClip(bbox, bandList=[band]) for band in bands]
+
+        xoff, yoff, xsize, ysize = self.pixel_window(bbox)
+        nodata = self.nodatavalue
+        #Dataset level read of every band, GDAL decodes each interleaved block once and fans it out to all bands.  The
+        #buffer holds every band's values without loss, each output keeps the data type of its band.
+        array = np.full((self.shape[2], ysize, xsize), nodata if nodata is not None else 0,
+                        dtype=_bands_dtype(self.ds, range(1, self.shape[2]+1)))
+        col, row = max(xoff, 0), max(yoff, 0)
+        cols, rows = min(xoff + xsize, self.shape[0]) - col, min(yoff + ysize, self.shape[1]) - row
+        if cols > 0 and rows > 0:
+            window = array[:, row-yoff:row-yoff+rows, col-xoff:col-xoff+cols]
+            self.ds.ReadAsArray(col, row, cols, rows, buf_obj=window if self.shape[2] > 1 else window[0])
+
+        gt = list(self.gt)
+        gt[0], gt[3] = gt[0] + xoff * gt[1], gt[3] + yoff * gt[5]
+        band_list = []
+        for band in bands:
+            out_ds = gdal.GetDriverByName('MEM').Create(os.path.splitext(fname)[0]+'_B{}'.format(band),
+                                                        xsize, ysize, 1, self.ds.GetRasterBand(band).DataType)
+            out_ds.SetGeoTransform(gt)
+            out_ds.SetProjection(self.srs.ExportToWkt())
+            out_band = out_ds.GetRasterBand(1)
+            band_nodata = self.ds.GetRasterBand(band).GetNoDataValue()
+            if band_nodata is not None:
+                out_band.SetNoDataValue(band_nodata)
+            out_band.WriteArray(array[band-1])
+            band_list.append(RasterDataset(out_ds))
+        return band_list
+
     @pygdal_config.log_operation
     def Save(self, out_path, **gdaltranslate_opts):
         fname = gdaltranslate_opts.pop('fname')
@@ -188,7 +432,7 @@ class RasterDataset(Raster):
             obj = s3.Object(bucket, os.path.join(key, self.name))
         else:
             obj = s3.Object(bucket, os.path.join(key, name))
-        obj.put(Body=vsimem_file)
+        return obj.put(Body=vsimem_file)
 
 
     @pygdal_config.log_operation
@@ -248,6 +492,57 @@ class RasterDataset(Raster):
         # print(out_ds.filename)
         return out_ds
 
+    @pygdal_config.log_operation
+    def BandMath(self, expression, out_depth=None, nodata=None, engine='numpy', blocksize=None, **kwargs):
+        """
+        Evaluates a band math expression (ex. `(b2-b1)/(b2+b1)`) block by block into a tiled GeoTIFF.  Unlike
+        EmbedFunction the expression is compiled once into fused NumPy operations and evaluated eagerly, so memory use
+        is bounded by the block size rather than the raster size.
+        :param expression: Band math expression, bands are referenced as b1, b2, ...
+        :param out_depth: Output bitdepth (ex. 'Float32'), defaults to the promoted dtype of the expression.
+        :param nodata: Output nodata value, defaults to the nodata value of the raster.  Pixels which are nodata in
+                       any input band, or which evaluate to NaN/inf, are set to this value.
+        :param engine: 'numpy' or 'numexpr'
+        :param blocksize: Optional (xsize, ysize) evaluation window, defaults to the native block size.
+        """
+        fname = os.path.splitext(kwargs.pop('fname'))[0] + '.tif'
+        expr = Expression(expression)
+        for band in expr.bands:
+            if band > self.shape[2]:
+                raise ValueError("Expression references band {} but raster only has {} bands".format(
+                    band, self.shape[2]))
+        if nodata is None:
+            nodata = self.nodatavalue
+        in_nodata = {b: self.ds.GetRasterBand(b).GetNoDataValue() for b in expr.bands}
+
+        if out_depth:
+            out_dtype = gdal_array.GDALTypeCodeToNumericTypeCode(gdal.GetDataTypeByName(out_depth))
+        else:
+            out_dtype = expr.dtype([gdal_array.GDALTypeCodeToNumericTypeCode(self.ds.GetRasterBand(b).DataType)
+                                    for b in expr.bands])
+        out_ds = gdal.GetDriverByName('GTiff').Create(fname, self.shape[0], self.shape[1], 1,
+                                                      gdal_array.NumericTypeCodeToGDALTypeCode(out_dtype),
+                                                      options=['TILED=YES'])
+        out_ds.SetGeoTransform(self.gt)
+        out_ds.SetProjection(self.srs.ExportToWkt())
+        out_band = out_ds.GetRasterBand(1)
+        if nodata is not None:
+            out_band.SetNoDataValue(nodata)
+
+        if expr.bands:
+            blocks = self.iter_blocks(bands=expr.bands, prefetch=1, blocksize=blocksize)
+        else:
+            #Constant expressions don't read any band, the window gives the shape of the result
+            blocks = ((window, []) for window in self.windows(blocksize))
+        for window, block in blocks:
+            arrays = dict(zip(expr.bands, block))
+            result = expr.evaluate(arrays, nodata=in_nodata, out_nodata=nodata, engine=engine,
+                                   shape=(window[3], window[2]))
+            out_band.WriteArray(result.astype(out_dtype, copy=False), window[0], window[1])
+        out_band.FlushCache()
+        out_band = None
+        return RasterDataset(out_ds)
+
     @pygdal_config.log_operation
     def SplitBands(self, **kwargs):
         fname = kwargs.pop('fname')
@@ -259,30 +554,93 @@ class RasterDataset(Raster):
 
     @pygdal_config.log_operation
     def Cogify(self, profile=DefaultCOG, **kwargs):
+        """
+        Create a cloud optimized GeoTIFF of the raster.
+        :param profile: COG profile class, or an already resolved profile bound to this raster.
+        """
 
         class InvalidCOGException(Exception):
             pass
 
         fname = os.path.splitext(kwargs.pop('fname'))[0] + '.tif'
-        profile = profile(self)
+        profile = resolve(profile, self)
 
         #Transcoding
         temp_fname = '/vsimem/transcode/{}.tif'.format(str(uuid.uuid4().hex))
         gdal.Translate(temp_fname, self.ds, creationOptions=profile.creation_options())
 
-        #Build overviews
+        #Build overviews, each level from the previous one
         transcoded = gdal.Open(temp_fname)
-        profile.overview_opts()
-        transcoded.BuildOverviews(profile.resample, profile.overviews())
+        with pygdal_config.scope(profile.overview_opts()):
+            overviews.build_overviews(transcoded, profile.overviews(), profile.overview_resampling())
 
         #Create COG
         gdal.Translate(fname, transcoded, creationOptions=profile.creation_options()+['COPY_SRC_OVERVIEWS=YES'])
-        out_cog = gdal.Open(fname)
-        errors, details = validate(out_cog)
+        errors, details = structure.validate_structure(fname, cache=None)
         if len(errors) == 0:
-            return RasterDataset(out_cog)
+            out_cog = RasterDataset(gdal.Open(fname))
+            #Keep the resolved profile so adaptive decisions (see ProfilingCOG) can be inspected
+            out_cog.profile = profile
+            return out_cog
         raise InvalidCOGException("The COG has the following errors: {}".format(errors))
 
+    @pygdal_config.log_operation
+    def TileCopy(self, bbox, profile=DefaultCOG, band=None, source=None, **kwargs):
+        """
+        Create a COG of a bounding box of form (xmin, xmax, ymin, ymax) by copying the compressed tiles (and overview
+        tiles) of the source, without decoding them.  Only possible when the source is a tiled GeoTIFF whose tiling,
+        compression, predictor and overviews match `profile` and the bounding box starts on a tile boundary.
+        :param band: Copy a single band (1-indexed) instead of all bands.
+        :param profile: COG profile class, or a profile already resolved (ex. once per scene) which is bound to the
+                        window instead of being resolved again.
+        :param source: Optional cognition.cog.tiff.TiffFile of this dataset's file, so the structure of a source cut
+                       into many COGs is parsed once.
+        :return: RasterDataset of the new COG, or None if the tiles can't be copied or the result isn't a valid COG
+                 (use BboxClip and Cogify instead).
+        """
+        fname = os.path.splitext(kwargs.pop('fname'))[0] + '.tif'
+        if self.rotated or self.ds.GetDriver().ShortName != 'GTiff':
+            return None
+        window = self.pixel_window(bbox)
+
+        reader = None
+        try:
+            if source is None:
+                reader = tiff.VSIReader(self.filename)
+                source = tiff.TiffFile(reader.read)
+            #Reject unaligned windows before resolving the profile, which may be costly (ex. ProfilingCOG)
+            main, _ = source.images()
+            if not main.tiled or window[0] % main.first(tiff.TILE_WIDTH) or window[1] % main.first(tiff.TILE_LENGTH):
+                return None
+
+            #Resolve the profile against a lightweight view of the output so it makes the same decisions as Cogify
+            view_fname = '/vsimem/tilecopy/{}.vrt'.format(uuid.uuid4().hex)
+            view = gdal.Translate(view_fname, self.ds, format='VRT', srcWin=window, bandList=[band] if band else None)
+            try:
+                profile = resolve(profile, RasterDataset(view))
+                factors = profile.overviews()
+            finally:
+                view = None
+                gdal.Unlink(view_fname)
+
+            compression = profile.full_resolution_compression()
+            plan = tiff.plan_tile_copy(source, window, factors, profile.blocksize, compression,
+                                       profile.predictor if compression else None, band=band)
+            if not plan:
+                return None
+            tiff.copy_tiles(source, plan, fname, band=band)
+        except tiff.TiffError:
+            return None
+        finally:
+            if reader:
+                reader.close()
+
+        errors, details = structure.validate_structure(fname, cache=None)
+        if errors:
+            gdal.Unlink(fname)
+            return None
+        return RasterDataset(gdal.Open(fname))
+
 class ClipHandler(object):
 
     def __init__(self, vrt_filepath_list):
@@ -322,6 +680,24 @@ def _save(package, out_dir):
     ds.Save(os.path.join(out_dir, ds.name))
 
 
+def _read_window(ds, window, bands, buf=None):
+    xoff, yoff, xsize, ysize = window
+    if buf is None:
+        buf = np.empty((len(bands), ysize, xsize), dtype=_bands_dtype(ds, bands))
+    else:
+        buf = buf[:len(bands), :ysize, :xsize]
+    for idx, band in enumerate(bands):
+        ds.GetRasterBand(band).ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=buf[idx])
+    return buf
+
+def _bands_dtype(ds, bands):
+    """NumPy dtype all of `bands` can be read into without loss (ex. Float32 for a Byte and a Float32 band)"""
+    return np.result_type(*[gdal_array.GDALTypeCodeToNumericTypeCode(ds.GetRasterBand(b).DataType) for b in bands])
+
+def _window_view(array, window):
+    xoff, yoff, xsize, ysize = window
+    return array[:, yoff:yoff+ysize, xoff:xoff+xsize]
+
 def _embed(vrt_path, pixel_func, bands, **kwargs):
     ds = RasterDataset(gdal.Open(vrt_path))
     fname = ds.EmbedFunction(pixel_func, bands, **kwargs)
@@ -1,31 +1,104 @@
 from osgeo import gdal, ogr
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 
 from cognition.pygdal.config import pygdal_config
+from cognition.pygdal.geometry import isRectangle
 
-def clip_wrapper(raster_data, vector_data, srs, **gdalwarp_opts):
-    clip_list = []
+def clip_wrapper(raster_data, vector_data, srs, fids=None, workers=1, batch_size=32, **gdalwarp_opts):
+    """
+    Clip the raster by every feature of the layer, or only by the features in `fids` when passed.
+
+    Features which are axis aligned rectangles in the raster's CRS (ex. grid cells) are clipped with a pixel window,
+    which avoids the warper entirely, unless extra gdal.Warp options are passed.  All other cutlines are written once
+    to a single in-memory layer which gdal.Warp selects from by FID.  Features are clipped in batches of `batch_size`
+    across `workers` threads, or in the calling thread when the raster can't be reopened by name (ex. MEM datasets),
+    as GDAL dataset handles can't be shared across threads.
+    """
     lyr = vector_data.GetLayer()
-    for feat in lyr:
-        clip = Clip(raster_data, feat, srs, **gdalwarp_opts)
-        clip_list.append(clip)
-    return clip_list
-
-def create_clipper(geom, srs):
-    fname = pygdal_config.tempfiles.gen_file('shp', 'clippers', str(uuid.uuid4().hex))
-    out_ds = ogr.GetDriverByName('ESRI Shapefile').CreateDataSource(fname)
-    out_lyr = out_ds.CreateLayer(fname, srs)
-    out_feat = ogr.Feature(out_lyr.GetLayerDefn())
-    out_feat.SetGeometry(geom)
-    out_lyr.CreateFeature(out_feat)
+    if fids is None:
+        features = lyr
+    else:
+        features = (lyr.GetFeature(int(fid)) for fid in fids)
+    lyr_srs = lyr.GetSpatialRef()
+    window_clip = not gdalwarp_opts and not raster_data.rotated and (lyr_srs is None or srs.IsSame(lyr_srs))
+
+    jobs = []
+    cutline_features = []
+    for feat in features:
+        geom = feat.GetGeometryRef()
+        if window_clip and isRectangle(geom):
+            jobs.append(('window', geom.GetEnvelope()))
+        else:
+            jobs.append(('cutline', len(cutline_features)))
+            cutline_features.append(feat)
+    cutline = None
+    if cutline_features:
+        #The features keep the vector's CRS, gdal.Warp transforms the cutline to the raster's
+        cutline, layer_name, cutline_fids = create_cutline_layer(cutline_features, lyr_srs or srs)
+    if _source(raster_data) is raster_data.ds:
+        workers = 1
+
+    def run(batch):
+        out = []
+        for kind, value in batch:
+            if kind == 'window':
+                out.append(WindowClip(raster_data, value))
+            else:
+                out.append(Clip(raster_data, cutline, layer_name, cutline_fids[value], **gdalwarp_opts))
+        return out
+
+    batches = [jobs[i:i+batch_size] for i in range(0, len(jobs), batch_size)]
+    try:
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(pygdal_config.bind(run), batches))
+        else:
+            results = [run(batch) for batch in batches]
+    finally:
+        #Warped VRTs embed their cutline, so the shared layer is no longer needed
+        if cutline:
+            gdal.Unlink(cutline)
+    return [clip for batch in results for clip in batch]
+
+def create_cutline_layer(features, srs):
+    """
+    Write the geometry of each feature to one GeoPackage layer (in /vsimem/ unless TEMP_SAVE points to disk).
+    :return: Tuple of (datasource path, layer name, list of FIDs in the cutline layer)
+    """
+    layer_name = 'cutlines'
+    fname = pygdal_config.tempfiles.gen_file('gpkg', 'clippers', str(uuid.uuid4().hex))
+    out_ds = ogr.GetDriverByName('GPKG').CreateDataSource(fname)
+    out_lyr = out_ds.CreateLayer(layer_name, srs, ogr.wkbUnknown)
+    defn = out_lyr.GetLayerDefn()
+    fids = []
+    out_lyr.StartTransaction()
+    for feat in features:
+        out_feat = ogr.Feature(defn)
+        out_feat.SetGeometry(feat.GetGeometryRef())
+        out_lyr.CreateFeature(out_feat)
+        fids.append(out_feat.GetFID())
+    out_lyr.CommitTransaction()
     out_lyr = None
     out_ds = None
-    return fname
+    return fname, layer_name, fids
 
 @pygdal_config.log_operation
-def Clip(raster_data, feat, srs, **gdalwarp_opts):
+def Clip(raster_data, cutline, layer_name, fid, **gdalwarp_opts):
     fname = gdalwarp_opts.pop('fname')
-    geom = feat.GetGeometryRef()
-    clipper = create_clipper(geom, srs)
-    gdal.Warp(fname, raster_data.ds, cutlineDSName=clipper, cropToCutline=True, format='VRT', **gdalwarp_opts)
-    return fname
\ No newline at end of file
+    gdal.Warp(fname, _source(raster_data), cutlineDSName=cutline, cutlineLayer=layer_name,
+              cutlineWhere='fid = {}'.format(fid), cropToCutline=True, format='VRT', **gdalwarp_opts)
+    return fname
+
+@pygdal_config.log_operation
+def WindowClip(raster_data, bbox, **kwargs):
+    """Clip to a bounding box with a pixel window instead of the warper, for rectangles in the raster's CRS"""
+    fname = kwargs.pop('fname')
+    gdal.Translate(fname, _source(raster_data), srcWin=raster_data.pixel_window(bbox), format='VRT')
+    return fname
+
+def _source(raster_data):
+    """Open the source by name when possible so concurrent clips do not share a dataset handle"""
+    if raster_data.filename and raster_data.ds.GetDriver().ShortName != 'MEM':
+        return raster_data.filename
+    return raster_data.ds
@@ -1,6 +1,8 @@
 import uuid
+import os
 
 from cognition.pygdal.projection import SpatialRef
+from cognition.index.strtree import STRtree
 
 class Vector(object):
 
@@ -13,6 +15,7 @@ class Vector(object):
             self.id = str(uuid.uuid4().hex)
         else:
             self.id = id
+        self._sindex = None
 
     @property
     def features(self):
@@ -30,4 +33,37 @@ class Vector(object):
 
     @property
     def fcount(self):
-        return self.lyr.GetFeatureCount()
\ No newline at end of file
+        return self.lyr.GetFeatureCount()
+
+    @property
+    def index_path(self):
+        """Location of the persisted spatial index, next to the data"""
+        return self.ds.GetDescription() + '.strtree.npz'
+
+    def spatial_index(self, persist=False):
+        """
+        Packed STR-tree over the feature envelopes, queries return feature ids.  The tree is built once per Vector.
+        :param persist: Save the tree next to the data (or load it from there if it is newer than the data).  Only
+                        applies to vector data stored on the local filesystem.
+        """
+        if self._sindex is not None:
+            return self._sindex
+        source = self.ds.GetDescription()
+        on_disk = persist and os.path.exists(source)
+        if on_disk and os.path.exists(self.index_path) and os.path.getmtime(self.index_path) >= os.path.getmtime(source):
+            self._sindex = STRtree.load(self.index_path)
+            return self._sindex
+
+        fids = []
+        bounds = []
+        for feat in self.features:
+            geom = feat.GetGeometryRef()
+            if geom is None:
+                continue
+            fids.append(feat.GetFID())
+            bounds.append(geom.GetEnvelope())
+        self.lyr.ResetReading()
+        self._sindex = STRtree(bounds, fids)
+        if on_disk:
+            self._sindex.save(self.index_path)
+        return self._sindex
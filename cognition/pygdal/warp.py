@@ -0,0 +1,96 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from osgeo import gdal
+
+from cognition.pygdal.config import pygdal_config
+
+
+class WarpBase(object):
+
+    """Base class for creating warp profiles, which control the performance of RasterDataset.Reproject"""
+
+    def __init__(self, ds):
+        self.ds = ds
+
+        #Warper settings
+        self.resample = 'near'
+        self.multithread = True
+        self.num_threads = 'ALL_CPUS'
+        self.warp_memory = 512 #Megabytes
+        self.error_threshold = 0.125 #Pixels, 0 uses the exact transformer
+        self.target_aligned_pixels = False
+        self.config = {} #GDAL configuration options applied to the calling thread and the materialization workers
+
+        #Materialization settings
+        self.chunksize = 1024 #Pixels, rounded to a multiple of the block size
+        self.workers = os.cpu_count() or 1
+        self.blocksize = 512
+        self.compression = None
+
+    def warp_options(self, materialize=False):
+        """
+        Keyword arguments passed to gdal.Warp.
+        :param materialize: The warp is materialized by `workers` concurrent threads, each warping with one thread
+                            and its share of the warp memory so they don't oversubscribe CPUs and memory.
+        """
+        multithread, num_threads, warp_memory = self.multithread, self.num_threads, self.warp_memory
+        if materialize and self.workers > 1:
+            multithread, num_threads = False, 1
+            warp_memory = max(1, warp_memory // self.workers)
+        return {'resampleAlg': self.resample,
+                'multithread': multithread,
+                'warpMemoryLimit': warp_memory * 1024 * 1024,
+                'errorThreshold': self.error_threshold,
+                'warpOptions': ['NUM_THREADS={}'.format(num_threads)]}
+
+    def creation_options(self):
+        """Creation options of the tiled GeoTIFF written when materializing"""
+        opts = ['TILED=YES', 'BIGTIFF=IF_SAFER',
+                'BLOCKXSIZE={}'.format(self.blocksize), 'BLOCKYSIZE={}'.format(self.blocksize)]
+        if self.compression:
+            opts.append('COMPRESS={}'.format(self.compression))
+        return opts
+
+
+class DefaultWarp(WarpBase):
+
+    def __init__(self, ds):
+        WarpBase.__init__(self, ds)
+
+
+def materialize(vrt_fname, out_fname, profile):
+    """
+    Write a warped VRT to a tiled GeoTIFF.  The output is split into chunks aligned to its tiles which are warped
+    concurrently, each thread reading through its own handle on the VRT; writes are serialized.
+    """
+    vrt = gdal.Open(vrt_fname)
+    xsize, ysize, count = vrt.RasterXSize, vrt.RasterYSize, vrt.RasterCount
+    out_ds = gdal.GetDriverByName('GTiff').Create(out_fname, xsize, ysize, count,
+                                                  vrt.GetRasterBand(1).DataType,
+                                                  options=profile.creation_options())
+    out_ds.SetGeoTransform(vrt.GetGeoTransform())
+    out_ds.SetProjection(vrt.GetProjection())
+    for i in range(count):
+        nodata = vrt.GetRasterBand(i+1).GetNoDataValue()
+        if nodata is not None:
+            out_ds.GetRasterBand(i+1).SetNoDataValue(nodata)
+    vrt = None
+
+    chunk = max(profile.blocksize, profile.chunksize // profile.blocksize * profile.blocksize)
+    windows = [(xoff, yoff, min(chunk, xsize - xoff), min(chunk, ysize - yoff))
+               for yoff in range(0, ysize, chunk) for xoff in range(0, xsize, chunk)]
+    local = threading.local()
+    lock = threading.Lock()
+
+    def warp_chunk(window):
+        if not hasattr(local, 'ds'):
+            local.ds = gdal.Open(vrt_fname)
+        data = local.ds.ReadRaster(*window)
+        with lock:
+            out_ds.WriteRaster(window[0], window[1], window[2], window[3], data)
+
+    with ThreadPoolExecutor(max_workers=profile.workers) as executor:
+        list(executor.map(pygdal_config.bind(warp_chunk), windows))
+    out_ds.FlushCache()
+    return out_ds